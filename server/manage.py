@@ -39,7 +39,58 @@ def passwd(username, password):
 def useradd(username, password):
     " Add a user to the model "
     import project.model as model
-    model.create_user(username, password)
+    if model.create_user(username, password) is None:
+        app.logger.warning('Cannot create user: %s', username)
+
+
+@app.cli.command()
+def ensure_indexes():
+    " Create the indexes of the model, if they do not exist "
+    import project.model as model
+    if not model.ensure_indexes():
+        app.logger.warning('Some indexes could not be created')
+
+
+@app.cli.command()
+def index_report():
+    " Report missing, unused and undeclared indexes "
+    import project.model as model
+    for collection_name, report in model.index_report().items():
+        print('{}:'.format(collection_name))
+        print('  missing: {}'.format(', '.join(report['missing']) or '-'))
+        if report['unused'] is None:
+            print('  unused: (no index statistics)')
+        else:
+            print('  unused: {}'.format(', '.join(report['unused']) or '-'))
+        print('  undeclared: {}'.format(', '.join(report['undeclared']) or '-'))
+
+
+@app.cli.command()
+def backfill_owners():
+    " Set the owner and visibility of groups, checklists and items created by older versions "
+    import project.model as model
+    app.logger.info('Groups updated: %s', model.backfill_owners())
+
+
+@app.cli.command()
+@click.option('--once', is_flag=True, help='Exit when there are no more jobs')
+def worker(once):
+    " Run the jobs in the queue "
+    import project.jobs as jobs
+    app.logger.info('Jobs run: %s', jobs.work(once=once))
+
+
+@app.cli.command()
+@click.option('--items', default=100000, help='Number of items')
+@click.option('--checklists', default=10, help='Number of checklists')
+@click.option('--storage', default='memory', help='Storage backend: memory, sqlite or mongo')
+def benchmark(items, checklists, storage):
+    " Measure the model with a synthetic user with many items "
+    import project.benchmark
+    app.config['STORAGE_BACKEND'] = storage
+    project.model.configure_model(app)
+    for name, seconds in project.benchmark.run(items=items, checklists=checklists):
+        print('{:<24} {:8.3f} s'.format(name, seconds))
 
 
 @app.cli.command()
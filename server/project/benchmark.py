@@ -0,0 +1,72 @@
+""" A synthetic benchmark of the model, with a user that has many items.
+
+Run it with `flask benchmark`. It uses the storage in STORAGE_BACKEND: by default, the
+benchmark command replaces it with the memory storage, so it needs no database.
+"""
+
+import datetime
+import time
+import project.model as model
+
+# items in each bulk operation, as a client would send them
+BULK_SIZE = 1000
+
+
+def _timed(timings, name, function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    timings.append((name, time.perf_counter() - start))
+    return result
+
+
+def run(items=100000, checklists=10):
+    """ Creates a user with several checklists and items, and measures the most common operations.
+
+    The model must be configured. The user is removed at the end.
+
+    Args:
+        items (int): total number of items
+        checklists (int): number of checklists. The items are split among them
+
+    Returns:
+        A list of (name of the operation, seconds) """
+    timings = []
+    today = datetime.date.today()
+    user = model.create_user('benchmark-{}'.format(time.time()))
+    group = user.create_child({'name': 'GROUP'})
+    created = [group.create_child({'name': 'CHECKLIST{}'.format(i), 'order': i}) for i in range(checklists)]
+
+    def create_items():
+        for index, checklist in enumerate(created):
+            count = items // checklists + (1 if index < items % checklists else 0)
+            for start in range(0, count, BULK_SIZE):
+                model.bulk_items(checklist, [
+                    {'op': 'create', 'item': {
+                        'name': 'ITEM{}'.format(number), 'checked': number % 3 == 0,
+                        'due_date': (today + datetime.timedelta(days=number % 30)).isoformat(),
+                        'done_date': today.isoformat() if number % 3 == 0 else ''}}
+                    for number in range(start, min(count, start + BULK_SIZE))])
+
+    _timed(timings, 'create items', create_items)
+    checklist = created[0]
+    item_ids = [item['_id'] for item in checklist.info.get('items', [])]
+
+    _timed(timings, 'available checklists', lambda: list(model.available_checklists(group.id())))
+    _timed(timings, 'load a checklist', lambda: list(model.iter_documents(model.Item, item_ids)))
+    _timed(timings, 'user tree', model.user_tree, user.id())
+    to_date = (today + datetime.timedelta(days=7)).isoformat()
+    _timed(timings, 'today', lambda: list(model.checklist_items(
+        user.id(), {'checked': {'$not': {'$eq': True}}, 'due_date': {'$gt': '', '$lt': to_date}})))
+    _timed(timings, 'history', lambda: list(model.checklist_items(
+        user.id(), {'checked': True, 'done_date': {'$gte': today.isoformat()}})))
+    _timed(timings, 'sync', model.sync, user.id(), limit=items)
+    _timed(timings, 'check items', model.check_items, checklist)
+    _timed(timings, 'shift due dates', model.shift_due_dates, checklist, 1)
+    _timed(timings, 'duplicate a checklist', model.duplicate_checklist, checklist)
+    _timed(timings, 'delete a checklist', model.delete_checklist, checklist)
+
+    for checklist in model.available_checklists(group.id()):
+        model.delete_checklist(model.Checklist(checklist['_id']))
+    group.delete()
+    user.delete()
+    return timings
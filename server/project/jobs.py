@@ -0,0 +1,183 @@
+""" A queue of jobs in the storage of the model, for operations too long for a request.
+
+Views enqueue a job and return at once. Workers, started with `flask worker`, claim the
+jobs one by one and run them in batches. A claimed job has a lease: if the worker dies,
+another worker claims the job again when the lease expires, so handlers must be safe
+to run again after a partial run. A job fails after max_attempts runs, also if the workers die.
+"""
+
+import datetime
+import logging
+import os
+import socket
+import time
+import pymongo
+import project.model as model
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# job kind -> function(params, progress). See handler()
+_handlers = dict()
+
+batch_size = 500
+lease = 60
+max_attempts = 3
+
+
+def configure(config):
+    """ Configures the jobs from a Flask configuration.
+
+    JOBS_BATCH_SIZE is the number of documents a job writes at once.
+    JOBS_LEASE is the number of seconds a worker owns a job without reporting progress.
+    JOBS_MAX_ATTEMPTS is the number of times a job runs before it fails. """
+    global batch_size, lease, max_attempts
+    batch_size = config.get('JOBS_BATCH_SIZE', 500)
+    lease = config.get('JOBS_LEASE', 60)
+    max_attempts = config.get('JOBS_MAX_ATTEMPTS', 3)
+
+
+def handler(kind):
+    """ A decorator to register the function that runs a kind of job.
+
+    The function gets the parameters of the job and a function progress(**info), that saves
+    information about the progress and extends the lease of the job. It returns the result of the job. """
+    def register(function):
+        _handlers[kind] = function
+        return function
+    return register
+
+
+def enqueue(kind, params, owner_id):
+    """ Adds a job to the queue.
+
+    Args:
+        kind (str): the kind of job. There must be a handler for it
+        params (dict): the parameters of the job
+        owner_id: the user that can see the job
+
+    Returns:
+        The identifier of the job """
+    if kind not in _handlers:
+        raise ValueError('Unknown kind of job: {}'.format(kind))
+    now = model._now()
+    job = dict(
+        _id=ObjectId(), kind=kind, params=params, owner_id=ObjectId(owner_id), status=QUEUED,
+        attempts=0, created_at=now, updated_at=now)
+    model.storage.insert('jobs', [job])
+    return job['_id']
+
+
+def get_job(job_id):
+    """ Returns the document of a job, or None if it doesn't exist """
+    try:
+        return model.storage.find_one('jobs', {'_id': ObjectId(job_id)})
+    except (InvalidId, TypeError):
+        return None
+
+
+def claim(worker_id):
+    """ Claims the oldest job in the queue, or a job whose lease expired.
+
+    Jobs whose lease expired after the last attempt are marked as failed.
+
+    Returns:
+        The document of the job, or None if there are no jobs """
+    now = model._now()
+    model.storage.update(
+        'jobs', {'status': RUNNING, 'lease_until': {'$lt': now}, 'attempts': {'$gte': max_attempts}},
+        {'$set': {'status': FAILED, 'error': 'The lease expired in the last attempt', 'updated_at': now},
+         '$unset': {'lease_until': ''}},
+        multi=True)
+    return model.storage.find_and_update(
+        'jobs', {'$or': [
+            {'status': QUEUED},
+            {'status': RUNNING, 'lease_until': {'$lt': now}, 'attempts': {'$lt': max_attempts}}]},
+        {'$set': {'status': RUNNING, 'worker': worker_id, 'lease_until': now + datetime.timedelta(seconds=lease),
+                  'updated_at': now},
+         '$inc': {'attempts': 1}},
+        sort=[('created_at', pymongo.ASCENDING)])
+
+
+def run(job):
+    """ Runs a claimed job and saves its result """
+    def progress(**info):
+        now = model._now()
+        model.storage.update('jobs', {'_id': job['_id']}, {'$set': {
+            'progress': info, 'lease_until': now + datetime.timedelta(seconds=lease), 'updated_at': now}})
+
+    try:
+        result = _handlers[job['kind']](job['params'], progress)
+    except Exception as exc:
+        logger.exception('Job %s failed', job['_id'])
+        status = FAILED if job['attempts'] >= max_attempts else QUEUED
+        model.storage.update('jobs', {'_id': job['_id']}, {'$set': {
+            'status': status, 'error': str(exc), 'updated_at': model._now()}})
+        return False
+    now = model._now()
+    model.storage.update('jobs', {'_id': job['_id']}, {
+        '$set': {'status': DONE, 'result': result, 'updated_at': now, 'finished_at': now},
+        '$unset': {'error': '', 'lease_until': ''}})
+    return True
+
+
+def work(once=False, poll=1.0):
+    """ Runs jobs from the queue.
+
+    Args:
+        once (bool): if True, returns when the queue is empty. Else, runs forever
+        poll (float): seconds to wait when the queue is empty
+
+    Returns:
+        The number of jobs run """
+    worker_id = '{}:{}'.format(socket.gethostname(), os.getpid())
+    count = 0
+    while True:
+        job = claim(worker_id)
+        if job is None:
+            if once:
+                return count
+            time.sleep(poll)
+            continue
+        run(job)
+        count += 1
+
+
+# --------------------------------------- Handlers
+
+
+@handler('delete_checklist')
+def delete_checklist(params, progress):
+    """ Deletes a checklist, and then its items in batches """
+    checklist_id = ObjectId(params['checklist_id'])
+    info = model.storage.find_one('checklists', {'_id': checklist_id})
+    if info is not None:
+        return dict(items=model.delete_checklist(
+            model.Checklist(checklist_id, info=info), batch_size=batch_size,
+            progress=lambda deleted: progress(items=deleted)))
+    # a previous attempt deleted the checklist: delete the remaining items
+    return dict(items=model.delete_items(
+        {'parentid': checklist_id}, ObjectId(params['owner_id']), params.get('private', True),
+        batch_size=batch_size, progress=lambda deleted: progress(items=deleted)))
+
+
+@handler('duplicate_checklist')
+def duplicate_checklist(params, progress):
+    """ Duplicates a checklist in batches. The new checklist is visible only when all its items are copied """
+    new_id = ObjectId(params['new_id'])
+    if model.storage.find_one('checklists', {'_id': new_id}, {'_id': 1}) is not None:
+        # a previous attempt finished, but it was not marked as done
+        return dict(_id=str(new_id))
+    info = model.storage.find_one('checklists', {'_id': ObjectId(params['checklist_id'])})
+    if info is None:
+        raise ValueError('Checklist not found: {}'.format(params['checklist_id']))
+    model.duplicate_checklist(
+        model.Checklist(info['_id'], info=info), new_id=new_id, batch_size=batch_size,
+        progress=lambda copied: progress(items=copied))
+    return dict(_id=str(new_id))
@@ -1,19 +1,83 @@
 #!/usr/bin/env python3
 
+import base64
+import contextlib
+import datetime
+import json
 import logging
-import bcrypt
+import flask
 import pymongo
+import project.server.events as events
+import project.server.invalidations as invalidations
+import project.server.passwords as passwords
+import project.storage
 from bson.objectid import ObjectId
 from bson.errors import InvalidId
+from project.server.cache import LRUCache
+from project.storage import StorageError, StorageUnavailable, DuplicateKeyError, BulkWriteError, query
 
 
 logger = logging.getLogger(__name__)
 PASSWORD_FIELDNAME = 'password_hash'
 
-# The Flask app must change this to the real path
+# The Flask app must change this to the real storage. See project.storage
+storage = None
+# the pymongo client and database, if the storage is MongoDB
 client = None
 db = None
 
+# fields maintained by the model in every document. Users cannot set them
+MANAGED_FIELDS = ('version', 'updated_at')
+# deleted elements are remembered this number of days, for clients that sync their changes
+TOMBSTONE_DAYS = 90
+
+# documents of these collections are cached between requests. See search_element()
+CACHED_COLLECTIONS = ('groups', 'checklists')
+# (collection name, _id) -> document
+element_cache = LRUCache()
+# incremented by every invalidation: a document read before an invalidation is not cached
+_cache_generation = 0
+# the cache is only used while every process invalidates it. See project.server.invalidations
+_cache_enabled = False
+
+# The indexes the model needs, by collection. Each index is a dictionary with the
+# keys and name of the index, and any other option accepted by create_index()
+INDEXES = {
+    'users': [
+        # users that are being created have no name yet: only check unique names
+        dict(keys=[('name', pymongo.ASCENDING)], name='name', unique=True,
+             partialFilterExpression={'name': {'$type': 'string'}}),
+    ],
+    'groups': [
+        dict(keys=[('parentid', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)], name='parentid_id'),
+        dict(keys=[('owner_id', pymongo.ASCENDING), ('updated_at', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)], name='owner_id_updated_at_id'),
+        dict(keys=[('private', pymongo.ASCENDING), ('updated_at', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)], name='private_updated_at_id'),
+    ],
+    'checklists': [
+        dict(keys=[('parentid', pymongo.ASCENDING), ('order', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)], name='parentid_order_id'),
+        dict(keys=[('owner_id', pymongo.ASCENDING), ('updated_at', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)], name='owner_id_updated_at_id'),
+        dict(keys=[('private', pymongo.ASCENDING), ('updated_at', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)], name='private_updated_at_id'),
+    ],
+    'items': [
+        dict(keys=[('parentid', pymongo.ASCENDING), ('checked', pymongo.ASCENDING), ('due_date', pymongo.ASCENDING)], name='parentid_checked_due_date'),
+        # the items of a user for the special checklists today and history. See checklist_items()
+        dict(keys=[('owner_id', pymongo.ASCENDING), ('checked', pymongo.ASCENDING), ('due_date', pymongo.ASCENDING)], name='owner_id_checked_due_date'),
+        dict(keys=[('owner_id', pymongo.ASCENDING), ('checked', pymongo.ASCENDING), ('done_date', pymongo.ASCENDING)], name='owner_id_checked_done_date'),
+        dict(keys=[('owner_id', pymongo.ASCENDING), ('updated_at', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)], name='owner_id_updated_at_id'),
+        dict(keys=[('private', pymongo.ASCENDING), ('updated_at', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)], name='private_updated_at_id'),
+    ],
+    'tombstones': [
+        dict(keys=[('owner_id', pymongo.ASCENDING), ('updated_at', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)], name='owner_id_updated_at_id'),
+        dict(keys=[('private', pymongo.ASCENDING), ('updated_at', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)], name='private_updated_at_id'),
+        dict(keys=[('updated_at', pymongo.ASCENDING)], name='updated_at', expireAfterSeconds=TOMBSTONE_DAYS * 24 * 60 * 60),
+    ],
+    'jobs': [
+        dict(keys=[('status', pymongo.ASCENDING), ('created_at', pymongo.ASCENDING)], name='status_created_at'),
+        # finished jobs are removed after a week
+        dict(keys=[('finished_at', pymongo.ASCENDING)], name='finished_at', expireAfterSeconds=7 * 24 * 60 * 60),
+    ]
+}
+
 
 def configure_model(app):
     """ Configures the model from a Flask app.
@@ -21,25 +85,321 @@ def configure_model(app):
     Attrs:
         :app (Flask): The Flask application to read the configuration from
     """
-    global logger, client, db
-    client = pymongo.MongoClient(app.config.get('MONGOURL'))
-    db = client[app.config.get('MONGODB', 'mytasks')]
+    global logger, storage, client, db, _cache_enabled
+    storage = project.storage.create_storage(app.config)
+    client = getattr(storage, 'client', None)
+    db = getattr(storage, 'db', None)
     logger = app.logger
+    passwords.configure(app.config)
+    events.configure(app.config, storage)
+    element_cache.maxsize = app.config.get('ELEMENT_CACHE_SIZE', 1024)
+    element_cache.ttl = app.config.get('ELEMENT_CACHE_TTL', 60)
+    element_cache.clear()
+    _cache_enabled = invalidations.configure(app.config, storage, _uncache, _uncache_all) and element_cache.maxsize > 0
+    if not _cache_enabled:
+        logger.info('Groups and checklists are not cached')
+    if storage.name != 'mongo':
+        # local storages need no server. With MongoDB, importing the app must not wait for the
+        # server: run `flask ensure-indexes` after each deployment
+        ensure_indexes()
+    app.before_request(reset_identity_map)
+    app.teardown_request(log_identity_map)
+
+
+@contextlib.contextmanager
+def transaction(enabled=True):
+    """ A context manager that returns a session with a transaction, or None if transactions are not used.
+
+    Pass the session to all the operations inside the transaction. If enabled is False, there is no transaction.
+    MongoDB uses transactions only if MONGO_TRANSACTIONS is set """
+    if not enabled:
+        yield None
+        return
+    with storage.transaction() as session:
+        yield session
+
+
+def reset_identity_map():
+    """ Starts a new, empty identity map for the current request.
+
+    The identity map keeps the elements loaded during a request, so each document
+    is read from the database only once. Outside requests there is no identity map. """
+    flask.g.identity_map = dict()
+    flask.g.identity_map_stats = dict(hits=0, misses=0)
+
+
+def identity_map_stats():
+    """ Returns a dictionary with the hits and misses of the identity map in the current request """
+    if not flask.has_request_context() or 'identity_map_stats' not in flask.g:
+        return dict(hits=0, misses=0)
+    return flask.g.identity_map_stats
+
+
+def log_identity_map(exc=None):
+    stats = identity_map_stats()
+    logger.debug('Identity map: %s hits, %s misses', stats['hits'], stats['misses'])
+
+
+def _identity_map():
+    """ Returns the identity map of the current request, or None """
+    if not flask.has_request_context():
+        return None
+    if 'identity_map' not in flask.g:
+        reset_identity_map()
+    return flask.g.identity_map
+
+
+def _remember(element):
+    """ Adds an element to the identity map of the current request, if any """
+    identity_map = _identity_map()
+    if identity_map is not None:
+        identity_map[(element.collection_name, element.id())] = element
+
+
+def _forget(element):
+    """ Removes an element from the identity map of the current request, if any """
+    identity_map = _identity_map()
+    if identity_map is not None:
+        identity_map.pop((element.collection_name, element.id()), None)
+
+
+def _uncache(collection_name, element_ids):
+    """ Removes documents from the cache of this process """
+    global _cache_generation
+    _cache_generation += 1
+    for _id in element_ids:
+        element_cache.delete((collection_name, _id))
+
+
+def _uncache_all():
+    """ Removes all documents from the cache of this process """
+    global _cache_generation
+    _cache_generation += 1
+    element_cache.clear()
+
+
+def invalidate(collection_name, element_ids):
+    """ Removes documents from the caches of all processes. Call it after changing the documents.
+
+    Attr:
+        collection_name: the name of the collection. Only documents in CACHED_COLLECTIONS are cached
+        element_ids: a list of ObjectId. None values are ignored """
+    element_ids = [_id for _id in element_ids if _id is not None]
+    if collection_name in CACHED_COLLECTIONS and element_ids:
+        invalidations.publish(collection_name, element_ids)
+
+
+def cache_enabled():
+    """ Returns True if this process can use the cache of documents now """
+    return _cache_enabled and invalidations.listen()
+
+
+def cache_stats():
+    """ Returns the counters of the cache of documents in this process """
+    return element_cache.stats()
+
+
+def _now():
+    """ Returns the current UTC time, with the precision of MongoDB dates """
+    now = datetime.datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def _bump(update=None):
+    """ Returns an update document that also increments the version and sets the update time of the documents.
+
+    The version of a document changes every time the document, or anything included in its
+    view, changes. For example, the version of a checklist changes when any of its items changes. """
+    update = dict(update or {})
+    update['$inc'] = {'version': 1}
+    update['$set'] = dict(update.get('$set', {}), updated_at=_now())
+    return update
+
+
+def _bump_stage():
+    """ The same as _bump(), as a stage of an update with an aggregation pipeline """
+    return {'$set': {'version': {'$add': [{'$ifNull': ['$version', 0]}, 1]}, 'updated_at': _now()}}
+
+
+def _bury(element_class, element_ids, owner_id, private=True, session=None):
+    """ Remembers that several elements of the same class were deleted, for clients that sync their changes,
+    and notifies the deletion to the clients listening to events """
+    if element_ids:
+        now = _now()
+        storage.insert('tombstones', [
+            dict(_id=ObjectId(), element_id=_id, collection=element_class.collection_name, owner_id=owner_id,
+                 private=private, updated_at=now)
+            for _id in element_ids], session=session)
+        events.notify(element_class.collection_name, element_ids, 'deleted', owner_id=owner_id, private=private)
+
+
+def _hide(element_class, element_ids, owner_id):
+    """ Remembers that several public elements of the same class became private, so the clients of
+    other users that sync their changes remove them. The owner does not receive these tombstones """
+    if element_ids:
+        now = _now()
+        storage.insert('tombstones', [
+            dict(_id=ObjectId(), element_id=_id, collection=element_class.collection_name, owner_id=owner_id,
+                 private=False, hidden=True, updated_at=now)
+            for _id in element_ids])
+
+
+def touch(element_class, element_ids, owner_id=None, private=True):
+    """ Increments the version of several elements of the same class, with a single update.
+
+    Attr:
+        element_class: the class of the elements. Currently: User, Group, Checklist, Item
+        element_ids: a list of ObjectId. None values are ignored
+        owner_id: the owner of the elements, to notify the change to the clients listening to events
+        private: if False, the change is notified to every client """
+    element_ids = [_id for _id in element_ids if _id is not None]
+    if element_ids:
+        storage.update(element_class.collection_name, {'_id': {'$in': element_ids}}, _bump(), multi=True)
+        invalidate(element_class.collection_name, element_ids)
+        events.notify(element_class.collection_name, element_ids, 'saved', owner_id=owner_id, private=private)
+
+
+def ensure_indexes():
+    """ Creates the indexes in INDEXES, if they do not exist yet.
+
+    Errors are logged. If the database cannot be reached, no more indexes are tried.
+
+    Returns:
+        True if all indexes were created """
+    success = True
+    for collection_name, indexes in INDEXES.items():
+        for index in indexes:
+            options = index.copy()
+            keys = options.pop('keys')
+            try:
+                storage.create_index(collection_name, keys, **options)
+            except StorageUnavailable as exc:
+                logger.error('Cannot create the indexes: %s', exc)
+                return False
+            except StorageError as exc:
+                logger.error('Cannot create index %s.%s: %s', collection_name, index['name'], exc)
+                success = False
+    return success
+
+
+def index_report():
+    """ Compares the indexes in the database with INDEXES.
+
+    Returns:
+        A dictionary collection_name: {'missing': [...], 'unused': [...], 'undeclared': [...]}, with names of indexes.
+        Declared indexes that do not exist are missing. Indexes in the database that were never used
+        since the server started are unused. Indexes in the database not in INDEXES are undeclared.
+        unused is None if the server does not provide index statistics.
+    """
+    report = dict()
+    for collection_name, indexes in INDEXES.items():
+        declared = [index['name'] for index in indexes]
+        existing = storage.index_names(collection_name)
+        report[collection_name] = dict(
+            missing=[name for name in declared if name not in existing],
+            unused=storage.unused_indexes(collection_name),
+            undeclared=[name for name in existing if name not in declared]
+        )
+    return report
+
+
+class TrackedDict(dict):
+    """ A dictionary that remembers the keys that were set or removed since the last call to reset_changes().
+
+    Only changes to the dictionary are tracked: if a value is a list or dictionary and it is
+    modified in place, assign it again to mark the key as changed. """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reset_changes()
+
+    def reset_changes(self):
+        self._changed = set()
+        self._removed = set()
+
+    def changes(self):
+        """ Returns a tuple (dict with the keys set and their values, set of removed keys) """
+        return {key: self[key] for key in self._changed}, set(self._removed)
+
+    def set_unchanged(self, key, value):
+        """ Sets a value that is already saved in the database """
+        super().__setitem__(key, value)
+        self._changed.discard(key)
+        self._removed.discard(key)
+
+    def _mark_changed(self, key):
+        self._changed.add(key)
+        self._removed.discard(key)
+
+    def _mark_removed(self, key):
+        self._removed.add(key)
+        self._changed.discard(key)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._mark_changed(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._mark_removed(key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *args):
+        if key in self:
+            self._mark_removed(key)
+        return super().pop(key, *args)
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._mark_removed(key)
+        return key, value
+
+    def clear(self):
+        for key in self:
+            self._mark_removed(key)
+        super().clear()
 
 
 class BaseElement(object):
-    def __init__(self, _id, collection=None, parent_class=None, children_class=None):
+    # fields that are inherited from the parent, and cannot be set by users
+    derived_fields = ('owner_id', 'private')
+
+    def __init__(self, _id, parent_class=None, children_class=None):
         """
 
         Args:
-            collection: a db.COLLECTION for this element
             parent_class: The BaseElement which contains this one, if any
             children_class: The BaseElement this element can contain, if any
         """
-        self.info = dict(_id=_id)
-        self._collection = collection
+        self.info = TrackedDict(_id=_id)
         self._parent_class = parent_class
         self._children_class = children_class
+        self._parent = None
+        self._saved = dict()
+        self._new = False
+
+    def _create(self, **defaults):
+        """ Initializes a new element. It is inserted in the database the first time it is saved """
+        self.info['_id'] = ObjectId()
+        self.info.update(defaults)
+        self._new = True
+
+    def _load(self, info):
+        """ Loads the information of the element from a document in the database """
+        self.info.update(info)
+        self.info.reset_changes()
+        self._set_saved()
+
+    def _set_saved(self):
+        """ Remembers the fields of the last saved version that affect the children of this element """
+        self._saved = {key: self.info.get(key) for key in ('parentid', 'owner_id', 'private')}
 
     def id(self):
         """ A convenience method to get the bson.objectid.ObjectId of this element """
@@ -56,21 +416,26 @@ class BaseElement(object):
         Only data intented that can be publicly accessed is returned. """
 
         return dict(
-            _id=str(self.id()),
+            _id=self.id(),
             name=self.info.get('name', ''),
             parentid=self.info.get('parentid', None)
         )
 
     def sane_info(self):
-        """ Returns an info object that can be serialized """
-        new_info = self.info.copy()
-        if '_id' in new_info:
-            new_info['_id'] = str(new_info['_id'])
-        if 'parentid' in new_info:
-            new_info['parentid'] = str(new_info['parentid'])
-        return new_info
-
-    def save(self):
+        """ Returns a copy of the info that views can change and serialize. See project.server.jsonprovider """
+        return dict(self.info)
+
+    def save(self, touch_parent=True):
+        """ Saves the element in the database.
+
+        New elements are inserted. For existing elements, only the fields that changed
+        since they were loaded or saved are updated.
+
+        Args:
+            touch_parent (bool): if False, the version of the parent is not incremented: the caller does it
+
+        Returns:
+            True if the element was saved """
         # before saving, make sure the identifiers are really identifiers
         try:
             if type(self.info['_id']) != ObjectId:
@@ -79,23 +444,115 @@ class BaseElement(object):
                 self.info['parentid'] = ObjectId(self.info['parentid'])
         except InvalidId:
             return False
-        self._collection.save(self.info)
+
+        # existing elements moved to a new parent inherit its owner and visibility
+        existing = self._saved.get('parentid') is not None
+        if existing and self.info.get('parentid') != self._saved['parentid']:
+            new_parent = self.parent(use_cached=False)
+            if new_parent is not None:
+                self.info.update(new_parent.inherited_info())
+
+        try:
+            if self._new:
+                self.info['version'] = 1
+                self.info['updated_at'] = _now()
+                storage.insert(self.collection_name, [dict(self.info)])
+                self._new = False
+            else:
+                changed, removed = self.info.changes()
+                changed.pop('_id', None)
+                update = dict()
+                if changed:
+                    update['$set'] = changed
+                if removed:
+                    update['$unset'] = {key: '' for key in removed}
+                if not update:
+                    return True
+                saved = storage.find_and_update(
+                    self.collection_name, {'_id': self.id()}, _bump(update), projection={'version': 1, 'updated_at': 1})
+                if saved is None:
+                    logger.warning('Cannot save %s: it does not exist', self.info['_id'])
+                    return False
+                self.info['version'] = saved['version']
+                self.info['updated_at'] = saved['updated_at']
+        except DuplicateKeyError as exc:
+            logger.warning('Cannot save %s: %s', self.info['_id'], exc)
+            return False
+        self.info.reset_changes()
+        invalidate(self.collection_name, [self.id()])
+        events.notify(self.collection_name, [self.id()], 'saved', owner_id=self.owner_id(),
+                      private=self.is_private(), parentid=self.info.get('parentid'))
+        if touch_parent:
+            self.touch_parent()
+
+        changed = existing and any(self.info.get(key) != self._saved.get(key) for key in ('owner_id', 'private'))
+        if existing and self._saved.get('private') is False and self.is_private():
+            _hide(type(self), [self.id()], self._saved.get('owner_id'))
+        self._set_saved()
+        if changed:
+            self.propagate_inherited()
         return True
 
+    def touch_parent(self):
+        """ Increments the version of the parent of this element, and of its previous parent if it moved """
+        if self._parent_class is not None:
+            parent_ids = {self.info.get('parentid'), self._saved.get('parentid')}
+            touch(self._parent_class, list(parent_ids), owner_id=self.owner_id(), private=self.is_private())
+
+    def owner_id(self):
+        """ Returns the identifier of the user that owns this element, or None if it has no owner """
+        if 'owner_id' in self.info:
+            return self.info['owner_id']
+        if self.info.get('parentid') is not None:
+            # old documents: search the owner in the parent
+            parent = self.parent()
+            if parent is not None:
+                return parent.owner_id()
+        return None
+
+    def is_private(self):
+        """ Returns True if only the owner can access this element """
+        if 'owner_id' in self.info:
+            return self.info.get('private', True)
+        if self.info.get('parentid') is not None:
+            # old documents: search the visibility in the parent
+            parent = self.parent()
+            if parent is not None:
+                return parent.is_private()
+        return False
+
+    def inherited_info(self):
+        """ Returns the fields that the children of this element inherit """
+        return dict(owner_id=self.owner_id(), private=self.is_private())
+
+    def propagate_inherited(self):
+        """ Updates the inherited fields in the children of this element """
+        pass
+
     def visible_by(self, user_id):
         """ Returns True if user_id is allowed to access the BaseElement """
-        if self.info.get('parentid') is not None:
-            return self.parent().visible_by(user_id)
-        return True
+        if 'owner_id' not in self.info and self.info.get('parentid') is not None:
+            # old documents: the parent decides
+            parent = self.parent()
+            return parent is not None and parent.visible_by(user_id)
+        owner_id = self.info.get('owner_id')
+        return owner_id is None or str(owner_id) == str(user_id) or not self.info.get('private', True)
 
     def editable_by(self, user_id):
         """ Returns True if the user_id is allowed to edit or remove this BaseElement """
-        if self.info.get('parentid') is not None:
-            return self.parent().editable_by(user_id)
-        return True
+        if 'owner_id' not in self.info and self.info.get('parentid') is not None:
+            # old documents: the parent decides
+            parent = self.parent()
+            return parent is not None and parent.editable_by(user_id)
+        owner_id = self.info.get('owner_id')
+        return owner_id is None or str(owner_id) == str(user_id)
 
     def delete(self):
-        self._collection.remove({'_id': self.id()})
+        storage.delete(self.collection_name, {'_id': self.id()})
+        invalidate(self.collection_name, [self.id()])
+        _bury(type(self), [self.id()], self.owner_id(), self.is_private())
+        _forget(self)
+        self.touch_parent()
         return True
 
     def create_child(self, info):
@@ -103,6 +560,14 @@ class BaseElement(object):
 
         If info includes an _id or a parentid, it is ignored
         """
+        new_child = self._new_child(info)
+        # saving the child increments the version of this element
+        new_child.save()
+        _remember(new_child)
+        return new_child
+
+    def _new_child(self, info):
+        """ Returns a new child of this element, that is not saved yet. See create_child() """
         if self._children_class is None:
             raise Exception('This element type cannot have children')
         new_child = self._children_class(None)
@@ -114,40 +579,52 @@ class BaseElement(object):
 
         # update the info and save
         new_child.update(new_info)
-        new_child.update({'parentid': self.id()})
-        new_child.save()
+        new_child.info['parentid'] = self.id()
+        new_child.info.update(self.inherited_info())
+        new_child._parent = self
         return new_child
 
     def parent(self, use_cached=True):
         """ Returns a BaseElement with the parent, if anyself.
 
         This method caches the first call to avoid requests to the database """
-        if use_cached and hasattr(self, '_parent') and self._parent is not None:
+        if use_cached and self._parent is not None:
             return self._parent
-        if 'parentid' not in self.info or not hasattr(self, '_parent_class'):
+        if 'parentid' not in self.info or self._parent_class is None:
             return None
-        return search_element(self._parent_class, self.info.get('parentid'))
+        self._parent = search_element(self._parent_class, self.info.get('parentid'))
+        return self._parent
 
     def update(self, new_info):
         """ Updates the information of this BaseElement.
 
-        Only information NOT starting with _ is updated. """
-        for key in new_info:
-            if not key.startswith('_'):
-                self.info[key] = new_info[key]
+        Only information NOT starting with _ and not derived from the parent is updated. """
+        self.info.update(self.writable_info(new_info))
+
+    @classmethod
+    def writable_info(cls, info):
+        """ Returns the fields in info that users can set: not starting with _ and not derived from the parent """
+        return {key: value for key, value in info.items()
+                if not key.startswith('_') and key not in cls.derived_fields and key not in MANAGED_FIELDS}
 
 
 class User(BaseElement):
-    def __init__(self, _id):
-        super().__init__(_id, collection=db.users, children_class=Group)
+    collection_name = 'users'
+
+    def __init__(self, _id, info=None):
+        super().__init__(_id, children_class=Group)
         if _id is None:
             # create a new user
-            _id = db.users.insert_one({}).inserted_id
+            self._create()
+            return
 
-        new_info = db.users.find_one({'_id': _id})
+        new_info = info if info is not None else storage.find_one(self.collection_name, {'_id': _id})
         if new_info is None:
             raise Exception('User not found: {}'.format(_id))
-        self.update(new_info)
+        self._load(new_info)
+
+    def inherited_info(self):
+        return dict(owner_id=self.id())
 
     def hash_password(self, password):
         """ Save a password hash in the user.
@@ -155,7 +632,7 @@ class User(BaseElement):
         Args:
             password (str): the password of the user. Only it hash is saved.
         """
-        self.info[PASSWORD_FIELDNAME] = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+        self.info[PASSWORD_FIELDNAME] = passwords.hashpw(password)
 
     def verify_password(self, password):
         """ Returns True if the password is verified.
@@ -163,7 +640,7 @@ class User(BaseElement):
         If the user does not have a password hash, it is never verified. """
         if PASSWORD_FIELDNAME in self.info:
             try:
-                return bcrypt.checkpw(password.encode(), self.info[PASSWORD_FIELDNAME].encode())
+                return passwords.checkpw(password, self.info[PASSWORD_FIELDNAME])
             except ValueError as exc:
                 logger.error(exc)
                 return False
@@ -173,117 +650,846 @@ class User(BaseElement):
 
 class Group(BaseElement):
     """ Groups are private unless explicitely configured as non private """
-    def __init__(self, _id):
-        super().__init__(_id, collection=db.groups, children_class=Checklist, parent_class=User)
+    collection_name = 'groups'
+    derived_fields = ('owner_id', )
+
+    def __init__(self, _id, info=None):
+        super().__init__(_id, children_class=Checklist, parent_class=User)
         if _id is None:
             # create a new group
-            _id = db.groups.insert_one({'private': True}).inserted_id
+            self._create(private=True)
+            return
 
-        new_info = db.groups.find_one({'_id': _id})
+        new_info = info if info is not None else storage.find_one(self.collection_name, {'_id': _id})
         if new_info is None:
             raise Exception('Group not found: {}'.format(_id))
-        self.update(new_info)
+        self._load(new_info)
 
     def summary(self):
         return super().summary().update({'private': self.info.get('private', True)})
 
+    def owner_id(self):
+        # the owner of a group is always its parent
+        return self.info.get('owner_id', self.info.get('parentid'))
+
+    def is_private(self):
+        return self.info.get('private', True)
+
+    def propagate_inherited(self):
+        """ Updates the owner and visibility of the checklists and items in this group """
+        inherited = self.inherited_info()
+        storage.update('checklists', {'parentid': self.id()}, _bump({'$set': inherited}), multi=True)
+        checklist_ids = storage.distinct('checklists', '_id', {'parentid': self.id()})
+        invalidate('checklists', checklist_ids)
+        if checklist_ids:
+            storage.update('items', {'parentid': {'$in': checklist_ids}}, _bump({'$set': inherited}), multi=True)
+
     def visible_by(self, user_id):
         """ Returns True if user_id is allowed to access the group """
-        my_user = self.parent()
-        assert my_user is not None
         # a user can access its own groups always
-        if str(user_id) == str(my_user.id()):
+        if str(user_id) == str(self.owner_id()):
             return True
         # a different user can access only to non private groups
-        return not self.info.get('private', True)
+        return not self.is_private()
 
     def editable_by(self, user_id):
         """ Returns True if the user_id is allowed to edit or remove this group """
         # only owners can edit or remove groups
-        my_user = self.parent()
-        assert my_user is not None
-        return str(my_user.id()) == str(user_id)
+        return str(self.owner_id()) == str(user_id)
 
 
 class Checklist(BaseElement):
-    def __init__(self, _id):
-        super().__init__(_id, collection=db.checklists, parent_class=Group, children_class=Item)
+    collection_name = 'checklists'
+
+    def __init__(self, _id, info=None):
+        super().__init__(_id, parent_class=Group, children_class=Item)
         if _id is None:
             # create a new checklist
-            _id = db.checklists.insert_one({}).inserted_id
+            self._create()
+            return
 
-        new_info = db.checklists.find_one({'_id': _id})
+        new_info = info if info is not None else storage.find_one(self.collection_name, {'_id': _id})
         if new_info is None:
             raise Exception('Checklist not found: {}'.format(_id))
-        self.update(new_info)
+        self._load(new_info)
+
+    def propagate_inherited(self):
+        """ Updates the owner and visibility of the items in this checklist """
+        if storage.update('items', {'parentid': self.id()}, _bump({'$set': self.inherited_info()}), multi=True).modified_count > 0:
+            touch(Checklist, [self.id()], owner_id=self.owner_id(), private=self.is_private())
 
     def delete_child(self, item_id):
-        if 'items' not in self.info:
-            return False
-        item_pos = -1
-        for i in range(0, len(self.info['items'])):
-            if str(self.info['items'][i]['_id']) == str(item_id):
-                item_pos = i
-                break
-        if item_pos == -1:
+        """ Removes an item from the items of this checklist. The item itself is not removed.
+
+        Returns:
+            True if the item was in this checklist """
+        if not detach_item(self.id(), item_id):
             return False
-        self.info['items'].pop(item_pos)
-        return self.save()
+        self.info.set_unchanged('items', [item for item in self.info.get('items', []) if str(item.get('_id')) != str(item_id)])
+        return True
 
-    def create_child(self, info):
-        child = super().create_child(info)
-        if 'items' not in self.info:
-            self.info['items'] = list([dict(_id=child.id())])
+    def create_child(self, info, position=None):
+        """ Creates a new item in this checklist.
+
+        Args:
+            info (dict): the information of the item
+            position (int): the position of the item in the checklist. If None, it is appended at the end """
+        child = self._new_child(info)
+        child.save(touch_parent=False)
+        _remember(child)
+        # add the item and increment the version of this checklist in a single update
+        push = {'$each': [dict(_id=child.id())]}
+        if position is not None:
+            push['$position'] = position
+        saved = storage.find_and_update(
+            self.collection_name, {'_id': self.id()}, _bump({'$push': {'items': push}}), projection={'version': 1, 'updated_at': 1})
+        invalidate(self.collection_name, [self.id()])
+        events.notify(self.collection_name, [self.id()], 'saved', owner_id=self.owner_id(), private=self.is_private())
+        if saved is not None:
+            self.info.set_unchanged('version', saved['version'])
+            self.info.set_unchanged('updated_at', saved['updated_at'])
+        items = list(self.info.get('items', []))
+        if position is None:
+            items.append(dict(_id=child.id()))
         else:
-            self.info['items'].append(dict(_id=child.id()))
-        self.save()
+            items.insert(position, dict(_id=child.id()))
+        self.info.set_unchanged('items', items)
         return child
 
 
 class Item(BaseElement):
-    def __init__(self, _id):
-        super().__init__(_id, collection=db.items, parent_class=Checklist)
+    collection_name = 'items'
+
+    def __init__(self, _id, info=None):
+        super().__init__(_id, parent_class=Checklist)
         if _id is None:
-            # create a new checklist
-            _id = db.items.insert_one({}).inserted_id
+            # create a new item
+            self._create()
+            return
 
-        new_info = db.items.find_one({'_id': _id})
+        new_info = info if info is not None else storage.find_one(self.collection_name, {'_id': _id})
         if new_info is None:
             raise Exception('Item not found: {}'.format(_id))
-        self.update(new_info)
+        self._load(new_info)
+
 
+def invalid_fields(info):
+    """ Returns the names of the fields in info that cannot be saved: starting with $ or with a dot """
+    return [key for key in info if key.startswith('$') or '.' in key]
 
-def available_users():
-    """  Returns: A pymongo.cursor.Cursor with the available users """
-    return db.users.find({}, {'name': 1})
 
+def page_token(document, keys=('_id', )):
+    """ Returns an opaque token to get the page after a document.
+
+    Attrs:
+        document: the last document of a page
+        keys: the keys the documents are sorted by. The last one must be _id """
+    values = [document.get(key) for key in keys]
+    values = [str(value) if type(value) == ObjectId else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
 
-def available_groups(user_id, only_public=False):
+
+def _parse_page_token(token, keys):
+    """ Returns the values of the keys in a token created by page_token().
+
+    Raises:
+        ValueError: if the token is not valid """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+        if type(values) != list or len(values) != len(keys):
+            raise ValueError
+        values[-1] = ObjectId(values[-1])
+    except (ValueError, TypeError, InvalidId):
+        raise ValueError('Invalid page token')
+    return values
+
+
+def _after_order(order, _id):
+    """ Returns a filter for the checklists after (order, _id) when sorted by order and _id DESC.
+
+    Orders are numbers, strings or null. MongoDB compares values of the same type only, and it
+    sorts strings before numbers and numbers before null in a descending sort """
+    if order is None:
+        return {'order': None, '_id': {'$lt': _id}}
+    after = [{'order': order, '_id': {'$lt': _id}}, {'order': {'$lt': order}}]
+    if type(order) == str:
+        after.append({'order': {'$type': 'number'}})
+    after.append({'order': None})
+    return {'$or': after}
+
+
+def available_users(limit=None, after=None):
+    """
+    Attrs:
+        limit: maximum number of users. Default: all
+        after: a token from page_token() to get only the users after a user
+
+    Returns: An iterable with the available users, sorted by _id
+
+    Raises:
+        ValueError: if the token is not valid """
+    filter = {}
+    if after is not None:
+        filter['_id'] = {'$gt': _parse_page_token(after, ('_id', ))[0]}
+    return storage.find_many('users', filter, {'name': 1}, sort=[('_id', pymongo.ASCENDING)], limit=limit)
+
+
+def available_groups(user_id, only_public=False, limit=None, after=None):
     """
     Attrs:
         user_id: str or ObjectId of the user
         only_public: if True, returns only public groups. Default: False
+        limit: maximum number of groups. Default: all
+        after: a token from page_token() to get only the groups after a group
 
     Returns:
-        A pymongo.cursor.Cursor with the available groups in a user """
+        An iterable with the available groups in a user, sorted by _id
+
+    Raises:
+        ValueError: if the token is not valid """
     if type(user_id) == str:
         try:
             user_id = ObjectId(user_id)
         except InvalidId:
             return []
+    filter = {'parentid': user_id}
     if only_public:
-        return db.groups.find({'parentid': user_id, 'private': False}, {'name': 1, 'private': 1})
-    return db.groups.find({'parentid': user_id}, {'name': 1, 'private': 1})
+        filter['private'] = False
+    if after is not None:
+        filter['_id'] = {'$gt': _parse_page_token(after, ('_id', ))[0]}
+    return storage.find_many('groups', filter, {'name': 1, 'private': 1}, sort=[('_id', pymongo.ASCENDING)], limit=limit)
 
 
-def available_checklists(group_id):
-    """  Returns: A pymongo.cursor.Cursor with the available checklists in a group """
+def available_checklists(group_id, limit=None, after=None):
+    """
+    Attrs:
+        group_id: str or ObjectId of the group
+        limit: maximum number of checklists. Default: all
+        after: a token from page_token() with keys ('order', '_id') to get only the checklists after a checklist
+
+    Returns: An iterable with the available checklists in a group, sorted by order and _id DESC
+
+    Raises:
+        ValueError: if the token is not valid """
     if type(group_id) == str:
         try:
             group_id = ObjectId(group_id)
         except InvalidId:
             return []
-    return db.checklists.find({'parentid': group_id}, {'name': 1, 'order': 1, 'parentid': 1}).sort('order', pymongo.DESCENDING)
+    filter = {'parentid': group_id}
+    if after is not None:
+        filter.update(_after_order(*_parse_page_token(after, ('order', '_id'))))
+    return storage.find_many(
+        'checklists', filter, {'name': 1, 'order': 1, 'parentid': 1},
+        sort=[('order', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)], limit=limit)
+
+
+def user_tree(user_id, only_public=False, depth=3, fields=None):
+    """ Returns the groups of a user, with their checklists and items, using a query for each level.
+
+    Attrs:
+        user_id: str or ObjectId of the user
+        only_public: if True, returns only public groups. Default: False
+        depth (int): 1 returns only groups, 2 groups and checklists, 3 groups, checklists and items
+        fields (list): if not None, only these fields of each document are returned,
+            in addition to _id and parentid
+
+    Returns:
+        A list of groups. Each group has a list 'checklists', and each checklist a list 'items'
+        in the order of the checklist.
+    """
+    if type(user_id) == str:
+        try:
+            user_id = ObjectId(user_id)
+        except InvalidId:
+            return []
+    projection = None
+    if fields is not None:
+        projection = {field: 1 for field in fields if not field.startswith('$')}
+        projection['parentid'] = 1
+
+    filter = {'parentid': user_id}
+    if only_public:
+        filter['private'] = False
+    groups = list(storage.find_many('groups', filter, projection))
+    if depth < 2 or not groups:
+        return groups
+
+    checklist_projection = projection
+    if projection is not None and depth >= 3:
+        # the items array is needed to sort the items
+        checklist_projection = dict(projection, items=1)
+    checklists_by_group = {group['_id']: [] for group in groups}
+    checklists = list(storage.find_many(
+        'checklists', {'parentid': {'$in': list(checklists_by_group)}}, checklist_projection,
+        sort=[('order', pymongo.DESCENDING)]))
+    for checklist in checklists:
+        checklists_by_group[checklist['parentid']].append(checklist)
+    for group in groups:
+        group['checklists'] = checklists_by_group[group['_id']]
+    if depth < 3 or not checklists:
+        return groups
+
+    items = dict()
+    for item in storage.find_many('items', {'parentid': {'$in': [checklist['_id'] for checklist in checklists]}}, projection):
+        items[item['_id']] = item
+    for checklist in checklists:
+        # items not found are ignored. Items without _id are internal items
+        checklist['items'] = [
+            items[item['_id']] if '_id' in item else item
+            for item in checklist.get('items', []) if '_id' not in item or item['_id'] in items]
+    return groups
+
+
+def checklist_items(user_id, items_filter):
+    """ Searches items in all the checklists of a user.
+
+    Items are read with a single query on their owner, that uses an index on MongoDB, and then
+    grouped by checklist. Items saved before they had an owner are not found: see backfill_owners().
+
+    Attrs:
+        user_id: str or ObjectId of the user
+        items_filter (dict): a filter to select items. It is applied in addition to the owner of the item.
+
+    Returns:
+        An iterable with a document for each checklist that has matching items,
+        in the order of available_groups() and available_checklists():
+        {'_id': group_id, 'name': group_name, 'checklist': {'_id':..., 'name':...}, 'items': [...]}
+    """
+    if type(user_id) == str:
+        try:
+            user_id = ObjectId(user_id)
+        except InvalidId:
+            return []
+    items = dict()
+    for item in storage.find_many('items', dict(items_filter, owner_id=user_id)):
+        items.setdefault(item.get('parentid'), []).append(item)
+    if not items:
+        return []
+    checklists = storage.find_many(
+        'checklists', {'_id': {'$in': [_id for _id in items if _id is not None]}}, {'name': 1, 'parentid': 1, 'order': 1},
+        sort=[('order', pymongo.DESCENDING)])
+    checklists_by_group = dict()
+    for checklist in checklists:
+        checklists_by_group.setdefault(checklist['parentid'], []).append(checklist)
+    groups = storage.find_many(
+        'groups', {'_id': {'$in': list(checklists_by_group)}, 'parentid': user_id}, {'name': 1},
+        sort=[('_id', pymongo.ASCENDING)])
+    return [
+        dict(_id=group['_id'], name=group.get('name'), checklist=dict(_id=checklist['_id'], name=checklist.get('name')),
+             items=items[checklist['_id']])
+        for group in groups for checklist in checklists_by_group[group['_id']]]
+
+_SYNC_SOURCES = ('groups', 'checklists', 'items', 'tombstones')
+
+
+def _to_milliseconds(date):
+    """ Returns the milliseconds since the epoch of a datetime, or None """
+    if date is None:
+        return None
+    delta = date - datetime.datetime(1970, 1, 1)
+    return (delta.days * 86400 + delta.seconds) * 1000 + delta.microseconds // 1000
+
+
+def _from_milliseconds(milliseconds):
+    """ The inverse of _to_milliseconds() """
+    if milliseconds is None:
+        return None
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=int(milliseconds))
+
+
+def _sync_token(positions, issued_at):
+    """ Returns a token with the last (updated_at, _id) returned from each collection, and the time
+    until the changes were read """
+    values = dict(issued_at=_to_milliseconds(issued_at))
+    for name, position in positions.items():
+        if position is not None:
+            updated_at, _id = position
+            values[name] = [_to_milliseconds(updated_at), str(_id)]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def _parse_sync_token(token):
+    """ Returns the positions and the time of issue in a token created by _sync_token().
+
+    The time of issue is None in tokens created before it was included.
+
+    Raises:
+        ValueError: if the token is not valid """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+        positions = dict()
+        for name in _SYNC_SOURCES:
+            if name in values:
+                updated_at, _id = values[name]
+                positions[name] = (_from_milliseconds(updated_at), ObjectId(_id))
+        issued_at = _from_milliseconds(values.get('issued_at'))
+    except (ValueError, TypeError, AttributeError, InvalidId, OverflowError):
+        raise ValueError('Invalid sync token')
+    return positions, issued_at
+
+
+def _after_update(position, until):
+    """ Returns a filter for the documents after a position when sorted by updated_at and _id, and updated before until.
+
+    Documents without updated_at, written before it was maintained, come first """
+    if position is None:
+        return {'$or': [{'updated_at': None}, {'updated_at': {'$lte': until}}]}
+    updated_at, _id = position
+    if updated_at is None:
+        return {'$or': [{'updated_at': None, '_id': {'$gt': _id}}, {'updated_at': {'$type': 'date', '$lte': until}}]}
+    return {'$or': [{'updated_at': updated_at, '_id': {'$gt': _id}}, {'updated_at': {'$gt': updated_at, '$lte': until}}]}
+
+
+def _visible_filters(name, user_id):
+    """ Returns the filters of the documents of a collection that a user can access, as BaseElement.visible_by().
+
+    Each filter can use an index with the update time: see INDEXES """
+    if name == 'tombstones':
+        # hidden tombstones are elements that became private: only the other users remove them
+        return [{'owner_id': user_id, 'hidden': {'$ne': True}}, {'owner_id': {'$ne': user_id}, 'private': False}]
+    return [{'owner_id': user_id}, {'private': False}]
+
+
+def sync(user_id, since=None, limit=1000, delay=0):
+    """ Returns the groups, checklists and items that a user can access that changed since a previous sync,
+    and the deleted ones.
+
+    The elements are the ones of the user and the public ones of every user. Each collection is read
+    with range queries on the owner or the visibility, and the update time of the documents. Elements
+    without owner are not returned: run backfill_owners() for old documents. When a public element
+    becomes private, the other users receive it in 'deleted'. Clients remove the children of the
+    deleted elements, and apply 'deleted' before the other changes.
+
+    Attrs:
+        user_id: str or ObjectId of the user
+        since: a token returned by a previous call. If None, all the elements are returned
+        limit: maximum number of documents of each collection. If there are more, 'more' is True
+            and the next call with the returned token continues from here
+        delay: seconds. Documents updated more recently are not returned yet. Use the maximum
+            difference between the clocks of the servers, so writes are not missed
+
+    Returns:
+        A dictionary {'groups': [...], 'checklists': [...], 'items': [...],
+        'deleted': [{'_id': ..., 'collection': ...}], 'next': token, 'more': bool, 'reset': bool}
+        If reset is True, the token is too old to know the deleted elements: all the elements
+        are returned and the client must remove any element it does not receive.
+
+    Raises:
+        ValueError: if the token is not valid
+    """
+    if type(user_id) == str:
+        user_id = ObjectId(user_id)
+    positions, issued_at = _parse_sync_token(since) if since is not None else (dict(), None)
+    reset = False
+    # tombstones older than this may be removed: the client could miss deletions after the token was issued.
+    # Positions are not compared, since they do not move if a collection has no changes
+    oldest = _now() - datetime.timedelta(days=TOMBSTONE_DAYS)
+    if issued_at is None:
+        # an old token without its time of issue: its positions are the best guess
+        expired = any(position[0] is not None and position[0] < oldest for position in positions.values())
+    else:
+        expired = issued_at < oldest
+    if expired:
+        positions = dict()
+        reset = True
+    until = _now() - datetime.timedelta(seconds=delay)
+
+    changes = dict(deleted=[], more=False, reset=reset)
+    for name in _SYNC_SOURCES:
+        after = _after_update(positions.get(name), until)
+        filter = {'$or': [dict(visible, **after) for visible in _visible_filters(name, user_id)]}
+        documents = list(storage.find_many(
+            name, filter, sort=[('updated_at', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)], limit=limit + 1))
+        if len(documents) > limit:
+            documents = documents[:limit]
+            changes['more'] = True
+        if documents:
+            positions[name] = (documents[-1].get('updated_at'), documents[-1]['_id'])
+        if name == 'tombstones':
+            changes['deleted'] = [dict(_id=info['element_id'], collection=info['collection']) for info in documents]
+        else:
+            changes[name] = documents
+    changes['next'] = _sync_token(positions, until)
+    return changes
+
+
+def attach_item(checklist_id, item_id, position=None):
+    """ Adds an item to the items of a checklist, in a single operation and without loading the checklist.
+
+    Args:
+        checklist_id: str or ObjectId of the checklist
+        item_id: str or ObjectId of the item
+        position (int): the position of the item in the checklist. If None, it is appended at the end
+
+    Returns:
+        True if the checklist exists """
+    try:
+        push = {'$each': [dict(_id=ObjectId(item_id))]}
+        checklist_id = ObjectId(checklist_id)
+    except InvalidId:
+        return False
+    if position is not None:
+        push['$position'] = position
+    matched = storage.update('checklists', {'_id': checklist_id}, _bump({'$push': {'items': push}})).matched_count > 0
+    invalidate('checklists', [checklist_id])
+    return matched
+
+
+def detach_item(checklist_id, item_id):
+    """ Removes an item from the items of a checklist, in a single operation and without loading the checklist.
+
+    Args:
+        checklist_id: str or ObjectId of the checklist
+        item_id: str or ObjectId of the item
+
+    Returns:
+        True if the item was in the checklist """
+    try:
+        item_id = ObjectId(item_id)
+        checklist_id = ObjectId(checklist_id)
+    except InvalidId:
+        return False
+    modified = storage.update(
+        'checklists', {'_id': checklist_id, 'items._id': item_id}, _bump({'$pull': {'items': {'_id': item_id}}})).modified_count > 0
+    invalidate('checklists', [checklist_id])
+    return modified
+
+
+def _batches(values, batch_size):
+    """ Splits a list in lists of batch_size elements. If batch_size is None, there is a single batch """
+    if not batch_size:
+        return [values]
+    return [values[start:start + batch_size] for start in range(0, len(values), batch_size)]
+
+
+def duplicate_checklist(checklist, new_id=None, batch_size=None, progress=None):
+    """ Duplicates a checklist and all its items, in the same group.
+
+    Items are read and written in batches, and then the new checklist is inserted with its items array,
+    so the copy is not visible until it is complete. Without batches, items are read in a single query
+    and written with a single insert, and if transactions are used everything happens in one transaction.
+
+    Args:
+        checklist (Checklist): the checklist to duplicate
+        new_id (ObjectId): identifier of the new checklist. If None, a new identifier. Items left by
+            a previous call with the same new_id that did not finish are removed first
+        batch_size (int): number of items in each read and write. If None, all items at once
+        progress: if not None, a function called with the number of items copied after each batch
+
+    Returns:
+        The new Checklist
+    """
+    new_info = dict(checklist.info)
+    new_info.pop('items', None)
+    new_info['_id'] = new_id or ObjectId()
+    new_info['version'] = 1
+    new_info['updated_at'] = _now()
+    inherited = checklist.inherited_info()
+    if new_id is not None:
+        delete_items({'parentid': new_id}, inherited['owner_id'], inherited['private'])
+
+    items = checklist.info.get('items', [])
+    new_refs = []
+    with transaction(enabled=batch_size is None) as session:
+        for batch in _batches(items, batch_size):
+            external_ids = [item['_id'] for item in batch if '_id' in item]
+            external_items = dict()
+            if external_ids:
+                external_items = {
+                    info['_id']: info for info in storage.find_many('items', {'_id': {'$in': external_ids}}, session=session)}
+
+            new_items = []
+            for item in batch:
+                if '_id' in item:
+                    # it is an external document: duplicate the item
+                    item = external_items.get(item['_id'])
+                    if item is None:
+                        continue
+                # internal items are converted to external items
+                new_item = dict(item)
+                new_item.update(inherited)
+                new_item['_id'] = ObjectId()
+                new_item['parentid'] = new_info['_id']
+                new_item['version'] = 1
+                new_item['updated_at'] = new_info['updated_at']
+                new_items.append(new_item)
+            if new_items:
+                storage.insert('items', new_items, session=session)
+            new_refs.extend(dict(_id=item['_id']) for item in new_items)
+            if progress is not None:
+                progress(len(new_refs))
+        new_info['items'] = new_refs
+        storage.insert('checklists', [new_info], session=session)
+    events.notify(Checklist.collection_name, [new_info['_id']], 'saved', owner_id=inherited['owner_id'],
+                  private=inherited['private'], parentid=new_info.get('parentid'))
+    touch(Group, [new_info.get('parentid')], owner_id=inherited['owner_id'], private=inherited['private'])
+
+    new_checklist = Checklist(new_info['_id'], info=new_info)
+    _remember(new_checklist)
+    return new_checklist
+
+
+def clear_checklist(checklist):
+    """ Removes all done items from a checklist, and any reference to items that do not exist.
+
+    This uses a fixed number of queries, whatever the size of the checklist.
+
+    Args:
+        checklist (Checklist): the checklist to clear. Its items are updated.
+
+    Returns:
+        The number of references removed from the checklist
+    """
+    deleted = delete_items({'parentid': checklist.id(), 'checked': True}, checklist.owner_id(), checklist.is_private())
+    item_ids = [item['_id'] for item in checklist.info.get('items', []) if '_id' in item]
+    existing = set(storage.distinct('items', '_id', {'_id': {'$in': item_ids}})) if item_ids else set()
+    removed = [_id for _id in item_ids if _id not in existing]
+    if removed:
+        storage.update('checklists', {'_id': checklist.id()}, _bump({'$pull': {'items': {'_id': {'$in': removed}}}}))
+        invalidate('checklists', [checklist.id()])
+        checklist.info.set_unchanged('items', [
+            item for item in checklist.info['items'] if '_id' not in item or item['_id'] in existing])
+        events.notify(Checklist.collection_name, [checklist.id()], 'saved', owner_id=checklist.owner_id(), private=checklist.is_private())
+    elif deleted:
+        touch(Checklist, [checklist.id()], owner_id=checklist.owner_id(), private=checklist.is_private())
+    return len(removed)
+
+
+def bulk_items(checklist, operations):
+    """ Creates, updates and deletes several items of a checklist at once.
+
+    All operations are sent in a single bulk write, followed by a single update of the items array
+    of the checklist. Operations on items that are not in the checklist fail. Items cannot be
+    moved to another checklist with this function.
+
+    Args:
+        checklist (Checklist): the checklist. Its items are updated.
+        operations (list): a list of dictionaries {'op': 'create', 'item': {...}},
+            {'op': 'update', '_id': ..., 'item': {...}} or {'op': 'delete', '_id': ...}
+
+    Returns:
+        A list with the result of each operation, in the same order:
+        {'op': ..., '_id': ..., 'status': 200} or {'op': ..., 'status': 400, 404 or 500, 'error_message': ...}.
+        If the bulk write fails, the operation that failed and the ones after it have status 500
+    """
+    results = []
+    requests = []
+    # the result and the item of each request
+    request_results = []
+    targets = []
+    inherited = checklist.inherited_info()
+    owner_id, private = inherited['owner_id'], inherited['private']
+
+    for operation in operations:
+        op = operation.get('op') if isinstance(operation, dict) else None
+        result = dict(op=op, status=200)
+        results.append(result)
+        if op not in ('create', 'update', 'delete'):
+            result.update(status=400, error_message='Unknown operation')
+            continue
+        info = operation.get('item') or dict()
+        invalid = invalid_fields(info)
+        if invalid:
+            result.update(status=400, error_message='Invalid field names: {}'.format(', '.join(invalid)))
+            continue
+        if op == 'create':
+            if 'name' not in info:
+                result.update(status=400, error_message='An item needs a name')
+                continue
+            new_item = Item.writable_info(info)
+            new_item.update(inherited)
+            new_item['_id'] = ObjectId()
+            new_item['parentid'] = checklist.id()
+            new_item['version'] = 1
+            new_item['updated_at'] = _now()
+            requests.append(('insert', new_item))
+            request_results.append((result, new_item['_id']))
+            result['_id'] = str(new_item['_id'])
+            continue
+        try:
+            if operation.get('_id') is None:
+                raise InvalidId()
+            _id = ObjectId(operation['_id'])
+        except (InvalidId, TypeError):
+            result.update(status=400, error_message='Invalid identifier')
+            continue
+        result['_id'] = str(_id)
+        targets.append((result, op, _id, info))
+
+    # updates and deletes: only on items of this checklist
+    existing = set()
+    if targets:
+        existing = set(storage.distinct('items', '_id', {'_id': {'$in': [_id for _, _, _id, _ in targets]}, 'parentid': checklist.id()}))
+    for result, op, _id, info in targets:
+        if _id not in existing:
+            result.update(status=404, error_message='Item not found in this checklist')
+        elif op == 'update':
+            new_info = Item.writable_info(info)
+            new_info.pop('parentid', None)
+            if new_info:
+                requests.append(('update', {'_id': _id, 'parentid': checklist.id()}, _bump({'$set': new_info})))
+                request_results.append((result, _id))
+        else:
+            requests.append(('delete', {'_id': _id, 'parentid': checklist.id()}))
+            request_results.append((result, _id))
+
+    applied = len(requests)
+    in_transaction = False
+    try:
+        with transaction() as session:
+            in_transaction = session is not None
+            if requests:
+                storage.bulk('items', requests, session=session)
+            _save_bulk_items(checklist, requests, owner_id, private, session=session)
+    except BulkWriteError as exc:
+        logger.error('Bulk write on checklist %s failed: %s', checklist.id(), exc)
+        # a transaction undoes all the operations. Without it, the ones before the error were applied
+        applied = 0 if in_transaction else exc.applied
+        for index, (result, _) in enumerate(request_results[applied:], start=applied):
+            result.update(status=500, error_message=str(exc) if index == exc.applied else 'Not applied')
+            if result['op'] == 'create':
+                result.pop('_id', None)
+        if applied:
+            _save_bulk_items(checklist, requests[:applied], owner_id, private)
+    requests = requests[:applied]
+    if requests:
+        invalidate('checklists', [checklist.id()])
+
+    created = [request[1]['_id'] for request in requests if request[0] == 'insert']
+    deleted = set(request[1]['_id'] for request in requests if request[0] == 'delete')
+    if created or deleted:
+        checklist.info.set_unchanged('items', [
+            item for item in checklist.info.get('items', []) if item.get('_id') not in deleted] + [dict(_id=_id) for _id in created])
+    if requests:
+        saved = [request[1]['_id'] for request in requests if request[0] != 'delete']
+        events.notify(Item.collection_name, saved, 'saved', owner_id=owner_id, private=private, parentid=checklist.id())
+        events.notify(Checklist.collection_name, [checklist.id()], 'saved', owner_id=owner_id, private=private)
+    return results
+
+
+def _save_bulk_items(checklist, requests, owner_id, private, session=None):
+    """ Updates the items array of a checklist after the requests of a bulk write, and buries the deleted items """
+    created = [request[1]['_id'] for request in requests if request[0] == 'insert']
+    deleted = [request[1]['_id'] for request in requests if request[0] == 'delete']
+    if deleted:
+        _bury(Item, deleted, owner_id, private, session=session)
+    created_refs = [dict(_id=_id) for _id in created]
+    if created and deleted:
+        storage.update('checklists', {'_id': checklist.id()}, [{'$set': {'items': {'$concatArrays': [
+            {'$filter': {
+                'input': {'$ifNull': ['$items', []]},
+                'cond': {'$not': [{'$in': ['$$this._id', deleted]}]}}},
+            created_refs]}}}, _bump_stage()], session=session)
+    elif created:
+        storage.update('checklists', {'_id': checklist.id()}, _bump({'$push': {'items': {'$each': created_refs}}}), session=session)
+    elif deleted:
+        storage.update('checklists', {'_id': checklist.id()}, _bump({'$pull': {'items': {'_id': {'$in': deleted}}}}), session=session)
+    elif requests:
+        storage.update('checklists', {'_id': checklist.id()}, _bump(), session=session)
+
+
+def delete_items(filter, owner_id, private=True, batch_size=None, progress=None):
+    """ Deletes the items that match a filter, leaving a tombstone for each one.
+
+    Args:
+        filter (dict): the filter of the items
+        owner_id: the owner of the items
+        private: the visibility of the items
+        batch_size (int): number of items in each delete. If None, all items at once
+        progress: if not None, a function called with the number of items deleted after each batch
+
+    Returns:
+        The number of items deleted
+    """
+    deleted = 0
+    while True:
+        item_ids = [info['_id'] for info in storage.find_many('items', filter, {'_id': 1}, limit=batch_size)]
+        if not item_ids:
+            return deleted
+        deleted += storage.delete('items', {'_id': {'$in': item_ids}})
+        _bury(Item, item_ids, owner_id, private)
+        if progress is not None:
+            progress(deleted)
+        if not batch_size:
+            return deleted
+
+
+def delete_checklist(checklist, batch_size=None, progress=None):
+    """ Deletes a checklist and all its items.
+
+    The checklist is deleted first, so it disappears at once, and then its items, in batches.
+
+    Args:
+        checklist (Checklist): the checklist
+        batch_size (int): number of items in each delete. If None, all items at once
+        progress: if not None, a function called with the number of items deleted after each batch
+
+    Returns:
+        The number of items deleted
+    """
+    checklist.delete()
+    return delete_items({'parentid': checklist.id()}, checklist.owner_id(), checklist.is_private(),
+                        batch_size=batch_size, progress=progress)
+
+
+def _touched(checklist, result):
+    """ Increments the version of a checklist if an update of its items changed any. Returns the number of items """
+    if result.modified_count > 0:
+        touch(Checklist, [checklist.id()], owner_id=checklist.owner_id(), private=checklist.is_private())
+    return result.modified_count
+
+
+def check_items(checklist, checked=True, done_date=''):
+    """ Checks or unchecks all items in a checklist with a single update.
+
+    Args:
+        checklist (Checklist): the checklist
+        checked (bool): the new value of checked
+        done_date (str): the new done_date of the items. Unchecked items always get an empty done_date
+
+    Returns:
+        The number of items that changed
+    """
+    if checked:
+        filter = {'parentid': checklist.id(), 'checked': {'$ne': True}}
+    else:
+        filter = {'parentid': checklist.id(), 'checked': True}
+        done_date = ''
+    return _touched(checklist, storage.update('items', filter, _bump({'$set': {'checked': checked, 'done_date': done_date}}), multi=True))
+
+
+def shift_due_dates(checklist, days):
+    """ Moves the due date of all items in a checklist a number of days, with a single update.
+
+    Only items with a due date in the format YYYY-MM-DD are changed. Dates that do not exist, as 2026-02-30, are kept.
+
+    Args:
+        checklist (Checklist): the checklist
+        days (int): the number of days. It can be negative.
+
+    Returns:
+        The number of items that changed
+    """
+    return _touched(checklist, storage.update(
+        'items', {'parentid': checklist.id(), 'due_date': {'$regex': r'^\d{4}-\d{2}-\d{2}$'}},
+        [{'$set': {'due_date': {'$dateToString': {
+            'format': '%Y-%m-%d',
+            'date': {'$add': [
+                {'$dateFromString': {'dateString': '$due_date', 'format': '%Y-%m-%d', 'onError': None, 'onNull': None}},
+                days * 24 * 60 * 60 * 1000]},
+            'onNull': '$due_date'}}}}, _bump_stage()],
+        multi=True))
+
+
+def clear_due_dates(checklist):
+    """ Removes the due date of all items in a checklist, with a single update.
+
+    Returns:
+        The number of items that changed
+    """
+    return _touched(checklist, storage.update(
+        'items', {'parentid': checklist.id(), 'due_date': {'$gt': ''}}, _bump({'$set': {'due_date': ''}}), multi=True))
 
 
 def create_user(name, password=None):
@@ -294,7 +1500,7 @@ def create_user(name, password=None):
         password (str): Password of the user. If None, no password is created and the user cannot logon
 
     Returns:
-        User: The new user
+        User: The new user, or None if the user cannot be created. For example, if the name already exists
     """
     user = User(None)
     user.info['name'] = name
@@ -302,12 +1508,15 @@ def create_user(name, password=None):
         user.hash_password(password)
     if user.save():
         return user
-    return user
+    return None
 
 
 def search_element(element_class, element_id):
     """ Search for a generic element
 
+    Groups and checklists are read from a cache shared by the requests of this process, if all the
+    processes remove them from their caches when they change: see invalidate()
+
     Attr:
         element_class: the class of the element to search. Currently: User, Group, Checklist, Item
         element_id: the identifier of the element to search
@@ -319,12 +1528,116 @@ def search_element(element_class, element_id):
         try:
             element_id = ObjectId(element_id)
         except InvalidId:
-            logger.warn('Invalid Identifier: %s', element_id)
+            logger.warning('Invalid Identifier: %s', element_id)
             return None
+    identity_map = _identity_map()
+    if identity_map is not None:
+        element = identity_map.get((element_class.collection_name, element_id))
+        if element is not None:
+            flask.g.identity_map_stats['hits'] += 1
+            return element
+        flask.g.identity_map_stats['misses'] += 1
     try:
-        return element_class(element_id)
+        if element_class.collection_name in CACHED_COLLECTIONS and type(element_id) == ObjectId and cache_enabled():
+            element = _load_cached(element_class, element_id)
+        else:
+            element = element_class(element_id)
     except Exception:
         return None
+    _remember(element)
+    return element
+
+
+def _load_cached(element_class, element_id):
+    """ Returns an element from the cache of documents, or loads it and adds it to the cache.
+
+    The cache keeps a copy of the document: changes to the element do not change the cache.
+
+    Raises:
+        Exception: if the element does not exist """
+    key = (element_class.collection_name, element_id)
+    info = element_cache.get(key)
+    if info is not None:
+        return element_class(element_id, info=query.copy_document(info))
+    generation = _cache_generation
+    element = element_class(element_id)
+    if generation == _cache_generation:
+        element_cache.set(key, query.copy_document(dict(element.info)))
+    return element
+
+
+def visible_version(element_class, element_id, user_id):
+    """ Returns the version of an element if a user can access it, reading only the fields needed to decide.
+
+    Attr:
+        element_class: the class of the element. Currently: Group, Checklist, Item
+        element_id: str or ObjectId of the element
+        user_id: the identifier of the user
+
+    Returns:
+        The version of the element. None if it doesn't exist, the user cannot access it or
+        the document has not enough information to decide, as old documents without owner.
+    """
+    try:
+        element_id = ObjectId(element_id)
+    except (InvalidId, TypeError):
+        return None
+    info = storage.find_one(
+        element_class.collection_name, {'_id': element_id}, {'version': 1, 'parentid': 1, 'owner_id': 1, 'private': 1})
+    if info is None or (element_class != Group and 'owner_id' not in info):
+        return None
+    if not element_class(element_id, info=info).visible_by(user_id):
+        return None
+    return info.get('version', 0)
+
+
+def iter_documents(element_class, element_ids, batch_size=500):
+    """ Reads the documents of several elements of the same class, a batch of them in each query.
+
+    Documents are not converted to elements nor kept in the identity map,
+    so only a batch is in memory at a time.
+
+    Attr:
+        element_class: the class of the elements to read. Currently: User, Group, Checklist, Item
+        element_ids: a list of identifiers, as str or ObjectId
+        batch_size: number of documents in each query
+
+    Yields:
+        The document of each identifier, in the same order than element_ids,
+        or None if it doesn't exist or its identifier is not valid.
+    """
+    for start in range(0, len(element_ids), batch_size):
+        object_ids = []
+        for element_id in element_ids[start:start + batch_size]:
+            if type(element_id) == str:
+                try:
+                    element_id = ObjectId(element_id)
+                except InvalidId:
+                    logger.warning('Invalid Identifier: %s', element_id)
+                    element_id = None
+            object_ids.append(element_id)
+        query_ids = [_id for _id in object_ids if _id is not None]
+        found = {info['_id']: info for info in storage.find_many(element_class.collection_name, {'_id': {'$in': query_ids}})}
+        for _id in object_ids:
+            yield found.get(_id)
+
+
+def backfill_owners():
+    """ Sets the owner and visibility of all groups, checklists and items from their parents.
+
+    Documents created before the owner was stored in them are updated.
+
+    Returns:
+        The number of groups updated """
+    updated = 0
+    for info in storage.find_many('groups', {'parentid': {'$ne': None}}):
+        group = Group(info['_id'], info=info)
+        inherited = group.inherited_info()
+        storage.update('groups', {'_id': group.id()}, _bump({'$set': inherited}))
+        invalidate('groups', [group.id()])
+        group.propagate_inherited()
+        updated += 1
+    return updated
 
 
 def search_username(name):
@@ -336,8 +1649,10 @@ def search_username(name):
     Returns:
         The User, or None if it doesn't exist.
     """
-    userinfo = db.users.find_one({'name': name})
+    userinfo = storage.find_one('users', {'name': name})
     if userinfo is None:
-        logger.warn('User not found: %s', name)
+        logger.warning('User not found: %s', name)
         return None
-    return User(userinfo['_id'])
+    user = User(userinfo['_id'], info=userinfo)
+    _remember(user)
+    return user
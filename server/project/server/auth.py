@@ -1,13 +1,44 @@
 import flask
 from flask_httpauth import HTTPBasicAuth
-from project.model import search_username
+from project.model import search_username, PASSWORD_FIELDNAME
+from project.server.cache import LRUCache
 import datetime
+import hashlib
+import hmac
+import os
+import time
 import jwt
 from bson.objectid import ObjectId
 from bson.errors import InvalidId
 
+# Successful verifications of username and password: keyed hash of the credentials -> password hash of the user
+password_cache = LRUCache()
+# Decoded tokens: keyed hash of the token -> (user identifier, expiration time)
+token_cache = LRUCache()
+# Credentials are never kept in memory: only a keyed hash of them, with a key that changes in every process
+_cache_key = os.urandom(32)
 
-def create_auth():
+
+def configure_cache(config):
+    """ Configures the size and time to live of the authentication caches from a Flask configuration """
+    for cache in (password_cache, token_cache):
+        cache.maxsize = config.get('AUTH_CACHE_SIZE', 1024)
+        cache.ttl = config.get('AUTH_CACHE_TTL', 300)
+        cache.clear()
+
+
+def cache_stats():
+    """ Returns the counters of the authentication caches """
+    return dict(passwords=password_cache.stats(), tokens=token_cache.stats())
+
+
+def _credentials_hash(*credentials):
+    return hmac.new(_cache_key, '\0'.join(credentials).encode(), hashlib.sha256).digest()
+
+
+def create_auth(config=None):
+    if config is not None:
+        configure_cache(config)
     auth = HTTPBasicAuth()
 
     @auth.verify_password
@@ -29,9 +60,18 @@ def create_auth():
         # there is a password: assume it is a user/password pair
         flask.current_app.logger.info('Verifying password for user %s', username)
         user = search_username(username)
-        if not user or not user.verify_password(password):
+        if not user:
             flask.current_app.logger.warning('Password not valid for username: %s', username)
             return False
+        # skip bcrypt if these credentials were verified recently, and the password didn't change since then
+        credentials = _credentials_hash(username, password)
+        password_hash = user.info.get(PASSWORD_FIELDNAME)
+        if password_hash is None or password_cache.get(credentials) != password_hash:
+            if not user.verify_password(password):
+                password_cache.delete(credentials)
+                flask.current_app.logger.warning('Password not valid for username: %s', username)
+                return False
+            password_cache.set(credentials, password_hash)
         flask.g.user_id = str(user.id())
         return True
 
@@ -74,9 +114,15 @@ def decode_auth_token(auth_token):
     Return:
         integer|string
     """
+    token = _credentials_hash(auth_token)
+    cached = token_cache.get(token)
+    if cached is not None and cached[1] > time.time():
+        return cached[0]
     try:
         payload = jwt.decode(auth_token, flask.current_app.config.get('SECRET_KEY'))
-        return ObjectId(payload.get('sub', ''))
+        user_id = ObjectId(payload.get('sub', ''))
+        token_cache.set(token, (user_id, payload.get('exp', 0)))
+        return user_id
     except jwt.ExpiredSignatureError:
         flask.current_app.logger.debug('Expired token')
         return None
@@ -0,0 +1,69 @@
+import collections
+import threading
+import time
+
+
+class LRUCache(object):
+    """ A thread safe cache with a maximum number of entries and a time to live.
+
+    When the cache is full, the least recently used entry is evicted. Expired entries
+    are removed when they are read.
+    """
+    def __init__(self, maxsize=1024, ttl=300):
+        """
+        Args:
+            maxsize (int): maximum number of entries in the cache
+            ttl (float): seconds an entry is valid after it is set. If None, entries do not expire
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """ Returns the value of a key, or default if the key is not in the cache or it expired """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """ Sets the value of a key, evicting the least recently used entries if the cache is full """
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """ Removes a key from the cache, if it exists """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """ Removes all entries """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """ Returns a dictionary with the counters of the cache """
+        with self._lock:
+            requests = self.hits + self.misses
+            return dict(
+                size=len(self._entries),
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                hit_rate=(self.hits / requests if requests else 0.0)
+            )
@@ -0,0 +1,211 @@
+""" Notifications of changes in the model, for the clients listening to /events.
+
+The model calls notify() every time it saves or deletes a document, and the notification
+is delivered to the subscriptions of the users that can see the document. Only subscriptions
+in the same process receive it: if the application runs in several processes, EVENTS_CHANGE_STREAM
+is required and each process reads the changes from a MongoDB change stream instead. Without it,
+subscriptions are refused. Change streams need a replica set. A single node replica set is enough.
+The changes made by `flask worker` are only notified with the change stream.
+
+Each subscription is an open response that keeps a thread of the server while the client is
+connected. EVENTS_MAX_SUBSCRIPTIONS limits them in each process, so they do not take all the
+threads of the server. To keep thousands of them, serve /events from a worker based on greenlets,
+for example `gunicorn -k gevent`: this module only uses primitives from threading and queue, that
+gevent makes cooperative. gevent is not installed with the application.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from pymongo.errors import PyMongoError
+from project.storage import StorageError
+
+try:
+    # the number of processes of the application, if it runs in mod_wsgi
+    from mod_wsgi import maximum_processes as _wsgi_processes
+except ImportError:
+    _wsgi_processes = None
+
+logger = logging.getLogger(__name__)
+
+_queue_size = 100
+_max_subscriptions = 5
+_change_stream = False
+# a reason to refuse subscriptions, or None
+_unavailable = None
+_storage = None
+_watcher_pid = None
+_lock = threading.Lock()
+# user identifier (str) -> set of Subscription
+_subscriptions = dict()
+
+# collections whose changes are notified
+COLLECTIONS = ('groups', 'checklists', 'items')
+
+
+class Unavailable(Exception):
+    """ Raised when a subscription cannot be opened in this process """
+    pass
+
+
+class Subscription(object):
+    """ The notifications waiting to be sent to a client """
+    def __init__(self, user_id, maxsize):
+        self.user_id = str(user_id)
+        self._queue = queue.Queue(maxsize)
+        self._overflowed = False
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # the client is too slow: it will be told to reload everything
+            self._overflowed = True
+
+    def get(self, timeout=None):
+        """ Returns the next event, or None if there is none after timeout seconds.
+
+        If some events were lost because there were too many waiting, an event with action 'reset' is returned """
+        if self._overflowed:
+            self._overflowed = False
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            return dict(action='reset', data=dict())
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+def configure(config, storage=None):
+    """ Configures the notifications from a Flask configuration.
+
+    EVENTS_QUEUE_SIZE is the number of events that can wait for a client.
+    EVENTS_MAX_SUBSCRIPTIONS is the number of clients that can listen in each process.
+    EVENTS_CHANGE_STREAM: if True, changes are read from a change stream of the storage instead of notify().
+    Only the MongoDB storage has change streams. It is required if SERVER_PROCESSES, or the processes
+    of mod_wsgi, are more than one. """
+    global _queue_size, _max_subscriptions, _change_stream, _storage, _unavailable
+    _queue_size = config.get('EVENTS_QUEUE_SIZE', 100)
+    _max_subscriptions = config.get('EVENTS_MAX_SUBSCRIPTIONS', 5)
+    _change_stream = config.get('EVENTS_CHANGE_STREAM', False)
+    _storage = storage
+    _unavailable = None
+    processes = config.get('SERVER_PROCESSES') or _wsgi_processes or 1
+    if processes > 1 and not _change_stream:
+        _unavailable = 'Events need EVENTS_CHANGE_STREAM when the application runs in several processes'
+        logger.error(_unavailable)
+
+
+def subscribe(user_id):
+    """ Returns a new Subscription for a user. Call unsubscribe() when the client disconnects
+
+    Raises:
+        Unavailable: if there are EVENTS_MAX_SUBSCRIPTIONS in this process, or events cannot reach this process """
+    if _unavailable is not None:
+        raise Unavailable(_unavailable)
+    if _change_stream:
+        _start_watcher()
+    subscription = Subscription(user_id, _queue_size)
+    with _lock:
+        if sum(len(subscriptions) for subscriptions in _subscriptions.values()) >= _max_subscriptions:
+            raise Unavailable('Too many clients listening to events')
+        _subscriptions.setdefault(subscription.user_id, set()).add(subscription)
+    return subscription
+
+
+def unsubscribe(subscription):
+    with _lock:
+        subscriptions = _subscriptions.get(subscription.user_id, set())
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            _subscriptions.pop(subscription.user_id, None)
+
+
+def subscribers():
+    """ Returns the number of open subscriptions in this process """
+    with _lock:
+        return sum(len(subscriptions) for subscriptions in _subscriptions.values())
+
+
+def publish(collection, element_id, action, owner_id=None, private=True, parentid=None):
+    """ Delivers an event to the subscriptions of the users that can see an element.
+
+    Args:
+        collection: the collection of the element
+        element_id: the identifier of the element
+        action: 'saved' or 'deleted'
+        owner_id: the owner of the element. The owner always receives the event
+        private: if False, all users receive the event
+        parentid: the identifier of the parent of the element, if known """
+    data = dict(collection=collection, _id=str(element_id))
+    if parentid is not None:
+        data['parentid'] = str(parentid)
+    event = dict(action=action, data=data)
+    with _lock:
+        if private:
+            targets = list(_subscriptions.get(str(owner_id), ()))
+        else:
+            targets = [subscription for subscriptions in _subscriptions.values() for subscription in subscriptions]
+    for subscription in targets:
+        subscription.put(event)
+
+
+def notify(collection, element_ids, action, owner_id=None, private=True, parentid=None):
+    """ Called by the model after saving or deleting elements. See publish().
+
+    If changes are read from a change stream, this does nothing: the change stream publishes them """
+    if _change_stream or collection not in COLLECTIONS:
+        return
+    for element_id in element_ids:
+        publish(collection, element_id, action, owner_id=owner_id, private=private, parentid=parentid)
+
+
+def _start_watcher():
+    """ Starts the thread that reads the change stream in this process, if it is not running """
+    global _watcher_pid
+    with _lock:
+        if _watcher_pid == os.getpid():
+            return
+        _watcher_pid = os.getpid()
+    threading.Thread(target=_watch, name='events-change-stream', daemon=True).start()
+
+
+def _publish_change(change):
+    """ Publishes a change from the change stream """
+    info = change.get('fullDocument')
+    if info is None:
+        # the document was removed after the change: its tombstone will be notified
+        return
+    if change['ns']['coll'] == 'tombstones':
+        publish(info['collection'], info['element_id'], 'deleted',
+                owner_id=info.get('owner_id'), private=info.get('private', True))
+    else:
+        publish(change['ns']['coll'], change['documentKey']['_id'], 'saved',
+                owner_id=info.get('owner_id'), private=info.get('private', True), parentid=info.get('parentid'))
+
+
+def _watch():
+    pipeline = [
+        {'$match': {
+            'ns.coll': {'$in': list(COLLECTIONS) + ['tombstones']},
+            'operationType': {'$in': ['insert', 'update', 'replace']}}},
+        {'$project': {
+            'ns': 1, 'documentKey': 1, 'fullDocument.owner_id': 1, 'fullDocument.private': 1,
+            'fullDocument.parentid': 1, 'fullDocument.collection': 1, 'fullDocument.element_id': 1}}
+    ]
+    resume_token = None
+    while True:
+        try:
+            with _storage.watch(pipeline, full_document='updateLookup', resume_after=resume_token) as stream:
+                for change in stream:
+                    resume_token = stream.resume_token
+                    _publish_change(change)
+        except StorageError as exc:
+            logger.error('Cannot read the change stream: %s', exc)
+            return
+        except PyMongoError as exc:
+            logger.error('Error in the change stream: %s', exc)
+            time.sleep(1)
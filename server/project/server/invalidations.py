@@ -0,0 +1,155 @@
+""" Invalidation of the caches of the model in several processes.
+
+The model calls publish() every time it changes a cached document. The document is removed
+at once from the cache of this process. If other processes use the storage, with MongoDB and
+CACHE_INVALIDATIONS, the default, the invalidations are also written to a small capped collection
+of MongoDB, that each process reads with a tailable cursor. Capped collections do not need a
+replica set.
+
+Nothing is read or written when the app starts, so it starts even if MongoDB cannot be reached:
+the capped collection is created by the first publish(), or by the thread that reads it.
+
+The caches decide who can read and edit the documents, so they must not keep documents
+that changed in another process. A process always publishes its changes, but it only uses
+its cache while its thread reads the invalidations of the others: see listen().
+"""
+
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+from bson.objectid import ObjectId
+from pymongo.errors import PyMongoError
+from project.storage import StorageError
+
+logger = logging.getLogger(__name__)
+
+# the capped collection with the invalidations
+COLLECTION = 'invalidations'
+# seconds between attempts to read the invalidations, after an error
+RETRY_INTERVAL = 5
+
+_storage = None
+_callback = None
+_clear = None
+# other processes can change the documents
+_shared = False
+# invalidations are sent to other processes
+_publish = False
+_size = 1024 * 1024
+# the capped collection exists
+_created = False
+# the process that started the thread that reads the invalidations
+_watcher_pid = None
+# the process whose thread is reading the invalidations now
+_listening_pid = None
+_lock = threading.Lock()
+
+
+def configure(config, storage, callback, clear):
+    """ Configures the invalidations from a Flask configuration. The storage is not used yet.
+
+    CACHE_INVALIDATIONS: if True, invalidations are sent to other processes. Only the MongoDB storage can.
+    CACHE_INVALIDATIONS_SIZE is the size in bytes of the capped collection.
+
+    Args:
+        callback: a function(collection, element_ids) that removes documents from the cache of this process
+        clear: a function() that removes all documents from the cache of this process
+
+    Returns:
+        False if the cache can never be used: other processes change the documents and they cannot send
+        invalidations. Else, listen() tells when the cache can be used """
+    global _storage, _callback, _clear, _shared, _publish, _size, _created, _watcher_pid, _listening_pid
+    _storage = storage
+    _callback = callback
+    _clear = clear
+    _shared = storage.shared
+    _publish = storage.shared and storage.name == 'mongo' and config.get('CACHE_INVALIDATIONS', True)
+    _size = config.get('CACHE_INVALIDATIONS_SIZE', 1024 * 1024)
+    _created = False
+    _watcher_pid = None
+    _listening_pid = None
+    return not _shared or _publish
+
+
+def _origin():
+    """ Returns the identifier of this process """
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def _create():
+    """ Creates the capped collection, if it was not created yet.
+
+    Raises:
+        StorageError: if it cannot be created """
+    global _created
+    if not _created:
+        _storage.create_capped(COLLECTION, _size)
+        _created = True
+
+
+def publish(collection, element_ids):
+    """ Removes documents from the caches of all processes.
+
+    The invalidations are sent even if this process does not use its cache """
+    _callback(collection, element_ids)
+    if not _publish:
+        return
+    try:
+        # else, inserting would create a collection that is not capped
+        _create()
+        _storage.insert(COLLECTION, [dict(
+            _id=ObjectId(), origin=_origin(), collection=collection, ids=list(element_ids),
+            created_at=datetime.datetime.utcnow())])
+    except (StorageError, PyMongoError) as exc:
+        logger.error('Cannot send an invalidation to other processes: %s', exc)
+
+
+def listen():
+    """ Starts the thread that reads the invalidations of other processes, if it is not running in this process.
+
+    Call this before reading from the cache: processes forked after configure() have no thread yet.
+
+    Returns:
+        True if this process can use its cache now: no other process changes the documents,
+        or the thread is reading their invalidations """
+    global _watcher_pid
+    if not _shared:
+        return True
+    if not _publish:
+        return False
+    pid = os.getpid()
+    if _watcher_pid != pid:
+        with _lock:
+            if _watcher_pid != pid:
+                _watcher_pid = pid
+                threading.Thread(target=_watch, name='cache-invalidations', daemon=True).start()
+    return _listening_pid == pid
+
+
+def _watch():
+    global _listening_pid
+    pid = os.getpid()
+    origin = _origin()
+    since = datetime.datetime.utcnow()
+    while True:
+        try:
+            _create()
+            invalidations = _storage.tail(COLLECTION, {'created_at': {'$gte': since}})
+            if _listening_pid != pid:
+                # documents cached before this point may have changed without an invalidation
+                _clear()
+                _listening_pid = pid
+            for invalidation in invalidations:
+                since = invalidation['created_at']
+                if invalidation.get('origin') != origin:
+                    _callback(invalidation['collection'], invalidation['ids'])
+            # the cursor ends if the collection is empty
+            time.sleep(1)
+        except (StorageError, PyMongoError) as exc:
+            if _listening_pid == pid:
+                logger.error('Cannot read the invalidations, the cache is not used: %s', exc)
+            _listening_pid = None
+            time.sleep(RETRY_INTERVAL)
@@ -0,0 +1,108 @@
+""" Serialization of the JSON responses.
+
+Documents of the model can be returned as they are read: ObjectId and other bson types are
+serialized as strings, and dates as ISO 8601 strings in UTC. If orjson is installed, it
+serializes the responses. Otherwise, the json module of the standard library does.
+
+Call install() to use this module in a Flask app. Flask 2.2 and later use a JSON provider,
+and older versions use a JSON encoder.
+"""
+
+import datetime
+import uuid
+import flask
+from bson.decimal128 import Decimal128
+from bson.objectid import ObjectId
+from bson.timestamp import Timestamp
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:
+    # Flask < 2.2
+    DefaultJSONProvider = None
+
+
+def _isoformat(value):
+    """ Returns a datetime as an ISO 8601 string. Naive datetimes are in UTC, as the ones in the storage """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value.isoformat()
+
+
+def default(value):
+    """ Returns a value that json can serialize instead of a value it cannot serialize.
+
+    Raises:
+        TypeError: if the value cannot be serialized """
+    if isinstance(value, (ObjectId, Decimal128, uuid.UUID)):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        return _isoformat(value)
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, Timestamp):
+        return _isoformat(value.as_datetime())
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+def dumps_orjson(obj, sort_keys=False, indent=None):
+    """ Serializes an object with orjson, or returns None if orjson is not installed or cannot serialize it.
+
+    orjson only indents with two spaces, and it never escapes non ASCII characters """
+    if orjson is None or indent not in (None, 2):
+        return None
+    option = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    try:
+        return orjson.dumps(obj, default=default, option=option).decode('utf-8')
+    except orjson.JSONEncodeError:
+        # for example, integers with more than 64 bits: let json try, or report the error
+        return None
+
+
+if DefaultJSONProvider is not None:
+    class JSONProvider(DefaultJSONProvider):
+        """ A JSON provider for Flask 2.2 and later """
+        @staticmethod
+        def default(value):
+            try:
+                return default(value)
+            except TypeError:
+                return DefaultJSONProvider.default(value)
+
+        def dumps(self, obj, **kwargs):
+            result = dumps_orjson(obj, sort_keys=kwargs.get('sort_keys', self.sort_keys), indent=kwargs.get('indent'))
+            if result is not None:
+                return result
+            return super().dumps(obj, **kwargs)
+else:
+    class JSONEncoder(flask.json.JSONEncoder):
+        """ A JSON encoder for Flask before 2.2 """
+        def default(self, value):
+            try:
+                return default(value)
+            except TypeError:
+                return super().default(value)
+
+        def encode(self, obj):
+            result = dumps_orjson(obj, sort_keys=self.sort_keys, indent=self.indent)
+            if result is not None:
+                return result
+            return super().encode(obj)
+
+
+def install(app):
+    """ Serializes the JSON responses of a Flask app with this module """
+    if DefaultJSONProvider is not None:
+        app.json_provider_class = JSONProvider
+        app.json = JSONProvider(app)
+    else:
+        app.json_encoder = JSONEncoder
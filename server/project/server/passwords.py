@@ -0,0 +1,116 @@
+""" Password hashing and verification out of the request threads.
+
+bcrypt is slow on purpose. Running it in the threads that serve requests lets a burst of
+logins block the rest of the requests, so the work is sent to a small pool of processes.
+The number of operations waiting for the pool is limited: when the limit is reached,
+PoolFull is raised instead of waiting.
+"""
+
+import atexit
+import concurrent.futures
+import os
+import threading
+import bcrypt
+
+_workers = 0
+_rounds = 12
+_limit = 0
+_pending = 0
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+
+
+class PoolFull(Exception):
+    """ Raised when there are too many password operations waiting """
+    pass
+
+
+def configure(config):
+    """ Configures the pool from a Flask configuration.
+
+    PASSWORD_WORKERS is the number of processes. If 0, passwords are hashed in the calling thread.
+    PASSWORD_QUEUE_SIZE is the number of operations that can wait for a free process.
+    BCRYPT_LOG_ROUNDS is the cost of new hashes. """
+    global _workers, _rounds, _limit, _executor
+    with _lock:
+        workers = config.get('PASSWORD_WORKERS', 0)
+        if _executor is not None and workers != _workers:
+            _executor.shutdown()
+            _executor = None
+        _workers = workers
+        _rounds = config.get('BCRYPT_LOG_ROUNDS', 12)
+        _limit = _workers + config.get('PASSWORD_QUEUE_SIZE', 0)
+
+
+def pending():
+    """ Returns the number of operations running or waiting in the pool """
+    return _pending
+
+
+def _get_executor():
+    """ Returns the executor of this process. Processes are created after forking, if needed """
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = concurrent.futures.ProcessPoolExecutor(max_workers=_workers)
+            _executor_pid = os.getpid()
+        return _executor
+
+
+@atexit.register
+def shutdown():
+    """ Stops the processes of the pool, if any """
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+def _release(future=None):
+    global _pending
+    with _lock:
+        _pending -= 1
+
+
+def _run(function, *args):
+    global _pending
+    if _workers <= 0:
+        return function(*args)
+    with _lock:
+        if _pending >= _limit:
+            raise PoolFull('Too many password operations waiting')
+        _pending += 1
+    try:
+        future = _get_executor().submit(function, *args)
+    except Exception:
+        _release()
+        raise
+    future.add_done_callback(_release)
+    return future.result()
+
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def _checkpw(password, password_hash):
+    return bcrypt.checkpw(password.encode(), password_hash.encode())
+
+
+def hashpw(password):
+    """ Returns the bcrypt hash of a password, as a str.
+
+    Raises:
+        PoolFull: if there are too many operations waiting """
+    return _run(_hashpw, password, _rounds)
+
+
+def checkpw(password, password_hash):
+    """ Returns True if the password matches the hash.
+
+    Raises:
+        PoolFull: if there are too many operations waiting
+        ValueError: if the hash is not valid """
+    return _run(_checkpw, password, password_hash)
@@ -0,0 +1,26 @@
+""" The storages of the model: the databases where documents are saved.
+
+STORAGE_BACKEND in the configuration chooses the storage:
+
+- 'mongo': a MongoDB database. See MONGOURL, MONGODB and MONGO_TRANSACTIONS
+- 'sqlite': an SQLite file, for small deployments on a single node. See SQLITE_PATH
+- 'memory': a dictionary in the memory of the process, for tests and benchmarks
+"""
+
+from project.storage.base import Storage, StorageError, StorageUnavailable, DuplicateKeyError, BulkWriteError, UpdateResult
+
+
+def create_storage(config):
+    """ Returns the storage configured in a Flask configuration """
+    backend = config.get('STORAGE_BACKEND', 'mongo')
+    if backend == 'mongo':
+        from project.storage.mongo import MongoStorage
+        return MongoStorage(
+            config.get('MONGOURL'), config.get('MONGODB', 'mytasks'), use_transactions=config.get('MONGO_TRANSACTIONS', False))
+    if backend == 'sqlite':
+        from project.storage.sqlite import SQLiteStorage
+        return SQLiteStorage(config.get('SQLITE_PATH', 'mytasks.sqlite3'))
+    if backend == 'memory':
+        from project.storage.memory import MemoryStorage
+        return MemoryStorage()
+    raise StorageError('Unknown storage backend: {}'.format(backend))
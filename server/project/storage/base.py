@@ -0,0 +1,171 @@
+import collections
+import contextlib
+
+
+class StorageError(Exception):
+    """ An error of the storage """
+    pass
+
+
+class DuplicateKeyError(StorageError):
+    """ A write breaks a unique index """
+    pass
+
+
+class BulkWriteError(StorageError):
+    """ An operation of Storage.bulk() failed. The operations before it were applied, and the rest were not
+
+    Attrs:
+        applied: the number of operations that were applied """
+    def __init__(self, message, applied):
+        super().__init__(message)
+        self.applied = applied
+
+
+class StorageUnavailable(StorageError):
+    """ The database cannot be reached """
+    pass
+
+
+# the result of Storage.update()
+UpdateResult = collections.namedtuple('UpdateResult', ['matched_count', 'modified_count'])
+
+
+class Storage(object):
+    """ The interface between the model and a database.
+
+    Documents are dictionaries with an _id. Filters, updates, projections and sorts use the
+    syntax of MongoDB: see project.storage.query for the subset every storage supports.
+
+    Most methods accept a session returned by transaction(): pass it to every operation
+    inside the transaction. """
+
+    # the name of the storage in STORAGE_BACKEND
+    name = None
+    # False if only this process can read and write the documents
+    shared = True
+
+    def find_one(self, collection, filter, projection=None, session=None):
+        """ Returns the first document that matches a filter, or None """
+        for document in self.find_many(collection, filter, projection=projection, limit=1, session=session):
+            return document
+        return None
+
+    def find_many(self, collection, filter, projection=None, sort=None, limit=None, session=None):
+        """ Returns an iterable with the documents that match a filter.
+
+        Args:
+            projection (dict): if not None, the fields to return
+            sort (list): if not None, a list of (key, direction). direction is 1 or -1
+            limit (int): if not None, the maximum number of documents """
+        raise NotImplementedError()
+
+    def count(self, collection, filter):
+        """ Returns the number of documents that match a filter """
+        raise NotImplementedError()
+
+    def distinct(self, collection, key, filter, session=None):
+        """ Returns a list with the distinct values of a key in the documents that match a filter """
+        raise NotImplementedError()
+
+    def insert(self, collection, documents, session=None):
+        """ Inserts a list of documents. They must have an _id.
+
+        Raises:
+            DuplicateKeyError: if a document breaks a unique index """
+        raise NotImplementedError()
+
+    def update(self, collection, filter, update, multi=False, session=None):
+        """ Updates the first document that matches a filter, or all of them if multi is True.
+
+        Args:
+            update: a dictionary of update operators, or a list of stages of an update pipeline
+
+        Returns:
+            An UpdateResult
+
+        Raises:
+            DuplicateKeyError: if a document breaks a unique index """
+        raise NotImplementedError()
+
+    def find_and_update(self, collection, filter, update, projection=None, sort=None, session=None):
+        """ Updates the first document that matches a filter in a single operation.
+
+        Returns:
+            The document after the update, or None if no document matches
+
+        Raises:
+            DuplicateKeyError: if a document breaks a unique index """
+        raise NotImplementedError()
+
+    def delete(self, collection, filter, session=None):
+        """ Deletes the documents that match a filter.
+
+        Returns:
+            The number of deleted documents """
+        raise NotImplementedError()
+
+    def bulk(self, collection, operations, session=None):
+        """ Runs several writes on a collection, in order.
+
+        Args:
+            operations: a list of tuples ('insert', document), ('update', filter, update)
+                or ('delete', filter). Updates and deletes change a single document
+
+        Raises:
+            BulkWriteError: if an operation fails. The operations after it are not run """
+        raise NotImplementedError()
+
+    def aggregate(self, collection, pipeline):
+        """ Returns an iterable with the result of an aggregation pipeline.
+
+        Only $match, $lookup, $unwind, $sort, $project and $limit stages are supported by every storage """
+        raise NotImplementedError()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """ A context manager that returns a session with a transaction, or None if the storage does not use them """
+        yield None
+
+    def create_index(self, collection, keys, name, unique=False, partialFilterExpression=None, expireAfterSeconds=None):
+        """ Creates an index if it does not exist yet.
+
+        Args:
+            keys: a list of (key, direction)
+            name: the name of the index
+            unique: if True, the values of the keys cannot repeat
+            partialFilterExpression: if not None, only documents that match this filter are indexed
+            expireAfterSeconds: if not None, documents are removed this number of seconds
+                after the date in the single key of the index
+
+        Raises:
+            StorageError: if the index cannot be created """
+        raise NotImplementedError()
+
+    def index_names(self, collection):
+        """ Returns a list with the names of the indexes of a collection, without the index of _id """
+        raise NotImplementedError()
+
+    def unused_indexes(self, collection):
+        """ Returns a list with the names of the indexes that were never used, or None if the storage does not know """
+        return None
+
+    def watch(self, pipeline, **kwargs):
+        """ Returns a change stream of the database. Only MongoDB has change streams """
+        raise StorageError('The {} storage has no change streams'.format(self.name))
+
+    def create_capped(self, collection, size):
+        """ Creates a collection with a maximum size in bytes that keeps the insertion order, if it does not exist yet.
+
+        Only MongoDB has capped collections """
+        raise StorageError('The {} storage has no capped collections'.format(self.name))
+
+    def tail(self, collection, filter):
+        """ Returns an iterator with the documents of a capped collection that match a filter, that waits for new documents.
+
+        The iterator ends if the collection is empty or the cursor is lost. Only MongoDB has tailable cursors """
+        raise StorageError('The {} storage has no tailable cursors'.format(self.name))
+
+    def drop(self):
+        """ Removes all the collections """
+        raise NotImplementedError()
@@ -0,0 +1,288 @@
+""" A storage in the memory of the process, for tests and benchmarks.
+
+Documents are kept in a dictionary by _id for each collection, with dictionaries from the values
+of parentid, owner_id and name to the identifiers of the documents. Conditions on _id and
+on these fields select the candidates, and project.storage.query filters them.
+
+Documents are copied when they are written and read, so callers cannot change them by accident.
+As in MongoDB, each write is atomic only for a single document: use transaction() to undo
+several writes if one fails. Indexes with expireAfterSeconds do not remove documents.
+"""
+
+import contextlib
+import threading
+from project.storage import query
+from project.storage.base import Storage, StorageError, DuplicateKeyError, BulkWriteError, UpdateResult
+
+# fields with an index from their values to the documents
+INDEXED_FIELDS = ('parentid', 'owner_id', 'name')
+
+
+def _key(value):
+    """ Returns the key of a value in an index, or None if it cannot be indexed """
+    if value is None:
+        return None
+    return query.hash_key(value)
+
+
+def _keys(value):
+    """ Returns the keys of a field in an index: arrays are indexed by their elements """
+    if value is None:
+        return ()
+    if not isinstance(value, list):
+        key = query.hash_key(value)
+        return () if key is None else (key,)
+    return [key for key in (_key(element) for element in value) if key is not None]
+
+
+class MemoryStorage(Storage):
+    """ A storage in a dictionary """
+    name = 'memory'
+    shared = False
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # collection -> {_id: document}
+        self._documents = dict()
+        # collection -> {field: {key: {_id: None}}}. The inner dictionaries keep the insertion order
+        self._indexes = dict()
+        # collection -> {index name: options}
+        self._index_options = dict()
+        # collection -> {index name: {key: _id}}, for unique indexes
+        self._unique = dict()
+        # a copy of the documents when the transaction started
+        self._snapshot = None
+
+    # --------------------------------------- Indexes of the documents
+
+    def _collection(self, collection):
+        if collection not in self._documents:
+            self._documents[collection] = dict()
+            self._indexes[collection] = {field: dict() for field in INDEXED_FIELDS}
+            self._index_options.setdefault(collection, dict())
+            self._unique[collection] = {
+                name: dict() for name, options in self._index_options[collection].items() if options['unique']}
+        return self._documents[collection]
+
+    def _unique_key(self, collection, name, document):
+        """ Returns the key of a document in a unique index, or None if the document is not in the index """
+        options = self._index_options[collection][name]
+        if options['partialFilterExpression'] and not query.match(document, options['partialFilterExpression']):
+            return None
+        values = tuple(query.get_value(document, key, None) for key, _ in options['keys'])
+        try:
+            hash(values)
+        except TypeError:
+            return repr(values)
+        return tuple(_key(value) for value in values)
+
+    def _add(self, collection, document):
+        """ Saves a document and adds it to the indexes. Raises DuplicateKeyError """
+        documents = self._collection(collection)
+        _id = document['_id']
+        unique_keys = dict()
+        for name, values in self._unique[collection].items():
+            key = self._unique_key(collection, name, document)
+            if key is not None and values.get(key, _id) != _id:
+                raise DuplicateKeyError('Duplicate key in index {}: {}'.format(name, key))
+            unique_keys[name] = key
+        if _id in documents:
+            self._remove(collection, _id)
+        documents[_id] = document
+        for field, index in self._indexes[collection].items():
+            for key in _keys(document.get(field)):
+                index.setdefault(key, dict())[_id] = None
+        for name, key in unique_keys.items():
+            if key is not None:
+                self._unique[collection][name][key] = _id
+
+    def _remove(self, collection, _id):
+        """ Removes a document and its entries in the indexes """
+        document = self._documents[collection].pop(_id)
+        for field, index in self._indexes[collection].items():
+            for key in _keys(document.get(field)):
+                index.get(key, dict()).pop(_id, None)
+        for name, values in self._unique[collection].items():
+            key = self._unique_key(collection, name, document)
+            if key is not None and values.get(key) == _id:
+                del values[key]
+
+    def _candidates(self, collection, filter):
+        """ Returns the identifiers of the documents that can match a filter, or None if any document can """
+        candidates = None
+        for field, condition in filter.items():
+            if field != '_id' and field not in INDEXED_FIELDS:
+                continue
+            if query._is_operator_document(condition):
+                if '$in' not in condition:
+                    continue
+                values = condition['$in']
+            else:
+                values = [condition]
+            keys = [_key(value) for value in values]
+            if any(key is None for key in keys):
+                continue
+            if field == '_id':
+                found = [key[1] for key in keys]
+            else:
+                index = self._indexes[collection][field]
+                found = [_id for key in keys for _id in index.get(key, ())]
+            if candidates is None or len(found) < len(candidates):
+                candidates = found
+        return candidates
+
+    def _select(self, collection, filter):
+        """ Returns the stored documents that match a filter. Do not change them """
+        documents = self._collection(collection)
+        candidates = self._candidates(collection, filter)
+        if candidates is None:
+            selected = documents.values()
+        else:
+            selected = [documents[_id] for _id in dict.fromkeys(candidates) if _id in documents]
+        test = query.matcher(filter)
+        return [document for document in selected if test(document)]
+
+    # --------------------------------------- Reads
+
+    def find_many(self, collection, filter, projection=None, sort=None, limit=None, session=None):
+        with self._lock:
+            documents = self._select(collection, filter)
+            if sort:
+                documents = query.sort_documents(documents, sort)
+            if limit:
+                documents = documents[:limit]
+            return [query.copy_document(query.project(document, projection)) for document in documents]
+
+    def count(self, collection, filter):
+        with self._lock:
+            return len(self._select(collection, filter))
+
+    def distinct(self, collection, key, filter, session=None):
+        with self._lock:
+            return query.copy_document(query.distinct(self._select(collection, filter), key))
+
+    def aggregate(self, collection, pipeline):
+        with self._lock:
+            filter = dict()
+            if pipeline and '$match' in pipeline[0]:
+                filter = pipeline[0]['$match']
+                pipeline = pipeline[1:]
+            documents = query.aggregate(
+                self._select(collection, filter), pipeline,
+                lambda other, other_filter: self._select(other, other_filter))
+            return query.copy_document(documents)
+
+    # --------------------------------------- Writes
+
+    def insert(self, collection, documents, session=None):
+        with self._lock:
+            for document in documents:
+                if document['_id'] in self._collection(collection):
+                    raise DuplicateKeyError('Duplicate _id: {}'.format(document['_id']))
+                self._add(collection, query.copy_document(document))
+
+    def _update(self, collection, filter, update, multi=False, sort=None):
+        """ Updates documents. Returns (number of matched documents, number of changed documents, documents after the update) """
+        matched = 0
+        changed = 0
+        updated = []
+        with self._lock:
+            documents = self._select(collection, filter)
+            if sort:
+                documents = query.sort_documents(documents, sort)
+            for document in documents[:None if multi else 1]:
+                matched += 1
+                # stored documents are never changed in place, for the snapshots of transactions.
+                # Updates do not change arrays and embedded documents: a shallow copy is enough
+                new_document = dict(document)
+                if query.update(new_document, update):
+                    if new_document.get('_id') != document['_id']:
+                        raise StorageError('The _id of a document cannot change')
+                    self._add(collection, new_document)
+                    changed += 1
+                updated.append(new_document)
+        return matched, changed, updated
+
+    def update(self, collection, filter, update, multi=False, session=None):
+        matched, modified, _ = self._update(collection, filter, update, multi=multi)
+        return UpdateResult(matched, modified)
+
+    def find_and_update(self, collection, filter, update, projection=None, sort=None, session=None):
+        _, _, documents = self._update(collection, filter, update, sort=sort)
+        return query.copy_document(query.project(documents[0], projection)) if documents else None
+
+    def delete(self, collection, filter, session=None, limit=None):
+        with self._lock:
+            documents = self._select(collection, filter)[:limit]
+            for document in documents:
+                self._remove(collection, document['_id'])
+            return len(documents)
+
+    def bulk(self, collection, operations, session=None):
+        with self._lock:
+            for applied, operation in enumerate(operations):
+                try:
+                    if operation[0] == 'insert':
+                        self.insert(collection, [operation[1]])
+                    elif operation[0] == 'update':
+                        self.update(collection, operation[1], operation[2])
+                    elif operation[0] == 'delete':
+                        self.delete(collection, operation[1], limit=1)
+                    else:
+                        raise StorageError('Unknown operation: {}'.format(operation[0]))
+                except (StorageError, query.QueryError) as exc:
+                    raise BulkWriteError(str(exc), applied)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """ Other threads wait until the transaction finishes. If it fails, all its writes are undone """
+        with self._lock:
+            if self._snapshot is not None:
+                # nested: the outer transaction decides
+                yield self
+                return
+            self._snapshot = {collection: dict(documents) for collection, documents in self._documents.items()}
+            try:
+                yield self
+            except BaseException:
+                self._restore(self._snapshot)
+                raise
+            finally:
+                self._snapshot = None
+
+    def _restore(self, snapshot):
+        """ Restores the documents of a snapshot, and rebuilds the indexes """
+        self._documents = dict()
+        for collection, documents in snapshot.items():
+            self._collection(collection)
+            for document in documents.values():
+                self._add(collection, document)
+
+    # --------------------------------------- Indexes
+
+    def create_index(self, collection, keys, name, unique=False, partialFilterExpression=None, expireAfterSeconds=None):
+        with self._lock:
+            documents = self._collection(collection)
+            self._index_options[collection][name] = dict(
+                keys=keys, unique=unique, partialFilterExpression=partialFilterExpression)
+            if unique and name not in self._unique[collection]:
+                self._unique[collection][name] = values = dict()
+                for document in documents.values():
+                    key = self._unique_key(collection, name, document)
+                    if key is not None:
+                        if key in values:
+                            del self._index_options[collection][name]
+                            del self._unique[collection][name]
+                            raise StorageError('Duplicate key in index {}: {}'.format(name, key))
+                        values[key] = document['_id']
+
+    def index_names(self, collection):
+        with self._lock:
+            return list(self._index_options.get(collection, dict()))
+
+    def drop(self):
+        with self._lock:
+            self._documents = dict()
+            self._indexes = dict()
+            self._index_options = dict()
+            self._unique = dict()
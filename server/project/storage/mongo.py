@@ -0,0 +1,146 @@
+import contextlib
+import pymongo
+import pymongo.errors
+from project.storage.base import Storage, StorageError, StorageUnavailable, DuplicateKeyError, BulkWriteError, UpdateResult
+
+
+@contextlib.contextmanager
+def _errors():
+    """ Converts the errors of pymongo to the errors of the storage """
+    try:
+        yield
+    except pymongo.errors.DuplicateKeyError as exc:
+        raise DuplicateKeyError(str(exc))
+    except pymongo.errors.BulkWriteError as exc:
+        if any(error.get('code') == 11000 for error in exc.details.get('writeErrors', [])):
+            raise DuplicateKeyError(str(exc))
+        raise
+
+
+class MongoStorage(Storage):
+    """ A storage in a MongoDB database.
+
+    Attrs:
+        client: the pymongo.MongoClient
+        db: the pymongo database
+        use_transactions: if True, transaction() starts a transaction. Only for replica sets """
+    name = 'mongo'
+
+    def __init__(self, url, database, use_transactions=False):
+        self.client = pymongo.MongoClient(url)
+        self.db = self.client[database]
+        self.use_transactions = use_transactions
+
+    def find_one(self, collection, filter, projection=None, session=None):
+        return self.db[collection].find_one(filter, projection, session=session)
+
+    def find_many(self, collection, filter, projection=None, sort=None, limit=None, session=None):
+        cursor = self.db[collection].find(filter, projection, session=session)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        return cursor
+
+    def count(self, collection, filter):
+        return self.db[collection].count_documents(filter)
+
+    def distinct(self, collection, key, filter, session=None):
+        return self.db[collection].distinct(key, filter, session=session)
+
+    def insert(self, collection, documents, session=None):
+        with _errors():
+            self.db[collection].insert_many(documents, session=session)
+
+    def update(self, collection, filter, update, multi=False, session=None):
+        with _errors():
+            if multi:
+                result = self.db[collection].update_many(filter, update, session=session)
+            else:
+                result = self.db[collection].update_one(filter, update, session=session)
+        return UpdateResult(result.matched_count, result.modified_count)
+
+    def find_and_update(self, collection, filter, update, projection=None, sort=None, session=None):
+        with _errors():
+            return self.db[collection].find_one_and_update(
+                filter, update, projection=projection, sort=sort, session=session,
+                return_document=pymongo.ReturnDocument.AFTER)
+
+    def delete(self, collection, filter, session=None):
+        return self.db[collection].delete_many(filter, session=session).deleted_count
+
+    def bulk(self, collection, operations, session=None):
+        requests = []
+        for operation in operations:
+            if operation[0] == 'insert':
+                requests.append(pymongo.InsertOne(operation[1]))
+            elif operation[0] == 'update':
+                requests.append(pymongo.UpdateOne(operation[1], operation[2]))
+            elif operation[0] == 'delete':
+                requests.append(pymongo.DeleteOne(operation[1]))
+            else:
+                raise StorageError('Unknown operation: {}'.format(operation[0]))
+        if requests:
+            try:
+                self.db[collection].bulk_write(requests, session=session)
+            except pymongo.errors.BulkWriteError as exc:
+                # writes are ordered: they stop at the first error
+                errors = exc.details.get('writeErrors', [])
+                applied = errors[0]['index'] if errors else 0
+                raise BulkWriteError(str(errors[0].get('errmsg') if errors else exc), applied)
+
+    def aggregate(self, collection, pipeline):
+        return self.db[collection].aggregate(pipeline)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        if not self.use_transactions:
+            yield None
+            return
+        with self.client.start_session() as session:
+            with session.start_transaction():
+                yield session
+
+    def create_index(self, collection, keys, name, **options):
+        options = {key: value for key, value in options.items() if value is not None}
+        try:
+            self.db[collection].create_index(keys, name=name, **options)
+        except pymongo.errors.ConnectionFailure as exc:
+            raise StorageUnavailable(str(exc))
+        except pymongo.errors.PyMongoError as exc:
+            raise StorageError(str(exc))
+
+    def index_names(self, collection):
+        return [name for name in self.db[collection].index_information() if name != '_id_']
+
+    def unused_indexes(self, collection):
+        try:
+            return [
+                stats['name'] for stats in self.db[collection].aggregate([{'$indexStats': {}}])
+                if stats['name'] != '_id_' and stats['accesses']['ops'] == 0]
+        except pymongo.errors.OperationFailure:
+            return None
+
+    def watch(self, pipeline, **kwargs):
+        return self.db.watch(pipeline, **kwargs)
+
+    def create_capped(self, collection, size):
+        try:
+            self.db.create_collection(collection, capped=True, size=size)
+        except pymongo.errors.CollectionInvalid:
+            # it already exists
+            pass
+        except pymongo.errors.ConnectionFailure as exc:
+            raise StorageUnavailable(str(exc))
+        except pymongo.errors.PyMongoError as exc:
+            raise StorageError(str(exc))
+
+    def tail(self, collection, filter):
+        cursor = self.db[collection].find(filter, cursor_type=pymongo.CursorType.TAILABLE_AWAIT)
+        while cursor.alive:
+            # iterating stops when there are no new documents after a while, but the cursor is still alive
+            for document in cursor:
+                yield document
+
+    def drop(self):
+        self.client.drop_database(self.db.name)
@@ -0,0 +1,552 @@
+""" An evaluator of the subset of the MongoDB query language used by the model.
+
+Storages that are not MongoDB use it to filter, update, project and sort documents in Python:
+filters with comparisons, $in, $or, $exists, $regex and $type; updates with $set, $unset, $inc,
+$push and $pull, or with an aggregation pipeline of $set stages; and aggregations with $match,
+$lookup, $unwind, $sort, $project and $limit.
+
+Values are compared as MongoDB does: values of different types are never equal, ranges only
+match values of the same type, and sorting follows the BSON order of types.
+"""
+
+import copy
+import datetime
+import functools
+import re
+from bson.objectid import ObjectId
+
+_MISSING = object()
+
+
+class QueryError(Exception):
+    """ Raised for operators the evaluator does not support """
+    pass
+
+
+# --------------------------------------- Values
+
+
+# the position of the most common types in the BSON order of types
+_RANKS = {type(None): 1, int: 2, float: 2, str: 3, dict: 4, list: 5, tuple: 5, ObjectId: 7, bool: 8, datetime.datetime: 9}
+
+
+def _type_rank(value):
+    """ Returns the position of the type of a value in the BSON order of types """
+    rank = _RANKS.get(type(value))
+    if rank is not None:
+        return rank
+    if value is None or value is _MISSING:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, (list, tuple)):
+        return 5
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime.datetime):
+        return 9
+    return 10
+
+
+def compare(a, b):
+    """ Compares two values in the BSON order. Returns -1, 0 or 1 """
+    rank_a, rank_b = _type_rank(a), _type_rank(b)
+    if rank_a != rank_b:
+        return -1 if rank_a < rank_b else 1
+    if rank_a == 1:
+        return 0
+    if rank_a == 4:
+        return compare(list(a.items()), list(b.items()))
+    if rank_a == 5:
+        for value_a, value_b in zip(a, b):
+            result = compare(value_a, value_b)
+            if result != 0:
+                return result
+        return compare(len(a), len(b))
+    if isinstance(a, tuple):
+        return compare(list(a), list(b))
+    return -1 if a < b else (1 if a > b else 0)
+
+
+def equals(a, b):
+    return _type_rank(a) == _type_rank(b) and compare(a, b) == 0
+
+
+@functools.total_ordering
+class _Ordered(object):
+    """ A value that is compared in the BSON order, for values Python cannot compare """
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return compare(self.value, other.value) == 0
+
+    def __lt__(self, other):
+        return compare(self.value, other.value) < 0
+
+
+def _sort_value(value):
+    rank = _type_rank(value)
+    if rank == 1:
+        return (1, 0)
+    if rank in (2, 3, 7, 8, 9):
+        return (rank, value)
+    return (rank, _Ordered(value))
+
+
+def sort_documents(documents, sort):
+    """ Returns a list with the documents sorted by a list of (key, direction) """
+    documents = list(documents)
+    # sorts are stable: sort by the last key first
+    for key, direction in reversed(sort):
+        documents.sort(key=lambda document: _sort_value(get_value(document, key, None)), reverse=direction < 0)
+    return documents
+
+
+def copy_document(value):
+    """ A deep copy of a document, faster than copy.deepcopy(): only dictionaries and lists are copied """
+    if isinstance(value, dict):
+        return {key: copy_document(element) if isinstance(element, (dict, list)) else element for key, element in value.items()}
+    if isinstance(value, list):
+        return [copy_document(element) if isinstance(element, (dict, list)) else element for element in value]
+    return value
+
+
+# --------------------------------------- Paths
+
+
+def get_value(document, path, default=_MISSING):
+    """ Returns the value of a dotted path in a document, without looking into arrays """
+    value = document
+    for part in path.split('.'):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return default
+    return value
+
+
+def _candidates(value, parts):
+    """ Returns the values of a path, looking into arrays as MongoDB does """
+    if not parts:
+        return [value]
+    part, rest = parts[0], parts[1:]
+    if isinstance(value, dict):
+        return _candidates(value[part], rest) if part in value else [_MISSING]
+    if isinstance(value, list):
+        if part.isdigit():
+            return _candidates(value[int(part)], rest) if int(part) < len(value) else [_MISSING]
+        found = []
+        for element in value:
+            if isinstance(element, dict) and part in element:
+                found.extend(_candidates(element[part], rest))
+        return found or [_MISSING]
+    return [_MISSING]
+
+
+def _set_value(document, path, value):
+    """ Sets the value of a dotted path. Embedded documents in the path are copied, not changed """
+    parts = path.split('.')
+    for part in parts[:-1]:
+        embedded = document.get(part)
+        document[part] = dict(embedded) if isinstance(embedded, dict) else dict()
+        document = document[part]
+    document[parts[-1]] = value
+
+
+def _unset_value(document, path):
+    """ Removes a dotted path. Embedded documents in the path are copied, not changed """
+    parts = path.split('.')
+    for part in parts[:-1]:
+        embedded = document.get(part)
+        if not isinstance(embedded, dict) or parts[-1] not in embedded:
+            return
+        document[part] = dict(embedded)
+        document = document[part]
+    document.pop(parts[-1], None)
+
+
+# --------------------------------------- Filters
+
+
+_TYPES = {
+    'null': (1, ), 'number': (2, ), 'double': (2, ), 'int': (2, ), 'long': (2, ), 'string': (3, ),
+    'object': (4, ), 'array': (5, ), 'objectId': (7, ), 'bool': (8, ), 'date': (9, )
+}
+
+_RANGES = {
+    '$lt': lambda result: result < 0, '$lte': lambda result: result <= 0,
+    '$gt': lambda result: result > 0, '$gte': lambda result: result >= 0
+}
+
+
+def hash_key(value):
+    """ Returns a hashable key that is the same for values that are equal in MongoDB, or None for arrays and objects """
+    if isinstance(value, (dict, list)):
+        return None
+    return (_type_rank(value), value)
+
+
+def _present(candidates):
+    """ Returns the values of the candidates that exist. Arrays are returned as a whole and by their elements """
+    values = [value for value in candidates if value is not _MISSING]
+    return values + [element for value in values if isinstance(value, list) for element in value]
+
+
+def _value_test(expected):
+    """ Returns a function(candidates) that is True if any candidate is equal to expected, or contains it if it is an array """
+    if expected is None:
+        return lambda candidates: any(value is _MISSING or value is None or (
+            isinstance(value, list) and None in value) for value in candidates)
+    if isinstance(expected, (dict, list)):
+        return lambda candidates: any(equals(value, expected) for value in _present(candidates))
+    rank = _type_rank(expected)
+
+    def test(candidates):
+        for value in candidates:
+            if isinstance(value, list):
+                if any(_type_rank(element) == rank and element == expected for element in value):
+                    return True
+            elif value is not _MISSING and _type_rank(value) == rank and value == expected:
+                return True
+        return False
+    return test
+
+
+def _in_test(values):
+    """ Returns a function(candidates) for $in. Hashable values are searched in a set """
+    keys = set(hash_key(value) for value in values if value is not None and hash_key(value) is not None)
+    others = [_value_test(value) for value in values if value is None or hash_key(value) is None]
+
+    def test(candidates):
+        for value in candidates:
+            if isinstance(value, list):
+                if any(hash_key(element) in keys for element in value):
+                    return True
+            elif value is not _MISSING and hash_key(value) in keys:
+                return True
+        return any(other(candidates) for other in others)
+    return test
+
+
+def _range_test(accept, argument):
+    """ Returns a function(candidates) for $lt, $lte, $gt and $gte. Only values of the same type are compared """
+    rank = _type_rank(argument)
+
+    def test(candidates):
+        for value in candidates:
+            for value in (value if isinstance(value, list) else (value, )):
+                if _type_rank(value) == rank and accept(compare(value, argument)):
+                    return True
+        return False
+    return test
+
+
+def _operator_test(operator, argument):
+    """ Returns a function(candidates) for an operator of a condition """
+    if operator == '$eq':
+        return _value_test(argument)
+    if operator == '$ne':
+        test = _value_test(argument)
+        return lambda candidates: not test(candidates)
+    if operator == '$in':
+        return _in_test(argument)
+    if operator == '$nin':
+        test = _in_test(argument)
+        return lambda candidates: not test(candidates)
+    if operator in _RANGES:
+        return _range_test(_RANGES[operator], argument)
+    if operator == '$exists':
+        return lambda candidates: any(value is not _MISSING for value in candidates) == bool(argument)
+    if operator == '$not':
+        test = _condition_test(argument)
+        return lambda candidates: not test(candidates)
+    if operator == '$regex':
+        pattern = re.compile(argument) if isinstance(argument, str) else argument
+        return lambda candidates: any(isinstance(value, str) and pattern.search(value) for value in _present(candidates))
+    if operator == '$type':
+        types = argument if isinstance(argument, list) else [argument]
+        ranks = set(rank for name in types for rank in _TYPES.get(name, ()))
+        return lambda candidates: any(
+            _type_rank(value) in ranks for value in _present(candidates) if value is not None) or (
+            1 in ranks and any(value is None for value in candidates))
+    raise QueryError('Operator not supported: {}'.format(operator))
+
+
+def _is_operator_document(condition):
+    return isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition)
+
+
+def _condition_test(condition):
+    if _is_operator_document(condition):
+        tests = [_operator_test(operator, argument) for operator, argument in condition.items()]
+        return lambda candidates: all(test(candidates) for test in tests)
+    return _value_test(condition)
+
+
+def matcher(filter):
+    """ Returns a function(document) that is True if the document matches a filter.
+
+    Use it to filter many documents: the filter is parsed only once """
+    tests = []
+    for key, condition in filter.items():
+        if key in ('$or', '$and', '$nor'):
+            branches = [matcher(branch) for branch in condition]
+            if key == '$or':
+                tests.append(lambda document, branches=branches: any(branch(document) for branch in branches))
+            elif key == '$and':
+                tests.append(lambda document, branches=branches: all(branch(document) for branch in branches))
+            else:
+                tests.append(lambda document, branches=branches: not any(branch(document) for branch in branches))
+        elif key.startswith('$'):
+            raise QueryError('Operator not supported: {}'.format(key))
+        else:
+            parts = key.split('.')
+            test = _condition_test(condition)
+            if len(parts) == 1:
+                # the most common case: a field of the document
+                tests.append(lambda document, key=key, test=test: test([document.get(key, _MISSING)]))
+            else:
+                tests.append(lambda document, parts=parts, test=test: test(_candidates(document, parts)))
+    return lambda document: all(test(document) for test in tests)
+
+
+def match(document, filter):
+    """ Returns True if a document matches a filter """
+    return matcher(filter)(document)
+
+
+def distinct(documents, key):
+    """ Returns a list with the distinct values of a key in some documents. Arrays add each of their elements """
+    values = []
+    seen = set()
+    for document in documents:
+        value = get_value(document, key, None)
+        for value in (value if isinstance(value, list) else [value]):
+            if value is None:
+                continue
+            try:
+                marker = (_type_rank(value), value)
+                if marker in seen:
+                    continue
+                seen.add(marker)
+            except TypeError:
+                # not hashable
+                if any(equals(value, other) for other in values):
+                    continue
+            values.append(value)
+    return values
+
+
+# --------------------------------------- Projections
+
+
+def project(document, projection):
+    """ Returns the fields of a document in a projection. Only inclusions, or only exclusions, are supported """
+    if not projection:
+        return document
+    include_id = projection.get('_id', 1)
+    fields = {key: value for key, value in projection.items() if key != '_id'}
+    if fields and all(not value for value in fields.values()):
+        result = copy.copy(document)
+        for key in fields:
+            _unset_value(result, key)
+        if not include_id:
+            result.pop('_id', None)
+        return result
+    result = dict()
+    if include_id and '_id' in document:
+        result['_id'] = document['_id']
+    for key in fields:
+        value = get_value(document, key)
+        if value is not _MISSING:
+            _set_value(result, key, value)
+    return result
+
+
+# --------------------------------------- Updates
+
+
+def _evaluate(expression, document, variables):
+    """ Evaluates an aggregation expression """
+    if isinstance(expression, str) and expression.startswith('$$'):
+        name, _, path = expression[2:].partition('.')
+        value = variables.get(name, None)
+        return get_value(value, path, None) if path else value
+    if isinstance(expression, str) and expression.startswith('$'):
+        return get_value(document, expression[1:], None)
+    if isinstance(expression, list):
+        return [_evaluate(element, document, variables) for element in expression]
+    if not isinstance(expression, dict):
+        return expression
+    if len(expression) != 1 or not next(iter(expression)).startswith('$'):
+        return {key: _evaluate(value, document, variables) for key, value in expression.items()}
+
+    operator, argument = next(iter(expression.items()))
+    if operator == '$literal':
+        return argument
+    if operator == '$filter':
+        name = argument.get('as', 'this')
+        values = _evaluate(argument['input'], document, variables) or []
+        return [value for value in values if _evaluate(argument['cond'], document, dict(variables, **{name: value}))]
+    if operator == '$dateFromString':
+        date_string = _evaluate(argument['dateString'], document, variables)
+        if date_string is None:
+            return _evaluate(argument.get('onNull'), document, variables)
+        try:
+            return datetime.datetime.strptime(date_string, argument.get('format', '%Y-%m-%dT%H:%M:%S.%fZ'))
+        except (TypeError, ValueError):
+            if 'onError' not in argument:
+                raise QueryError('Cannot parse a date: {}'.format(date_string))
+            return _evaluate(argument['onError'], document, variables)
+    if operator == '$dateToString':
+        date = _evaluate(argument['date'], document, variables)
+        if date is None:
+            return _evaluate(argument.get('onNull'), document, variables)
+        return date.strftime(argument.get('format', '%Y-%m-%dT%H:%M:%S.%fZ'))
+    arguments = _evaluate(argument if isinstance(argument, list) else [argument], document, variables)
+    if operator == '$concatArrays':
+        return [value for values in arguments for value in (values or [])]
+    if operator == '$not':
+        return not arguments[0]
+    if operator == '$in':
+        return any(equals(arguments[0], value) for value in arguments[1])
+    if operator == '$ifNull':
+        return arguments[1] if arguments[0] is None else arguments[0]
+    if operator == '$add':
+        if any(value is None for value in arguments):
+            return None
+        dates = [value for value in arguments if isinstance(value, datetime.datetime)]
+        total = sum(value for value in arguments if not isinstance(value, datetime.datetime))
+        return dates[0] + datetime.timedelta(milliseconds=total) if dates else total
+    raise QueryError('Operator not supported: {}'.format(operator))
+
+
+def _pull(values, condition):
+    if _is_operator_document(condition):
+        test = _condition_test(condition)
+        return [value for value in values if not test([value])]
+    if isinstance(condition, dict):
+        test = matcher(condition)
+        return [value for value in values if not (isinstance(value, dict) and test(value))]
+    return [value for value in values if not equals(value, condition)]
+
+
+def update(document, update_document):
+    """ Applies an update to a document, in place.
+
+    Only the fields of the document are replaced: arrays and embedded documents are never changed,
+    so a shallow copy of the document made before the update keeps the previous values.
+
+    Args:
+        update_document: a dictionary of update operators, or a list of $set and $unset stages
+
+    Returns:
+        True if the document changed """
+    before = dict(document)
+    if isinstance(update_document, list):
+        for stage in update_document:
+            for operator, argument in stage.items():
+                if operator in ('$set', '$addFields'):
+                    values = {key: _evaluate(value, document, dict()) for key, value in argument.items()}
+                    for key, value in values.items():
+                        _set_value(document, key, value)
+                elif operator == '$unset':
+                    for key in (argument if isinstance(argument, list) else [argument]):
+                        _unset_value(document, key)
+                else:
+                    raise QueryError('Stage not supported in updates: {}'.format(operator))
+        return document != before
+
+    for operator, argument in update_document.items():
+        for key, value in argument.items():
+            if operator == '$set':
+                _set_value(document, key, copy_document(value))
+            elif operator == '$unset':
+                _unset_value(document, key)
+            elif operator == '$inc':
+                _set_value(document, key, get_value(document, key, 0) + value)
+            elif operator == '$push':
+                values = list(get_value(document, key, []))
+                if _is_operator_document(value):
+                    new_values = copy_document(value['$each'])
+                    position = value.get('$position', len(values))
+                    values[position:position] = new_values
+                else:
+                    values.append(copy_document(value))
+                _set_value(document, key, values)
+            elif operator == '$pull':
+                values = get_value(document, key, _MISSING)
+                if isinstance(values, list):
+                    _set_value(document, key, _pull(values, value))
+            else:
+                raise QueryError('Operator not supported: {}'.format(operator))
+    return document != before
+
+
+# --------------------------------------- Aggregations
+
+
+def aggregate(documents, pipeline, find):
+    """ Runs an aggregation pipeline on some documents.
+
+    Args:
+        documents: an iterable with the documents of the collection. They are not modified
+        pipeline: a list of $match, $lookup, $unwind, $sort, $project and $limit stages
+        find: a function (collection, filter) that returns the documents of another collection, for $lookup
+
+    Returns:
+        A list with the resulting documents """
+    documents = iter(documents)
+    for stage in pipeline:
+        operator, argument = next(iter(stage.items()))
+        if operator == '$match':
+            test = matcher(argument)
+            documents = [document for document in documents if test(document)]
+        elif operator == '$sort':
+            documents = sort_documents(documents, list(argument.items()))
+        elif operator == '$project':
+            documents = [project(document, argument) for document in documents]
+        elif operator == '$limit':
+            documents = list(documents)[:argument]
+        elif operator == '$unwind':
+            path = argument[1:]
+            if '.' in path:
+                raise QueryError('Only fields of the document can be unwound: {}'.format(argument))
+            documents = [
+                dict(copy.copy(document), **{path: value})
+                for document in documents for value in (document.get(path) or [])]
+        elif operator == '$lookup':
+            documents = _lookup(list(documents), argument, find)
+        else:
+            raise QueryError('Stage not supported: {}'.format(operator))
+    return list(documents)
+
+
+def _lookup(documents, argument, find):
+    """ Joins documents with the documents in another collection, with a single query """
+    local_values = [get_value(document, argument['localField'], None) for document in documents]
+    keys = [value for value in local_values if value is not None]
+    foreign = find(argument['from'], {argument['foreignField']: {'$in': keys}}) if keys else []
+    by_key = dict()
+    for info in foreign:
+        by_key.setdefault(hash_key(get_value(info, argument['foreignField'], None)), []).append(info)
+    pipeline = argument.get('pipeline', [])
+    joined = []
+    for document, value in zip(documents, local_values):
+        if hash_key(value) is not None:
+            matches = by_key.get(hash_key(value), [])
+        else:
+            matches = [info for info in foreign if equals(get_value(info, argument['foreignField'], None), value)]
+        if pipeline:
+            matches = aggregate(matches, pipeline, find)
+        joined.append(dict(copy.copy(document), **{argument['as']: matches}))
+    return joined
@@ -0,0 +1,350 @@
+""" A storage in an SQLite database, for small deployments without a MongoDB server.
+
+Each collection is a table with the document as JSON, and some fields copied to columns
+with an index: parentid, owner_id and due_date. Conditions on these columns and on _id are
+run by SQLite, and then the documents are filtered, updated and sorted in Python with
+project.storage.query. Reads sorted by _id, parentid, owner_id or updated_at are sorted by SQLite,
+and they stop reading rows at the limit. Other sorts read and decode all the matching documents.
+
+The database is in WAL mode, so readers do not wait for writers. Each thread has its own
+connection, and each write is a transaction: transaction() groups several writes.
+"""
+
+import contextlib
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+from bson.objectid import ObjectId
+from project.storage import query
+from project.storage.base import Storage, StorageError, DuplicateKeyError, BulkWriteError, UpdateResult
+
+# fields copied to columns. parentid, owner_id and due_date have an index. updated_at and name are
+# used by the indexes of the model
+COLUMNS = ('parentid', 'owner_id', 'due_date', 'updated_at', 'name')
+INDEXED_COLUMNS = ('parentid', 'owner_id', 'due_date')
+# columns that SQLite sorts as MongoDB: their values are always ObjectIds or dates
+SORTED_COLUMNS = ('_id', 'parentid', 'owner_id', 'updated_at')
+
+# expired documents are removed at most once in this number of seconds
+EXPIRE_INTERVAL = 60
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _encode_value(value):
+    if isinstance(value, ObjectId):
+        return {'$oid': str(value)}
+    if isinstance(value, datetime.datetime):
+        delta = value - _EPOCH
+        return {'$date': (delta.days * 86400 + delta.seconds) * 1000 + delta.microseconds // 1000}
+    raise TypeError('Cannot store a value of type {}'.format(type(value).__name__))
+
+
+def _decode_value(value):
+    if len(value) == 1:
+        if '$oid' in value:
+            return ObjectId(value['$oid'])
+        if '$date' in value:
+            return _EPOCH + datetime.timedelta(milliseconds=value['$date'])
+    return value
+
+
+def encode(document):
+    """ Returns a document as JSON. Dates are saved with the precision of milliseconds, as in MongoDB """
+    return json.dumps(document, default=_encode_value, separators=(',', ':'))
+
+
+def decode(text):
+    return json.loads(text, object_hook=_decode_value)
+
+
+def _sql_value(value):
+    """ Returns the value of a column for a value in a document or a filter, or None if it has no column value """
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%dT%H:%M:%S.%f')
+    if isinstance(value, (str, int, float)):
+        return value
+    return None
+
+
+def _row_value(document, key):
+    value = document.get(key)
+    if isinstance(value, datetime.datetime):
+        # the same precision as the saved document
+        value = value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return _sql_value(value)
+
+
+def _sql_filter(filter):
+    """ Returns a WHERE clause and its parameters for the conditions of a filter on columns.
+
+    The clause selects the same documents as the filter, or more: the documents must be filtered again """
+    clauses = []
+    params = []
+    for key, condition in filter.items():
+        if key != '_id' and key not in COLUMNS:
+            continue
+        column = '"{}"'.format(key)
+        conditions = condition.items() if query._is_operator_document(condition) else [('$eq', condition)]
+        for operator, argument in conditions:
+            if operator == '$in':
+                values = [_sql_value(value) for value in argument]
+                if all(value is not None for value in values):
+                    clauses.append('{} IN (SELECT value FROM json_each(?))'.format(column))
+                    params.append(json.dumps(values))
+                continue
+            value = _sql_value(argument)
+            if value is None or isinstance(argument, bool):
+                continue
+            if operator == '$eq':
+                clauses.append('{} = ?'.format(column))
+            elif operator in ('$lt', '$lte', '$gt', '$gte'):
+                clauses.append('{} {} ?'.format(column, dict(lt='<', lte='<=', gt='>', gte='>=')[operator[1:]]))
+            else:
+                continue
+            params.append(value)
+    return ' AND '.join(clauses) or '1', params
+
+
+class SQLiteStorage(Storage):
+    """ A storage in an SQLite file """
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._tables = set()
+        # collection -> (key, seconds) of the index with expireAfterSeconds
+        self._ttl = dict()
+        self._expired_at = dict()
+
+    # --------------------------------------- Connections and transactions
+
+    def _connection(self):
+        """ Returns the connection of this thread and process """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @contextlib.contextmanager
+    def transaction(self):
+        connection = self._connection()
+        if connection.in_transaction:
+            # nested: the outer transaction commits
+            yield self
+            return
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield self
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _table(self, collection):
+        """ Returns the quoted name of the table of a collection, and creates it if it does not exist """
+        if collection not in self._tables:
+            with self._lock:
+                connection = self._connection()
+                connection.execute('CREATE TABLE IF NOT EXISTS "{}" (_id PRIMARY KEY, {}, doc TEXT NOT NULL)'.format(
+                    collection, ', '.join('"{}"'.format(column) for column in COLUMNS)))
+                for column in INDEXED_COLUMNS:
+                    connection.execute('CREATE INDEX IF NOT EXISTS "{0}:{1}" ON "{0}" ("{1}")'.format(collection, column))
+                if not connection.in_transaction:
+                    # else, the table is created only if the transaction commits
+                    self._tables.add(collection)
+        return '"{}"'.format(collection)
+
+    def _select(self, collection, filter, sort=(), lazy=False):
+        """ Yields (rowid, document) for the documents that match a filter, in the order they were inserted.
+
+        Args:
+            sort: a list of (column, direction) to sort the documents first
+            lazy: if True, rows are read while the documents are yielded. Do not write until the end """
+        where, params = _sql_filter(filter)
+        order = ['"{}" {}'.format(column, 'DESC' if direction < 0 else 'ASC') for column, direction in sort] + ['rowid']
+        rows = self._connection().execute(
+            'SELECT rowid, doc FROM {} WHERE {} ORDER BY {}'.format(self._table(collection), where, ', '.join(order)), params)
+        if not lazy:
+            rows = rows.fetchall()
+        test = query.matcher(filter)
+        for rowid, text in rows:
+            document = decode(text)
+            if test(document):
+                yield rowid, document
+
+    def _write_rows(self, collection, documents):
+        """ Saves documents that changed. documents is a list of (rowid, document) """
+        self._connection().executemany(
+            'UPDATE {} SET {}, doc = ? WHERE rowid = ?'.format(
+                self._table(collection), ', '.join('"{}" = ?'.format(column) for column in COLUMNS)),
+            [[_row_value(document, column) for column in COLUMNS] + [encode(document), rowid] for rowid, document in documents])
+
+    def _expire(self, collection):
+        """ Removes the expired documents of a collection with an index with expireAfterSeconds """
+        if collection not in self._ttl or self._expired_at.get(collection, 0) > time.time() - EXPIRE_INTERVAL:
+            return
+        self._expired_at[collection] = time.time()
+        key, seconds = self._ttl[collection]
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=seconds)
+        self.delete(collection, {key: {'$lt': cutoff}})
+
+    # --------------------------------------- Reads
+
+    def find_many(self, collection, filter, projection=None, sort=None, limit=None, session=None):
+        self._expire(collection)
+        if sort and any(key not in SORTED_COLUMNS for key, _ in sort):
+            documents = query.sort_documents((document for _, document in self._select(collection, filter)), sort)
+        else:
+            documents = (document for _, document in self._select(collection, filter, sort=sort or (), lazy=True))
+        result = []
+        for document in documents:
+            if limit and len(result) >= limit:
+                break
+            result.append(query.project(document, projection))
+        return result
+
+    def count(self, collection, filter):
+        return sum(1 for _ in self._select(collection, filter))
+
+    def distinct(self, collection, key, filter, session=None):
+        return query.distinct((document for _, document in self._select(collection, filter)), key)
+
+    def aggregate(self, collection, pipeline):
+        filter = dict()
+        if pipeline and '$match' in pipeline[0]:
+            filter = pipeline[0]['$match']
+            pipeline = pipeline[1:]
+        return query.aggregate(
+            (document for _, document in self._select(collection, filter)), pipeline,
+            lambda other, other_filter: self.find_many(other, other_filter))
+
+    # --------------------------------------- Writes
+
+    def insert(self, collection, documents, session=None):
+        table = self._table(collection)
+        with self.transaction():
+            try:
+                self._connection().executemany(
+                    'INSERT INTO {} (_id, {}, doc) VALUES (?, {}, ?)'.format(
+                        table, ', '.join('"{}"'.format(column) for column in COLUMNS), ', '.join('?' for _ in COLUMNS)),
+                    [[_sql_value(document['_id'])] + [_row_value(document, column) for column in COLUMNS] + [encode(document)]
+                     for document in documents])
+            except sqlite3.IntegrityError as exc:
+                raise DuplicateKeyError(str(exc))
+        self._expire(collection)
+
+    def _update(self, collection, filter, update, multi=False, sort=None):
+        """ Updates documents. Returns (number of matched documents, list of the documents after the update) """
+        matched = 0
+        changed = []
+        documents = []
+        with self.transaction():
+            rows = self._select(collection, filter)
+            if sort:
+                rows = list(rows)
+                rowids = {id(document): rowid for rowid, document in rows}
+                rows = [(rowids[id(document)], document) for document in query.sort_documents([row[1] for row in rows], sort)]
+            for rowid, document in rows:
+                matched += 1
+                _id = document.get('_id')
+                if query.update(document, update):
+                    if document.get('_id') != _id:
+                        raise StorageError('The _id of a document cannot change')
+                    changed.append((rowid, document))
+                documents.append(document)
+                if not multi:
+                    break
+            try:
+                self._write_rows(collection, changed)
+            except sqlite3.IntegrityError as exc:
+                raise DuplicateKeyError(str(exc))
+        return matched, len(changed), documents
+
+    def update(self, collection, filter, update, multi=False, session=None):
+        matched, modified, _ = self._update(collection, filter, update, multi=multi)
+        return UpdateResult(matched, modified)
+
+    def find_and_update(self, collection, filter, update, projection=None, sort=None, session=None):
+        _, _, documents = self._update(collection, filter, update, sort=sort)
+        return query.project(documents[0], projection) if documents else None
+
+    def delete(self, collection, filter, session=None):
+        with self.transaction():
+            rowids = [rowid for rowid, _ in self._select(collection, filter)]
+            if rowids:
+                self._connection().execute(
+                    'DELETE FROM {} WHERE rowid IN (SELECT value FROM json_each(?))'.format(self._table(collection)),
+                    [json.dumps(rowids)])
+        return len(rowids)
+
+    def bulk(self, collection, operations, session=None):
+        try:
+            with self.transaction():
+                for operation in operations:
+                    if operation[0] == 'insert':
+                        self.insert(collection, [operation[1]])
+                    elif operation[0] == 'update':
+                        self.update(collection, operation[1], operation[2])
+                    elif operation[0] == 'delete':
+                        rows = list(self._select(collection, operation[1]))[:1]
+                        if rows:
+                            self._connection().execute('DELETE FROM {} WHERE rowid = ?'.format(self._table(collection)), [rows[0][0]])
+                    else:
+                        raise StorageError('Unknown operation: {}'.format(operation[0]))
+        except (StorageError, query.QueryError) as exc:
+            # the transaction undid every operation
+            raise BulkWriteError(str(exc), 0)
+
+    # --------------------------------------- Indexes
+
+    def create_index(self, collection, keys, name, unique=False, partialFilterExpression=None, expireAfterSeconds=None):
+        expressions = []
+        for key, direction in keys:
+            if key == '_id' or key in COLUMNS:
+                expression = '"{}"'.format(key)
+            else:
+                expression = "json_extract(doc, '$.{}')".format(key.replace("'", "''"))
+            expressions.append('{} {}'.format(expression, 'DESC' if direction == -1 else 'ASC'))
+        where = ''
+        if partialFilterExpression:
+            conditions = []
+            for key, condition in partialFilterExpression.items():
+                if key not in COLUMNS or condition != {'$type': 'string'}:
+                    raise StorageError('Partial filter not supported: {}'.format(partialFilterExpression))
+                conditions.append('typeof("{}") = \'text\''.format(key))
+            where = ' WHERE ' + ' AND '.join(conditions)
+        try:
+            self._connection().execute('CREATE {}INDEX IF NOT EXISTS "{}__{}" ON {} ({}){}'.format(
+                'UNIQUE ' if unique else '', collection, name, self._table(collection), ', '.join(expressions), where))
+        except sqlite3.DatabaseError as exc:
+            raise StorageError(str(exc))
+        if expireAfterSeconds is not None:
+            self._ttl[collection] = (keys[0][0], expireAfterSeconds)
+
+    def index_names(self, collection):
+        prefix = '{}__'.format(collection)
+        rows = self._connection().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?", [collection]).fetchall()
+        return [row[0][len(prefix):] for row in rows if row[0].startswith(prefix)]
+
+    def drop(self):
+        with self._lock:
+            connection = self._connection()
+            tables = connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+            for row in tables:
+                connection.execute('DROP TABLE IF EXISTS "{}"'.format(row[0]))
+            self._tables = set()
+            self._ttl = dict()
+            self._expired_at = dict()
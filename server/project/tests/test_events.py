@@ -0,0 +1,70 @@
+import unittest
+import project.server.events as events
+
+
+class TestEvents(unittest.TestCase):
+    def setUp(self):
+        events.configure(dict(EVENTS_QUEUE_SIZE=2))
+        self.owner = events.subscribe('USER1')
+        self.other = events.subscribe('USER2')
+
+    def tearDown(self):
+        events.unsubscribe(self.owner)
+        events.unsubscribe(self.other)
+
+    def test_visibility(self):
+        " Private changes are sent only to the owner, public changes to everybody "
+        events.notify('items', ['ITEM1'], 'saved', owner_id='USER1', private=True, parentid='CK1')
+        events.notify('checklists', ['CK2'], 'deleted', owner_id='USER1', private=False)
+        # users are not notified
+        events.notify('users', ['USER1'], 'saved', owner_id='USER1', private=False)
+
+        self.assertEqual(self.owner.get(0), dict(action='saved', data=dict(collection='items', _id='ITEM1', parentid='CK1')))
+        self.assertEqual(self.owner.get(0), dict(action='deleted', data=dict(collection='checklists', _id='CK2')))
+        self.assertEqual(self.owner.get(0), None)
+        self.assertEqual(self.other.get(0), dict(action='deleted', data=dict(collection='checklists', _id='CK2')))
+        self.assertEqual(self.other.get(0), None)
+
+    def test_overflow(self):
+        " Slow clients get a reset event instead of the events they lost "
+        events.notify('items', ['ITEM1', 'ITEM2', 'ITEM3'], 'saved', owner_id='USER1')
+        self.assertEqual(self.owner.get(0)['action'], 'reset')
+        self.assertEqual(self.owner.get(0), None)
+
+    def test_unsubscribe(self):
+        " Closed subscriptions do not receive events "
+        self.assertEqual(events.subscribers(), 2)
+        events.unsubscribe(self.other)
+        self.assertEqual(events.subscribers(), 1)
+        events.notify('items', ['ITEM1'], 'saved', owner_id='USER2', private=False)
+        self.assertEqual(self.other.get(0), None)
+
+    def test_limits(self):
+        " Subscriptions are refused beyond EVENTS_MAX_SUBSCRIPTIONS, or if events cannot reach this process "
+        events.configure(dict(EVENTS_MAX_SUBSCRIPTIONS=3))
+        subscription = events.subscribe('USER3')
+        with self.assertRaises(events.Unavailable):
+            events.subscribe('USER3')
+        events.unsubscribe(subscription)
+        events.configure(dict(SERVER_PROCESSES=2))
+        with self.assertRaises(events.Unavailable):
+            events.subscribe('USER3')
+        self.assertEqual(events.subscribers(), 2)
+
+    def test_change_stream(self):
+        " Changes from a change stream are published, and deletions come from the tombstones "
+        events._publish_change(dict(
+            ns=dict(coll='items'), documentKey=dict(_id='ITEM1'),
+            fullDocument=dict(owner_id='USER1', private=True, parentid='CK1')))
+        events._publish_change(dict(
+            ns=dict(coll='tombstones'), documentKey=dict(_id='T1'),
+            fullDocument=dict(owner_id='USER1', private=True, collection='items', element_id='ITEM2')))
+        events._publish_change(dict(ns=dict(coll='items'), documentKey=dict(_id='ITEM3')))
+        self.assertEqual(self.owner.get(0), dict(action='saved', data=dict(collection='items', _id='ITEM1', parentid='CK1')))
+        self.assertEqual(self.owner.get(0), dict(action='deleted', data=dict(collection='items', _id='ITEM2')))
+        self.assertEqual(self.owner.get(0), None)
+        self.assertEqual(self.other.get(0), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import project.server.invalidations as invalidations
+from bson.objectid import ObjectId
+from project.storage import StorageUnavailable
+from project.storage.memory import MemoryStorage
+
+
+class SharedStorage(MemoryStorage):
+    """ A storage that other processes use, as MongoDB. The capped collection cannot be created the first time """
+    shared = True
+    name = 'mongo'
+
+    def __init__(self):
+        super().__init__()
+        self.attempts = 0
+
+    def create_capped(self, collection, size):
+        self.attempts += 1
+        if self.attempts == 1:
+            raise StorageUnavailable('Server not available')
+
+
+class TestInvalidations(unittest.TestCase):
+    def setUp(self):
+        self.storage = SharedStorage()
+        self.invalidated = []
+
+    def configure(self, storage, **config):
+        return invalidations.configure(config, storage, lambda collection, ids: self.invalidated.append((collection, ids)), lambda: None)
+
+    def test_configure(self):
+        " The storage is not used until an invalidation is published "
+        self.assertTrue(self.configure(self.storage))
+        self.assertEqual(self.storage.attempts, 0)
+        self.assertFalse(self.configure(self.storage, CACHE_INVALIDATIONS=False))
+        self.assertFalse(invalidations.listen())
+        # documents in the memory of this process: the cache is always used
+        self.assertTrue(self.configure(MemoryStorage()))
+        self.assertTrue(invalidations.listen())
+
+    def test_publish(self):
+        " Changes are published after the capped collection could not be created "
+        self.configure(self.storage)
+        _id = ObjectId()
+        invalidations.publish('groups', [_id])
+        invalidations.publish('groups', [_id])
+        self.assertEqual(self.invalidated, [('groups', [_id])] * 2)
+        self.assertEqual(self.storage.attempts, 2)
+        self.assertEqual([info['ids'] for info in self.storage.find_many(invalidations.COLLECTION, {})], [[_id]])
+
+
+if __name__ == '__main__':
+    unittest.main()
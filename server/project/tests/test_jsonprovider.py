@@ -0,0 +1,45 @@
+import datetime
+import json
+import unittest
+import flask
+import project.server.jsonprovider as jsonprovider
+from bson.objectid import ObjectId
+
+
+class TestJSONProvider(unittest.TestCase):
+    def setUp(self):
+        self.app = flask.Flask(__name__)
+        jsonprovider.install(self.app)
+        self.orjson = jsonprovider.orjson
+
+    def tearDown(self):
+        jsonprovider.orjson = self.orjson
+
+    def serialize(self):
+        _id = ObjectId()
+        document = dict(_id=_id, items=[dict(_id=_id)], updated_at=datetime.datetime(2020, 1, 2, 3, 4, 5, 6000), big=2 ** 70)
+        with self.app.test_request_context():
+            info = json.loads(flask.jsonify(document).get_data(as_text=True))
+        self.assertEqual(info['_id'], str(_id))
+        self.assertEqual(info['items'], [dict(_id=str(_id))])
+        self.assertEqual(info['updated_at'], '2020-01-02T03:04:05.006000+00:00')
+        self.assertEqual(info['big'], 2 ** 70)
+
+    def test_types(self):
+        " ObjectId and datetime are serialized as strings "
+        self.serialize()
+
+    def test_without_orjson(self):
+        " The json module of the standard library serializes the same "
+        jsonprovider.orjson = None
+        self.serialize()
+
+    def test_unknown_type(self):
+        " Values of unknown types are errors "
+        with self.app.test_request_context():
+            with self.assertRaises(TypeError):
+                flask.json.dumps(dict(value=object()))
+
+
+if __name__ == '__main__':
+    unittest.main()
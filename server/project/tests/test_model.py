@@ -1,10 +1,20 @@
+import flask
 import project.model as model
+import time
 import unittest
 from bson.objectid import ObjectId
+from project.storage import BulkWriteError
+
+
+def insert(collection, document):
+    """ Inserts a document directly in the storage of the model, and returns its identifier """
+    document['_id'] = ObjectId()
+    model.storage.insert(collection, [document])
+    return document['_id']
 
 
 def cursor_size(cursor):
-    """ Returns the size of a pymongo.Cursor """
+    """ Returns the number of documents in an iterable """
     size = 0
     for c in cursor:
         size += 1
@@ -13,19 +23,23 @@ def cursor_size(cursor):
 
 class TestModel(unittest.TestCase):
     def setUp(self):
+        app = flask.Flask(__name__)
+        app.config.from_object('project.server.config.TestingConfig')
+        model.configure_model(app)
+
         # create a user 0
-        self.user0 = model.db.users.insert({'name': 'NAME0'})
-        self.group0 = model.db.groups.insert({'name': 'GROUP0', 'parentid': self.user0, 'private': True})
-        self.checklist0 = model.db.checklists.insert({'name': 'CHECKLIST0', 'parentid': self.group0})
-        self.group1 = model.db.groups.insert({'name': 'GROUP1', 'parentid': self.user0, 'private': False})
-        self.checklist1 = model.db.checklists.insert({'name': 'CHECKLIST0', 'parentid': self.group1})
+        self.user0 = insert('users', {'name': 'NAME0'})
+        self.group0 = insert('groups', {'name': 'GROUP0', 'parentid': self.user0, 'private': True})
+        self.checklist0 = insert('checklists', {'name': 'CHECKLIST0', 'parentid': self.group0})
+        self.group1 = insert('groups', {'name': 'GROUP1', 'parentid': self.user0, 'private': False})
+        self.checklist1 = insert('checklists', {'name': 'CHECKLIST0', 'parentid': self.group1})
 
         # create user 1
-        self.user1 = model.db.users.insert({'name': 'NAME1'})
-        self.group11 = model.db.groups.insert({'name': 'GROUP1', 'parentid': self.user1})
+        self.user1 = insert('users', {'name': 'NAME1'})
+        self.group11 = insert('groups', {'name': 'GROUP1', 'parentid': self.user1})
 
     def tearDown(self):
-        model.db.command('dropDatabase')
+        model.storage.drop()
 
     def test_users(self):
         " Test there are two users int he database. "
@@ -169,3 +183,180 @@ class TestModel(unittest.TestCase):
         self.assertTrue(checklist.delete())
         checklist = model.search_element(model.Checklist, self.checklist0)
         self.assertTrue(checklist is None)
+
+    def test_indexes(self):
+        " Create the indexes and check user names are unique "
+        self.assertTrue(model.ensure_indexes())
+        # creating the indexes twice is not an error
+        self.assertTrue(model.ensure_indexes())
+        report = model.index_report()
+        for collection_name in model.INDEXES:
+            self.assertEqual(report[collection_name]['missing'], [])
+        self.assertEqual(model.create_user('NAME0'), None)
+        self.assertEqual(cursor_size(model.available_users()), 2)
+
+    def test_owners(self):
+        " Children inherit the owner and visibility of their parents "
+        group = model.search_element(model.Group, self.group0)
+        checklist = group.create_child({'name': 'CK', 'owner_id': self.user1, 'private': False})
+        item = checklist.create_child({'name': 'ITEM'})
+        self.assertEqual(checklist.info['owner_id'], self.user0)
+        self.assertTrue(checklist.info['private'])
+        self.assertEqual(item.info['owner_id'], self.user0)
+        self.assertTrue(item.info['private'])
+        self.assertFalse(item.visible_by(self.user1))
+
+        # changing the visibility of the group changes the visibility of its children
+        group.info['private'] = False
+        self.assertTrue(group.save())
+        item = model.search_element(model.Item, item.id())
+        self.assertFalse(item.info['private'])
+        self.assertTrue(item.visible_by(self.user1))
+        self.assertFalse(item.editable_by(self.user1))
+
+        # moving a checklist to a group of another user changes its owner
+        checklist = model.search_element(model.Checklist, checklist.id())
+        checklist.info['parentid'] = self.group11
+        self.assertTrue(checklist.save())
+        item = model.search_element(model.Item, item.id())
+        self.assertEqual(item.info['owner_id'], self.user1)
+        self.assertTrue(item.editable_by(self.user1))
+
+    def test_backfill_owners(self):
+        " Old documents without an owner get one "
+        item = insert('items', {'name': 'ITEM', 'parentid': self.checklist1})
+        self.assertTrue(model.search_element(model.Item, item).visible_by(self.user1))
+        self.assertEqual(model.backfill_owners(), 3)
+        checklist = model.search_element(model.Checklist, self.checklist0)
+        self.assertEqual(checklist.info['owner_id'], self.user0)
+        self.assertTrue(checklist.info['private'])
+        item = model.search_element(model.Item, item)
+        self.assertEqual(item.info['owner_id'], self.user0)
+        self.assertFalse(item.info['private'])
+
+    def test_partial_save(self):
+        " Only changed fields are saved "
+        checklist = model.search_element(model.Checklist, self.checklist0)
+        # another process changes the checklist
+        model.storage.update('checklists', {'_id': self.checklist0}, {'$set': {'description': 'DESCRIPTION'}})
+        checklist.info['name'] = 'CKNEW'
+        checklist.info['color'] = 'red'
+        self.assertTrue(checklist.save())
+        del checklist.info['color']
+        self.assertTrue(checklist.save())
+
+        info = model.storage.find_one('checklists', {'_id': self.checklist0})
+        self.assertEqual(info['name'], 'CKNEW')
+        self.assertEqual(info['description'], 'DESCRIPTION')
+        self.assertFalse('color' in info)
+
+        # new elements are inserted when saved
+        group = model.Group(None)
+        self.assertTrue(model.storage.find_one('groups', {'_id': group.id()}) is None)
+        group.info['name'] = 'NEWGROUP'
+        self.assertTrue(group.save())
+        self.assertEqual(model.storage.find_one('groups', {'_id': group.id()})['name'], 'NEWGROUP')
+
+    def test_versions(self):
+        " The version of an element changes with the element and with the elements in its view "
+        checklist = model.Checklist(self.checklist0)
+        version = checklist.info.get('version', 0)
+        item = checklist.create_child({'name': 'ITEM1', 'version': 100})
+        self.assertEqual(item.info['version'], 1)
+        # adding an item changes the version of the checklist once
+        self.assertEqual(checklist.info['version'], version + 1)
+        version = model.storage.find_one('checklists', {'_id': self.checklist0})['version']
+        self.assertEqual(checklist.info['version'], version)
+        item.info['checked'] = True
+        self.assertTrue(item.save())
+        self.assertEqual(item.info['version'], 2)
+        self.assertEqual(model.storage.find_one('checklists', {'_id': self.checklist0})['version'], version + 1)
+        model.check_items(checklist, checked=False)
+        self.assertEqual(model.storage.find_one('items', {'_id': item.id()})['version'], 3)
+        self.assertEqual(model.storage.find_one('checklists', {'_id': self.checklist0})['version'], version + 2)
+
+        self.assertEqual(model.visible_version(model.Item, item.id(), self.user0), 3)
+        self.assertEqual(model.visible_version(model.Item, item.id(), self.user1), None)
+        self.assertEqual(model.visible_version(model.Item, 'XXX', self.user0), None)
+
+    def test_checklist_items(self):
+        " Items are added and removed from checklists without overwriting concurrent changes "
+        checklist_a = model.Checklist(self.checklist0)
+        checklist_b = model.Checklist(self.checklist0)
+        item1 = checklist_a.create_child({'name': 'ITEM1'})
+        item2 = checklist_b.create_child({'name': 'ITEM2'})
+        item3 = checklist_b.create_child({'name': 'ITEM3'}, position=0)
+        items = model.Checklist(self.checklist0).info['items']
+        self.assertEqual([item['_id'] for item in items], [item3.id(), item1.id(), item2.id()])
+
+        self.assertTrue(checklist_a.delete_child(item1.id()))
+        self.assertFalse(checklist_b.delete_child(item1.id()))
+        self.assertTrue(model.detach_item(str(self.checklist0), str(item3.id())))
+        items = model.Checklist(self.checklist0).info['items']
+        self.assertEqual([item['_id'] for item in items], [item2.id()])
+
+    def test_bulk_items_failure(self):
+        " If a bulk write fails, the checklist keeps only the items that were saved "
+        checklist = model.Checklist(self.checklist0)
+        bulk = model.storage.bulk
+
+        def failing_bulk(collection, operations, session=None):
+            bulk(collection, operations[:1], session=session)
+            raise BulkWriteError('FAILED', 1)
+
+        model.storage.bulk = failing_bulk
+        try:
+            results = model.bulk_items(checklist, [dict(op='create', item=dict(name=name)) for name in ('ITEM1', 'ITEM2', 'ITEM3')])
+        finally:
+            del model.storage.bulk
+        self.assertEqual([result['status'] for result in results][1:], [500, 500])
+        self.assertEqual(results[1]['error_message'], 'FAILED')
+        self.assertEqual(results[2]['error_message'], 'Not applied')
+        saved = [ObjectId(result['_id']) for result in results if result['status'] == 200]
+        self.assertEqual(sorted(model.storage.distinct('items', '_id', {'parentid': self.checklist0})), sorted(saved))
+        items = model.Checklist(self.checklist0).info.get('items', [])
+        self.assertEqual([item['_id'] for item in items], saved)
+        self.assertEqual([item['_id'] for item in checklist.info.get('items', [])], saved)
+
+    def test_element_cache(self):
+        " Groups and checklists are cached, and removed from the cache when they change "
+        if not model._cache_enabled:
+            self.skipTest('The storage is not cached')
+        # the cache is used when the invalidations of other processes are read
+        for _ in range(50):
+            if model.cache_enabled():
+                break
+            time.sleep(0.1)
+        stats = model.cache_stats()
+        checklist = model.search_element(model.Checklist, self.checklist0)
+        checklist.info['name'] = 'NOT SAVED'
+        self.assertEqual(model.search_element(model.Checklist, self.checklist0).info['name'], 'CHECKLIST0')
+        self.assertEqual(model.cache_stats()['hits'], stats['hits'] + 1)
+        self.assertEqual(model.cache_stats()['misses'], stats['misses'] + 1)
+
+        item = checklist.create_child({'name': 'ITEM1'})
+        self.assertEqual(model.search_element(model.Checklist, self.checklist0).info['items'], [{'_id': item.id()}])
+        model.check_items(checklist)
+        self.assertEqual(
+            model.search_element(model.Checklist, self.checklist0).info['version'],
+            model.storage.find_one('checklists', {'_id': self.checklist0})['version'])
+        group = model.search_element(model.Group, self.group0)
+        group.info['name'] = 'NEWGROUP'
+        self.assertTrue(group.save())
+        self.assertEqual(model.search_element(model.Group, self.group0).info['name'], 'NEWGROUP')
+        self.assertTrue(group.delete())
+        self.assertIsNone(model.search_element(model.Group, self.group0))
+
+    def test_element_cache_processes(self):
+        " Storages shared by several processes are only cached if the processes invalidate the caches "
+        model.storage.drop()
+        app = flask.Flask(__name__)
+        app.config.from_object('project.server.config.TestingConfig')
+        app.config.update(STORAGE_BACKEND='sqlite', SQLITE_PATH=':memory:')
+        model.configure_model(app)
+        stats = model.cache_stats()
+        model.create_user('NAME2').create_child({'name': 'GROUP2'})
+        group_id = model.storage.find_one('groups', {'name': 'GROUP2'})['_id']
+        for _ in range(2):
+            self.assertEqual(model.search_element(model.Group, group_id).info['name'], 'GROUP2')
+        self.assertEqual(model.cache_stats(), stats)
@@ -0,0 +1,38 @@
+import threading
+import time
+import unittest
+import project.server.passwords as passwords
+
+
+class TestPasswords(unittest.TestCase):
+    def tearDown(self):
+        passwords.configure(dict(PASSWORD_WORKERS=0))
+
+    def test_inline(self):
+        " Without workers, passwords are hashed in the calling thread "
+        passwords.configure(dict(PASSWORD_WORKERS=0, BCRYPT_LOG_ROUNDS=4))
+        password_hash = passwords.hashpw('PASSWORD')
+        self.assertTrue(password_hash.startswith('$2b$04$'))
+        self.assertTrue(passwords.checkpw('PASSWORD', password_hash))
+        self.assertFalse(passwords.checkpw('WRONG', password_hash))
+
+    def test_pool(self):
+        " Passwords are hashed in a pool, and operations are rejected if the pool is full "
+        passwords.configure(dict(PASSWORD_WORKERS=1, PASSWORD_QUEUE_SIZE=0, BCRYPT_LOG_ROUNDS=4))
+        password_hash = passwords.hashpw('PASSWORD')
+        self.assertTrue(passwords.checkpw('PASSWORD', password_hash))
+        self.assertEqual(passwords.pending(), 0)
+
+        # keep the only worker busy
+        busy = threading.Thread(target=passwords._run, args=(time.sleep, 0.5))
+        busy.start()
+        deadline = time.monotonic() + 5
+        while passwords.pending() == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertRaises(passwords.PoolFull, passwords.checkpw, 'PASSWORD', password_hash)
+        busy.join()
+        self.assertEqual(passwords.pending(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
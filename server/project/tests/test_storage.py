@@ -0,0 +1,150 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from bson.objectid import ObjectId
+from project.storage import DuplicateKeyError, query
+from project.storage.memory import MemoryStorage
+from project.storage.sqlite import SQLiteStorage
+
+
+class TestQuery(unittest.TestCase):
+    def test_match(self):
+        " Filters compare values as MongoDB "
+        document = {'_id': 1, 'name': 'A', 'order': 2, 'items': [{'_id': 'x'}, {'_id': 'y'}], 'due_date': '2020-01-01'}
+        self.assertTrue(query.match(document, {'name': 'A', 'missing': None}))
+        self.assertTrue(query.match(document, {'items._id': 'y'}))
+        self.assertTrue(query.match(document, {'order': {'$gt': 1, '$lte': 2}}))
+        self.assertFalse(query.match(document, {'order': {'$gt': '1'}}))
+        self.assertTrue(query.match(document, {'$or': [{'name': 'B'}, {'order': {'$in': [1, 2]}}]}))
+        self.assertTrue(query.match(document, {'items.1': {'$exists': True}, 'items.2': {'$exists': False}}))
+        self.assertTrue(query.match(document, {'due_date': {'$regex': r'^\d{4}-\d{2}-\d{2}$'}}))
+        self.assertTrue(query.match(document, {'order': {'$type': 'number'}, 'checked': {'$ne': True}}))
+        self.assertFalse(query.match(document, {'order': True}))
+
+    def test_update(self):
+        " Updates with operators and with a pipeline "
+        document = {'_id': 1, 'items': [{'_id': 'x'}], 'due_date': '2020-01-31'}
+        self.assertTrue(query.update(document, {'$push': {'items': {'$each': [{'_id': 'y'}], '$position': 0}}, '$inc': {'version': 1}}))
+        self.assertEqual(document['items'], [{'_id': 'y'}, {'_id': 'x'}])
+        self.assertEqual(document['version'], 1)
+        self.assertTrue(query.update(document, {'$pull': {'items': {'_id': {'$in': ['x']}}}}))
+        self.assertEqual(document['items'], [{'_id': 'y'}])
+        self.assertFalse(query.update(document, {'$pull': {'items': {'_id': 'z'}}}))
+        query.update(document, [{'$set': {'due_date': {'$dateToString': {'format': '%Y-%m-%d', 'date': {'$add': [
+            {'$dateFromString': {'dateString': '$due_date', 'format': '%Y-%m-%d'}}, 24 * 60 * 60 * 1000]}}}}}])
+        self.assertEqual(document['due_date'], '2020-02-01')
+
+    def test_sort(self):
+        " Values of different types are sorted in the BSON order "
+        documents = [{'order': None}, {'order': 'a'}, {'order': 1}, {}]
+        documents = query.sort_documents(documents, [('order', -1)])
+        self.assertEqual([document.get('order') for document in documents], ['a', 1, None, None])
+
+    def test_lookup(self):
+        " $lookup joins with localField and foreignField, and runs the pipeline on the matches "
+        checklists = [{'_id': 1, 'checklist': {'_id': 'a'}}, {'_id': 2, 'checklist': {'_id': 'b'}}]
+        items = [{'_id': 'x', 'parentid': 'a', 'checked': True}, {'_id': 'y', 'parentid': 'a'}, {'_id': 'z', 'parentid': 'c'}]
+
+        def find(collection, filter):
+            return [item for item in items if query.match(item, filter)]
+
+        documents = query.aggregate(checklists, [{'$lookup': {
+            'from': 'items', 'localField': 'checklist._id', 'foreignField': 'parentid',
+            'pipeline': [{'$match': {'checked': True}}], 'as': 'items'}}], find)
+        self.assertEqual([[item['_id'] for item in document['items']] for document in documents], [['x'], []])
+
+
+class StorageTests(object):
+    """ Tests of the storages that need no server. Subclasses set self.storage """
+
+    def test_documents(self):
+        " Documents keep their types, and filters on columns and on other fields work "
+        parentid = ObjectId()
+        now = datetime.datetime(2020, 1, 2, 3, 4, 5, 6000)
+        self.storage.insert('items', [
+            dict(_id=ObjectId(), name='ITEM{}'.format(i), parentid=parentid, checked=i % 2 == 0, updated_at=now, order=i)
+            for i in range(5)])
+        self.storage.insert('items', [dict(_id=ObjectId(), name='OTHER', parentid=ObjectId())])
+        info = self.storage.find_one('items', {'parentid': parentid, 'name': 'ITEM0'})
+        self.assertEqual(info['parentid'], parentid)
+        self.assertEqual(info['updated_at'], now)
+        self.assertEqual(self.storage.count('items', {'parentid': parentid, 'checked': True}), 3)
+        self.assertEqual(self.storage.count('items', {'updated_at': {'$gte': now}}), 5)
+        names = [info['name'] for info in self.storage.find_many(
+            'items', {'parentid': {'$in': [parentid]}}, {'name': 1}, sort=[('order', -1)], limit=2)]
+        self.assertEqual(names, ['ITEM4', 'ITEM3'])
+
+        result = self.storage.update('items', {'parentid': parentid, 'checked': True}, {'$set': {'checked': False}}, multi=True)
+        self.assertEqual((result.matched_count, result.modified_count), (3, 3))
+        info = self.storage.find_and_update('items', {'name': 'ITEM1'}, {'$inc': {'version': 1}}, projection={'version': 1})
+        self.assertEqual(info['version'], 1)
+        self.assertEqual(self.storage.delete('items', {'parentid': parentid}), 5)
+        self.assertEqual(self.storage.count('items', {}), 1)
+
+    def test_sorted_columns(self):
+        " Sorts on _id and dates, with a limit, return the same documents as a sort of all the documents "
+        ids = [ObjectId() for _ in range(6)]
+        now = datetime.datetime(2020, 1, 2, 3, 4, 5, 6000)
+        self.storage.insert('items', [
+            dict(_id=ids[i], updated_at=now + datetime.timedelta(seconds=i // 2), checked=i != 3) for i in reversed(range(6))])
+        self.storage.insert('items', [dict(_id=ObjectId(), checked=True)])
+        documents = self.storage.find_many('items', {'checked': True}, {'_id': 1}, sort=[('updated_at', -1), ('_id', 1)], limit=4)
+        self.assertEqual([document['_id'] for document in documents], [ids[4], ids[5], ids[2], ids[0]])
+        documents = self.storage.find_many('items', {'updated_at': {'$gt': now}}, sort=[('_id', -1)], limit=2)
+        self.assertEqual([document['_id'] for document in documents], [ids[5], ids[4]])
+
+    def test_unique_index(self):
+        " A unique index with a partial filter is enforced "
+        self.storage.create_index('users', [('name', 1)], 'name', unique=True, partialFilterExpression={'name': {'$type': 'string'}})
+        self.assertEqual(self.storage.index_names('users'), ['name'])
+        self.storage.insert('users', [dict(_id=ObjectId(), name='USER1'), dict(_id=ObjectId()), dict(_id=ObjectId())])
+        with self.assertRaises(DuplicateKeyError):
+            self.storage.insert('users', [dict(_id=ObjectId(), name='USER1')])
+        user_id = self.storage.find_one('users', {'name': None})['_id']
+        with self.assertRaises(DuplicateKeyError):
+            self.storage.update('users', {'_id': user_id}, {'$set': {'name': 'USER1'}})
+
+    def test_transaction(self):
+        " Writes in a transaction are undone if it fails "
+        with self.assertRaises(ValueError):
+            with self.storage.transaction():
+                self.storage.insert('groups', [dict(_id=ObjectId(), name='GROUP1')])
+                raise ValueError()
+        self.assertEqual(self.storage.count('groups', {}), 0)
+
+
+class TestSQLiteStorage(StorageTests, unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.storage = SQLiteStorage(os.path.join(self.directory, 'test.sqlite3'))
+
+    def tearDown(self):
+        self.storage.drop()
+        shutil.rmtree(self.directory)
+
+
+class TestMemoryStorage(StorageTests, unittest.TestCase):
+    def setUp(self):
+        self.storage = MemoryStorage()
+
+    def test_indexed_fields(self):
+        " Filters on indexed fields and on _id find the same documents as a full scan "
+        parentids = [ObjectId(), ObjectId()]
+        self.storage.insert('items', [
+            dict(_id=ObjectId(), name='ITEM{}'.format(i % 3), parentid=parentids[i % 2]) for i in range(12)])
+        self.assertEqual(self.storage.count('items', {'parentid': parentids[0]}), 6)
+        self.assertEqual(self.storage.count('items', {'parentid': {'$in': parentids}, 'name': 'ITEM1'}), 4)
+        info = self.storage.find_one('items', {'name': 'ITEM2'})
+        self.storage.update('items', {'_id': info['_id']}, {'$set': {'name': 'CHANGED', 'parentid': None}})
+        self.assertEqual(self.storage.count('items', {'name': 'ITEM2'}), 3)
+        self.assertEqual(self.storage.find_one('items', {'name': 'CHANGED'})['_id'], info['_id'])
+        self.assertEqual(self.storage.count('items', {'parentid': None}), 1)
+        # stored documents cannot be changed through the documents that are read
+        info['name'] = 'OTHER'
+        self.assertIsNone(self.storage.find_one('items', {'name': 'OTHER'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -29,7 +29,7 @@ class TestViews(flask_testing.TestCase):
         self.user.create_child({'name': 'GROUP1'})
 
     def tearDown(self):
-        project.model.db.command('dropDatabase')
+        project.model.storage.drop()
 
     def test_blueprint(self):
         auth = project.server.auth.create_auth()
@@ -87,6 +87,23 @@ class TestViews(flask_testing.TestCase):
             self.assertEqual(data.get('name', ''), 'USER1')
             self.assertEqual(flask.g.user_id, str(self.user.id()))
 
+    def test_authcache(self):
+        " Verified passwords are cached until the password changes "
+        with self.client:
+            url = flask.url_for('users.info', _id=str(self.user.id()))
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+            project.server.auth.password_cache.clear()
+            hits = project.server.auth.cache_stats()['passwords']['hits']
+            self.assertEqual(http.get(url).get('name', ''), 'USER1')
+            self.assertEqual(http.get(url).get('name', ''), 'USER1')
+            self.assertEqual(project.server.auth.cache_stats()['passwords']['hits'], hits + 1)
+
+            # change the password: the old one is not valid anymore
+            self.user.hash_password('PASSWORD2')
+            self.user.save()
+            self.assertEqual(http.get(url).get('status', 0), 401)
+            self.assertEqual(http.get(url, auth=['USER1', 'PASSWORD2']).get('name', ''), 'USER1')
+
     def test_404(self):
         with self.client:
             http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
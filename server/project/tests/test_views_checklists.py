@@ -1,9 +1,10 @@
 import unittest
+import json
 import flask
 import flask_testing
 import project.model
 import project.views
-from project.tests import HTTPHelper
+from project.tests import HTTPHelper, auth_header
 
 
 class TestChecklistsView(flask_testing.TestCase):
@@ -32,7 +33,7 @@ class TestChecklistsView(flask_testing.TestCase):
         project.model.create_user('USER2', 'PASSWORD2')
 
     def tearDown(self):
-        project.model.db.command('dropDatabase')
+        project.model.storage.drop()
 
     def test_availablechecklists(self):
         with self.client:
@@ -52,6 +53,68 @@ class TestChecklistsView(flask_testing.TestCase):
             self.assertFalse('error_message' in data)
             self.assertTrue('name' in data and data['name'] == 'CHECKLIST1')
 
+    def test_streamchecklist(self):
+        """ Test a checklist is returned as JSON or NDJSON, depending on the Accept header """
+        for i in range(3):
+            self.checklist1.create_child({'name': 'ITEM{}'.format(i)})
+        with self.client:
+            url = flask.url_for('checklists.info', _id=str(self.checklist1.id()))
+            headers = {'Authorization': auth_header('USER1', 'PASSWORD1')}
+
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.mimetype, 'application/json')
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['name'], 'CHECKLIST1')
+            self.assertEqual([item['name'] for item in data['items']], ['ITEM0', 'ITEM1', 'ITEM2'])
+
+            headers['Accept'] = 'application/x-ndjson'
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            lines = [json.loads(line) for line in response.data.decode().splitlines()]
+            self.assertEqual(lines[0]['name'], 'CHECKLIST1')
+            self.assertFalse('items' in lines[0])
+            self.assertEqual([item['name'] for item in lines[1:]], ['ITEM0', 'ITEM1', 'ITEM2'])
+
+            # empty checklists are valid JSON
+            url = flask.url_for('checklists.info', _id=str(self.checklist2.id()))
+            data = HTTPHelper(self.client, ['USER1', 'PASSWORD1']).get(url)
+            self.assertEqual(data['items'], [])
+
+    def test_etag(self):
+        """ Test conditional requests return 304 until the checklist or its items change """
+        with self.client:
+            url = flask.url_for('checklists.info', _id=str(self.checklist1.id()))
+            headers = {'Authorization': auth_header('USER1', 'PASSWORD1')}
+            response = self.client.get(url, headers=headers)
+            etag = response.headers.get('ETag')
+            self.assertFalse(etag is None)
+
+            headers['If-None-Match'] = etag
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+
+            # changes in an item change the version of the checklist
+            item = self.checklist1.create_child({'name': 'ITEM1'})
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers.get('ETag'), etag)
+            headers['If-None-Match'] = etag = response.headers.get('ETag')
+            item.info['checked'] = True
+            item.save()
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers.get('ETag'), etag)
+
+            # the group changes when its checklists change
+            group_url = flask.url_for('groups.info', _id=str(self.group2.id()))
+            response = self.client.get(group_url, headers={'Authorization': auth_header('USER1', 'PASSWORD1')})
+            headers['If-None-Match'] = response.headers.get('ETag')
+            self.assertEqual(self.client.get(group_url, headers=headers).status_code, 304)
+            self.checklist2.info['name'] = 'NEWNAME'
+            self.checklist2.save()
+            self.assertEqual(self.client.get(group_url, headers=headers).status_code, 200)
+
     def test_newchecklist(self):
         """ Test creation of checklist, and its errors """
         with self.client:
@@ -116,6 +179,68 @@ class TestChecklistsView(flask_testing.TestCase):
             self.assertTrue('error_message' in data)
             self.assertEqual(data['status'], 401)
 
+    def test_movechecklist(self):
+        """ Test a checklist cannot be moved to a group of another user """
+        with self.client:
+            url = flask.url_for('checklists.info', _id=str(self.checklist1.id()))
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+            user2 = project.model.search_username('USER2')
+            group3 = user2.create_child({'name': 'GROUP3'})
+
+            data = http.put(url, data=dict(parentid=str(group3.id())))
+            self.assertEqual(data.get('status', 0), 401)
+
+            # clients cannot change the owner of a checklist
+            data = http.put(url, data=dict(owner_id=str(user2.id()), private=True))
+            self.assertFalse('error_message' in data)
+            self.assertEqual(data['owner_id'], str(self.user.id()))
+            self.assertFalse(data['private'])
+
+    def test_duplicatechecklist(self):
+        """ Test duplicating a checklist and its items """
+        self.checklist1.create_child({'name': 'ITEM1', 'checked': True})
+        self.checklist1.create_child({'name': 'ITEM2'})
+        with self.client:
+            url = flask.url_for('checklists.duplicate', _id=str(self.checklist1.id()))
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+
+            # USER2 cannot duplicate a checklist owned by USER1
+            data = http.post(url, auth=['USER2', 'PASSWORD2'])
+            self.assertEqual(data.get('status', 0), 401)
+
+            data = http.post(url)
+            self.assertFalse('error_message' in data)
+            self.assertNotEqual(data['_id'], str(self.checklist1.id()))
+            self.assertEqual(data['name'], 'CHECKLIST1')
+            self.assertEqual(data['parentid'], str(self.group2.id()))
+            self.assertEqual([item['name'] for item in data['items']], ['ITEM1', 'ITEM2'])
+            self.assertTrue(data['items'][0]['checked'])
+            for item in data['items']:
+                self.assertEqual(item['parentid'], data['_id'])
+
+            # the original checklist did not change
+            data = http.get(flask.url_for('checklists.info', _id=str(self.checklist1.id())))
+            self.assertEqual([item['parentid'] for item in data['items']], [str(self.checklist1.id())] * 2)
+
+    def test_clearchecklist(self):
+        """ Test removing the done items of a checklist """
+        self.checklist1.create_child({'name': 'ITEM1', 'checked': True})
+        self.checklist1.create_child({'name': 'ITEM2'})
+        self.checklist1.create_child({'name': 'ITEM3', 'checked': True})
+        with self.client:
+            url = flask.url_for('checklists.clear', _id=str(self.checklist1.id()))
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+
+            # USER2 cannot clear a checklist owned by USER1
+            data = http.post(url, auth=['USER2', 'PASSWORD2'])
+            self.assertEqual(data.get('status', 0), 401)
+
+            data = http.post(url)
+            self.assertFalse('error_message' in data)
+            self.assertEqual([item['name'] for item in data['items']], ['ITEM2'])
+            data = http.get(flask.url_for('checklists.info', _id=str(self.checklist1.id())))
+            self.assertEqual([item['name'] for item in data['items']], ['ITEM2'])
+
     def test_deletechecklist(self):
         """ Test deleting a checklist, and its errors """
         with self.client:
@@ -142,6 +267,35 @@ class TestChecklistsView(flask_testing.TestCase):
             self.assertTrue('error_message' in data)
             self.assertEqual(data.get('status', 0), 404)
 
+    def test_todaychecklist(self):
+        """ Test the special checklists today and history """
+        import datetime
+        today = datetime.date.today()
+        yesterday = (today - datetime.timedelta(days=1)).isoformat()
+        tomorrow = (today + datetime.timedelta(days=1)).isoformat()
+        later = (today + datetime.timedelta(days=30)).isoformat()
+        self.checklist1.create_child({'name': 'DUE', 'due_date': tomorrow})
+        self.checklist1.create_child({'name': 'LATER', 'due_date': later})
+        self.checklist1.create_child({'name': 'NODATE'})
+        self.checklist2.create_child({'name': 'DONE', 'due_date': yesterday, 'checked': True, 'done_date': yesterday})
+
+        with self.client:
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+            data = http.get(flask.url_for('checklists.today'))
+            names = [item['name'] for item in data['items']]
+            self.assertEqual(names, ['# GROUP2 # CHECKLIST1', 'DUE'])
+            data = http.get(flask.url_for('checklists.today', days=60))
+            names = [item['name'] for item in data['items']]
+            self.assertEqual(names, ['# GROUP2 # CHECKLIST1', 'DUE', 'LATER'])
+
+            data = http.get(flask.url_for('checklists.history'))
+            names = [item['name'] for item in data['items']]
+            self.assertEqual(names, ['# CHECKLIST2', 'DONE'])
+
+            # other users do not see these items
+            data = http.get(flask.url_for('checklists.today'), auth=['USER2', 'PASSWORD2'])
+            self.assertEqual(data['items'], [])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import flask
+import flask_testing
+import project.model
+import project.views
+import project.server.events
+from project.tests import auth_header
+
+
+class TestEventsView(flask_testing.TestCase):
+    def create_app(self):
+        app = flask.Flask(__name__)
+        app.config.from_object('project.server.config.TestingConfig')
+        project.model.configure_model(app)
+        project.views.register(app)
+        return app
+
+    def setUp(self):
+        self.user = project.model.create_user('USER1', 'PASSWORD1')
+        self.group = self.user.create_child({'name': 'GROUP1'})
+        self.checklist = self.group.create_child({'name': 'CHECKLIST1'})
+
+    def tearDown(self):
+        project.model.storage.drop()
+
+    def test_events(self):
+        """ Test changes are sent to the client as Server-Sent Events """
+        with self.client:
+            url = flask.url_for('events.stream')
+            response = self.client.get(url, headers={'Authorization': auth_header('USER1', 'PASSWORD1')}, buffered=False)
+            self.assertEqual(response.mimetype, 'text/event-stream')
+            chunks = iter(response.response)
+            self.assertEqual(next(chunks), b'retry: 5000\n\n')
+
+            item = self.checklist.create_child({'name': 'ITEM1'})
+            self.assertEqual(next(chunks), 'event: saved\ndata: {{"collection": "items", "_id": "{}", "parentid": "{}"}}\n\n'.format(
+                item.id(), self.checklist.id()).encode())
+            self.assertTrue('"_id": "{}"'.format(self.checklist.id()) in next(chunks).decode())
+
+            response.close()
+            self.assertEqual(project.server.events.subscribers(), 0)
+
+            # tokens are accepted as a parameter
+            token = project.server.auth.encode_auth_token(str(self.user.id())).decode()
+            response = self.client.get(flask.url_for('events.stream', token=token), buffered=False)
+            self.assertEqual(response.mimetype, 'text/event-stream')
+            response.close()
+            response = self.client.get(flask.url_for('events.stream', token='XXX'))
+            self.assertEqual(response.get_json()['status'], 401)
+
+    def test_too_many_clients(self):
+        """ Test clients are refused when there are too many in this process """
+        project.server.events.configure(dict(EVENTS_MAX_SUBSCRIPTIONS=1))
+        with self.client:
+            url = flask.url_for('events.stream')
+            headers = {'Authorization': auth_header('USER1', 'PASSWORD1')}
+            response = self.client.get(url, headers=headers, buffered=False)
+            self.assertEqual(response.mimetype, 'text/event-stream')
+            refused = self.client.get(url, headers=headers)
+            self.assertEqual(refused.status_code, 503)
+            self.assertEqual(refused.get_json()['status'], 503)
+            response.close()
+            self.assertEqual(project.server.events.subscribers(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -31,7 +31,7 @@ class TestGroupsView(flask_testing.TestCase):
         self.user2 = project.model.create_user('USER2', 'PASSWORD2')
 
     def tearDown(self):
-        project.model.db.command('dropDatabase')
+        project.model.storage.drop()
 
     def test_availablegroups(self):
         " Test a user can access to a list with the groups owned by him, but not to the private groups of other users"
@@ -78,6 +78,29 @@ class TestGroupsView(flask_testing.TestCase):
             self.assertTrue('name' in data)
             self.assertTrue(data['name'] == 'GROUP2')
 
+    def test_pagination(self):
+        """ Test the checklists of a group are returned in pages, sorted by order """
+        for order in (None, 2, 'B', 1, None, 'A', 2):
+            self.group1.create_child({'name': 'CK{}'.format(order), 'order': order})
+        with self.client:
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+            url = flask.url_for('groups.info', _id=str(self.group1.id()), limit=3)
+            names = []
+            pages = 0
+            while url is not None:
+                data = http.get(url)
+                self.assertFalse('error_message' in data)
+                self.assertTrue(len(data['checklists']) <= 3)
+                names.extend(checklist['name'] for checklist in data['checklists'])
+                url = data.get('checklists_next', None)
+                pages += 1
+            self.assertEqual(pages, 3)
+            self.assertEqual(names, ['CKB', 'CKA', 'CK2', 'CK2', 'CK1', 'CKNone', 'CKNone'])
+
+            # invalid tokens
+            data = http.get(flask.url_for('groups.info', _id=str(self.group1.id()), after='XXX'))
+            self.assertEqual(data.get('status', 0), 400)
+
     def test_newgroup(self):
         """ Test creation of group, and its errors """
         with self.client:
@@ -138,7 +161,7 @@ class TestGroupsView(flask_testing.TestCase):
             self.assertEqual(data.get('status', 0), 404)
 
             # non empty group: check it exists, try to delete, check it still exists
-            ck = project.model.db.checklists.find_one({'parentid': self.group2.id()})
+            ck = project.model.storage.find_one('checklists', {'parentid': self.group2.id()})
             self.assertFalse(ck is None)
             url = flask.url_for('groups.info', _id=str(self.group2.id()))
             data = http.get(url)
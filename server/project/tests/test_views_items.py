@@ -36,7 +36,7 @@ class TestItemsView(flask_testing.TestCase):
         project.model.create_user('USER2', 'PASSWORD2')
 
     def tearDown(self):
-        project.model.db.command('dropDatabase')
+        project.model.storage.drop()
 
     def test_availableitems(self):
         with self.client:
@@ -121,6 +121,136 @@ class TestItemsView(flask_testing.TestCase):
             self.assertTrue('error_message' in data)
             self.assertEqual(data['status'], 401)
 
+    def test_moveitem(self):
+        """ Test items are moved only to checklists the user can edit """
+        with self.client:
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+            checklist3 = project.model.create_user('USER3', 'PASSWORD3').create_child({'name': 'GROUP3'}).create_child({'name': 'CHECKLIST3'})
+
+            # USER1 cannot move an item to a checklist of another user
+            url = flask.url_for('items.info', _id=str(self.item1.id()))
+            data = http.put(url, data=dict(parentid=str(checklist3.id())))
+            self.assertEqual(data['status'], 401)
+            data = http.put(url, data=dict(parentid=str(self.item2.id())))
+            self.assertEqual(data['status'], 404)
+            data = http.get(url)
+            self.assertEqual(data['parentid'], str(self.checklist1.id()))
+
+            # USER1 moves an item to another checklist
+            data = http.put(url, data=dict(parentid=str(self.checklist2.id())))
+            self.assertEqual(data['parentid'], str(self.checklist2.id()))
+            self.assertTrue(data['private'])
+            data = http.get(flask.url_for('checklists.info', _id=str(self.checklist1.id())))
+            self.assertEqual([item['name'] for item in data['items']], ['ITEM2'])
+            data = http.get(flask.url_for('checklists.info', _id=str(self.checklist2.id())))
+            self.assertEqual([item['name'] for item in data['items']], ['ITEM3', 'ITEM1'])
+
+    def test_identitymap(self):
+        """ Test each document is loaded only once in a request """
+        with self.client:
+            url = flask.url_for('items.info', _id=str(self.item1.id()))
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+            data = http.put(url, data=dict(name='NEWNAME'))
+            self.assertEqual(data.get('name', None), 'NEWNAME')
+            # the item is loaded to be updated, and found again to return its information
+            stats = project.model.identity_map_stats()
+            self.assertEqual(stats['misses'], 1)
+            self.assertEqual(stats['hits'], 1)
+
+    def test_bulkitems(self):
+        """ Test creating, updating and deleting items in a single request """
+        with self.client:
+            url = flask.url_for('checklists.bulk', _id=str(self.checklist1.id()))
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+            operations = [
+                dict(op='create', item=dict(name='NEWITEM', owner_id=str(self.user2.id()))),
+                dict(op='update', _id=str(self.item1.id()), item=dict(name='NEWNAME', checked=True)),
+                dict(op='delete', _id=str(self.item2.id())),
+                dict(op='delete', _id=str(self.item3.id())),
+                dict(op='update', _id='XX'),
+                dict(op='unknown')
+            ]
+
+            # USER2 cannot edit the checklist
+            data = http.post(url, data=operations, auth=['USER2', 'PASSWORD2'])
+            self.assertEqual(data.get('status', 0), 401)
+
+            data = http.post(url, data=operations)
+            self.assertEqual(data.get('status', 0), 200)
+            self.assertEqual([result['status'] for result in data['results']], [200, 200, 200, 404, 400, 400])
+
+            data = http.get(flask.url_for('checklists.info', _id=str(self.checklist1.id())))
+            self.assertEqual([item['name'] for item in data['items']], ['NEWNAME', 'NEWITEM'])
+            self.assertTrue(data['items'][0]['checked'])
+            self.assertEqual(data['items'][1]['owner_id'], str(self.user.id()))
+            # item3 belongs to another checklist and it was not deleted
+            data = http.get(flask.url_for('items.info', _id=str(self.item3.id())))
+            self.assertEqual(data.get('name', None), 'ITEM3')
+
+    def test_invalid_fields(self):
+        """ Field names starting with $ or with a dot are rejected """
+        with self.client:
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+            data = http.put(flask.url_for('items.info', _id=str(self.item1.id())), data={'name': 'NEWNAME', '$where': '1'})
+            self.assertEqual(data.get('status', 0), 400)
+            data = http.post(flask.url_for('items.new'), data={'name': 'NEWITEM', 'parentid': str(self.checklist1.id()), 'a.b': 1})
+            self.assertEqual(data.get('status', 0), 400)
+
+            operations = [
+                dict(op='create', item={'name': 'NEWITEM', '$inc': 1}),
+                dict(op='update', _id=str(self.item1.id()), item={'tags.0': 'TAG'}),
+                dict(op='update', _id=str(self.item1.id()), item={'name': 'NEWNAME'})
+            ]
+            data = http.post(flask.url_for('checklists.bulk', _id=str(self.checklist1.id())), data=operations)
+            self.assertEqual([result['status'] for result in data['results']], [400, 400, 200])
+            data = http.get(flask.url_for('items.info', _id=str(self.item1.id())))
+            self.assertEqual(data.get('name', None), 'NEWNAME')
+            self.assertNotIn('tags.0', data)
+
+    def test_checklistactions(self):
+        """ Test actions on all the items of a checklist """
+        self.checklist1.create_child({'name': 'ITEM4', 'due_date': '2020-02-28'})
+        self.checklist1.create_child({'name': 'ITEM5', 'due_date': ''})
+        with self.client:
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+            checklist_url = flask.url_for('checklists.info', _id=str(self.checklist1.id()))
+
+            data = http.post(flask.url_for('checklists.check', _id=str(self.checklist1.id())), auth=['USER2', 'PASSWORD2'])
+            self.assertEqual(data.get('status', 0), 401)
+
+            data = http.post(flask.url_for('checklists.check', _id=str(self.checklist1.id())), data=dict(done_date='2020-01-01'))
+            self.assertEqual(data.get('count', 0), 4)
+            data = http.get(checklist_url)
+            self.assertTrue(all(item['checked'] and item['done_date'] == '2020-01-01' for item in data['items']))
+
+            data = http.post(flask.url_for('checklists.uncheck', _id=str(self.checklist1.id())))
+            self.assertEqual(data.get('count', 0), 4)
+            data = http.get(checklist_url)
+            self.assertFalse(any(item['checked'] for item in data['items']))
+
+            data = http.post(flask.url_for('checklists.shift', _id=str(self.checklist1.id())))
+            self.assertEqual(data.get('status', 0), 400)
+            data = http.post(flask.url_for('checklists.shift', _id=str(self.checklist1.id())), data=dict(days=2))
+            self.assertEqual(data.get('count', 0), 1)
+            data = http.get(checklist_url)
+            self.assertEqual([item.get('due_date') for item in data['items']], [None, None, '2020-03-01', ''])
+
+            data = http.post(flask.url_for('checklists.clear_due_dates', _id=str(self.checklist1.id())))
+            self.assertEqual(data.get('count', 0), 1)
+            data = http.get(checklist_url)
+            self.assertEqual([item.get('due_date') for item in data['items']], [None, None, '', ''])
+
+    def test_shift_invalid_dates(self):
+        """ Due dates that do not exist are not shifted """
+        self.checklist1.create_child({'name': 'ITEM4', 'due_date': '2026-02-30'})
+        self.checklist1.create_child({'name': 'ITEM5', 'due_date': '2026-02-27'})
+        with self.client:
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+            data = http.post(flask.url_for('checklists.shift', _id=str(self.checklist1.id())), data=dict(days=2))
+            self.assertEqual(data.get('status', 200), 200)
+            data = http.get(flask.url_for('checklists.info', _id=str(self.checklist1.id())))
+            self.assertEqual([item.get('due_date') for item in data['items']], [None, None, '2026-02-30', '2026-03-01'])
+
     def test_deleteitem(self):
         """ Test deleting an item, and its errors """
         with self.client:
@@ -0,0 +1,120 @@
+import datetime
+import json
+import unittest
+import flask
+import flask_testing
+import project.model
+import project.views
+import project.jobs
+from bson.objectid import ObjectId
+from project.tests import HTTPHelper, auth_header
+
+
+class TestJobsView(flask_testing.TestCase):
+    def create_app(self):
+        app = flask.Flask(__name__)
+        app.config.from_object('project.server.config.TestingConfig')
+        project.model.configure_model(app)
+        project.views.register(app)
+
+        @app.errorhandler(400)
+        @app.errorhandler(404)
+        @app.errorhandler(401)
+        @app.errorhandler(500)
+        def error_handler(error):
+            return flask.make_response(flask.jsonify({'error_message': str(error), 'status': error.code}))
+
+        return app
+
+    def setUp(self):
+        self.user = project.model.create_user('USER1', 'PASSWORD1')
+        self.group = self.user.create_child({'name': 'GROUP1'})
+        self.checklist = self.group.create_child({'name': 'CHECKLIST1'})
+        for i in range(5):
+            self.checklist.create_child({'name': 'ITEM{}'.format(i)})
+        project.model.create_user('USER2', 'PASSWORD2')
+        project.jobs.batch_size = 2
+
+    def tearDown(self):
+        project.model.storage.drop()
+
+    def post(self, url):
+        response = self.client.post(url, headers={'Authorization': auth_header('USER1', 'PASSWORD1')})
+        return response, json.loads(response.data.decode())
+
+    def test_duplicate(self):
+        """ Test a checklist is duplicated by a job """
+        with self.client:
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+            response, data = self.post(flask.url_for('checklists.duplicate', _id=str(self.checklist.id()), **{'async': 1}))
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.headers['Location'], data['job'])
+            self.assertEqual(http.get(data['job'])['status'], 'queued')
+            # only the owner can see the job
+            self.assertEqual(http.get(data['job'], auth=['USER2', 'PASSWORD2'])['status'], 401)
+            # the new checklist does not exist until the job is done
+            self.assertEqual(http.get(data['checklist'])['status'], 404)
+
+            self.assertEqual(project.jobs.work(once=True), 1)
+            job = http.get(data['job'])
+            self.assertEqual(job['status'], 'done')
+            self.assertEqual(job['progress'], dict(items=5))
+            new_checklist = http.get(data['checklist'])
+            self.assertEqual(new_checklist['_id'], job['result']['_id'])
+            self.assertEqual([item['name'] for item in new_checklist['items']], ['ITEM{}'.format(i) for i in range(5)])
+
+            # running the job again does not duplicate the checklist twice
+            project.model.storage.update('jobs', {'_id': ObjectId(job['_id'])}, {'$set': {'status': 'queued'}})
+            project.jobs.work(once=True)
+            self.assertEqual(project.model.storage.count('checklists', {'name': 'CHECKLIST1'}), 2)
+
+    def test_delete(self):
+        """ Test the items of a checklist are deleted by a job """
+        with self.client:
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+            url = flask.url_for('checklists.delete', _id=str(self.checklist.id()), **{'async': 1})
+            response = self.client.delete(url, headers={'Authorization': auth_header('USER1', 'PASSWORD1')})
+            self.assertEqual(response.status_code, 202)
+            data = json.loads(response.data.decode())
+            # the checklist is deleted at once
+            self.assertEqual(http.get(flask.url_for('checklists.info', _id=str(self.checklist.id())))['status'], 404)
+            self.assertEqual(project.model.storage.count('items', {'parentid': self.checklist.id()}), 5)
+
+            project.jobs.work(once=True)
+            job = http.get(data['job'])
+            self.assertEqual(job['status'], 'done')
+            self.assertEqual(job['result'], dict(items=5))
+            self.assertEqual(project.model.storage.count('items', {'parentid': self.checklist.id()}), 0)
+
+    def test_failed(self):
+        """ Test jobs are retried, and they fail after some attempts """
+        with self.client:
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+            job_id = project.jobs.enqueue('duplicate_checklist', dict(checklist_id='XXX', new_id=str(ObjectId())), self.user.id())
+            url = flask.url_for('jobs.info', _id=str(job_id))
+            project.jobs.work(once=True)
+            self.assertEqual(http.get(url)['status'], 'failed')
+            self.assertEqual(http.get(url)['attempts'], project.jobs.max_attempts)
+            self.assertTrue('error' in http.get(url))
+            self.assertEqual(http.get(flask.url_for('jobs.info', _id='XXX'))['status'], 404)
+
+    def test_expired_lease(self):
+        """ Test jobs whose worker died are claimed again, and they fail after some attempts """
+        with self.client:
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+            job_id = project.jobs.enqueue('delete_checklist', dict(checklist_id=str(self.checklist.id())), self.user.id())
+            url = flask.url_for('jobs.info', _id=str(job_id))
+            expired = {'$set': {'lease_until': project.model._now() - datetime.timedelta(seconds=1)}}
+            for attempt in range(1, project.jobs.max_attempts + 1):
+                self.assertEqual(project.jobs.claim('WORKER')['attempts'], attempt)
+                # the worker dies
+                project.model.storage.update('jobs', {'_id': job_id}, expired)
+            self.assertIsNone(project.jobs.claim('WORKER'))
+            job = http.get(url)
+            self.assertEqual(job['status'], 'failed')
+            self.assertEqual(job['attempts'], project.jobs.max_attempts)
+            self.assertTrue('error' in job)
+
+
+if __name__ == '__main__':
+    unittest.main()
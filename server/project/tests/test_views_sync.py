@@ -0,0 +1,137 @@
+import datetime
+import time
+import unittest
+import flask
+import flask_testing
+import project.model
+import project.views
+from project.tests import HTTPHelper
+
+
+class TestSyncView(flask_testing.TestCase):
+    def create_app(self):
+        app = flask.Flask(__name__)
+        app.config.from_object('project.server.config.TestingConfig')
+        project.model.configure_model(app)
+        project.views.register(app)
+
+        @app.errorhandler(400)
+        @app.errorhandler(404)
+        @app.errorhandler(401)
+        @app.errorhandler(500)
+        def error_handler(error):
+            return flask.make_response(flask.jsonify({'error_message': str(error), 'status': error.code}))
+
+        return app
+
+    def setUp(self):
+        self.user = project.model.create_user('USER1', 'PASSWORD1')
+        self.group = self.user.create_child({'name': 'GROUP1'})
+        self.checklist = self.group.create_child({'name': 'CHECKLIST1'})
+        self.item1 = self.checklist.create_child({'name': 'ITEM1'})
+        self.item2 = self.checklist.create_child({'name': 'ITEM2'})
+
+        self.user2 = project.model.create_user('USER2', 'PASSWORD2')
+        self.user2.create_child({'name': 'GROUP2', 'private': False})
+
+    def tearDown(self):
+        project.model.storage.drop()
+
+    def test_sync(self):
+        """ Test the changes since the last sync are returned, including deleted elements """
+        with self.client:
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+
+            # the first sync returns everything of the user, and the public elements of other users
+            data = http.get(flask.url_for('sync.changes'))
+            self.assertEqual(sorted(group['name'] for group in data['groups']), ['GROUP1', 'GROUP2'])
+            self.assertEqual([checklist['name'] for checklist in data['checklists']], ['CHECKLIST1'])
+            self.assertEqual(sorted(item['name'] for item in data['items']), ['ITEM1', 'ITEM2'])
+            self.assertFalse(data['more'])
+            self.assertFalse(data['reset'])
+
+            # nothing changed
+            data = http.get(flask.url_for('sync.changes', since=data['next']))
+            self.assertEqual(data['groups'] + data['checklists'] + data['items'] + data['deleted'], [])
+
+            # a changed item, its checklist and a deleted item
+            token = data['next']
+            time.sleep(0.01)
+            self.item1.info['checked'] = True
+            self.item1.save()
+            http.post(flask.url_for('checklists.bulk', _id=str(self.checklist.id())), data=[dict(op='delete', _id=str(self.item2.id()))])
+            data = http.get(flask.url_for('sync.changes', since=token))
+            self.assertEqual(data['groups'], [])
+            self.assertEqual([checklist['name'] for checklist in data['checklists']], ['CHECKLIST1'])
+            self.assertEqual(data['checklists'][0]['items'], [dict(_id=str(self.item1.id()))])
+            self.assertEqual([item['name'] for item in data['items']], ['ITEM1'])
+            self.assertEqual(data['deleted'], [dict(_id=str(self.item2.id()), collection='items')])
+
+            # private groups of other users are not returned
+            data = http.get(flask.url_for('sync.changes'), auth=['USER2', 'PASSWORD2'])
+            self.assertEqual([group['name'] for group in data['groups']], ['GROUP2'])
+
+    def test_private(self):
+        """ Test public elements that become private are deleted only for the other users """
+        group = self.user2.create_child({'name': 'GROUP3', 'private': False})
+        with self.client:
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+            http2 = HTTPHelper(self.client, ['USER2', 'PASSWORD2'])
+            data = http.get(flask.url_for('sync.changes'))
+            self.assertIn('GROUP3', [info['name'] for info in data['groups']])
+            token, token2 = data['next'], http2.get(flask.url_for('sync.changes'))['next']
+            time.sleep(0.01)
+            group.info['private'] = True
+            group.save()
+
+            data = http.get(flask.url_for('sync.changes', since=token))
+            self.assertEqual(data['groups'], [])
+            self.assertEqual(data['deleted'], [dict(_id=str(group.id()), collection='groups')])
+            data = http2.get(flask.url_for('sync.changes', since=token2))
+            self.assertEqual([info['name'] for info in data['groups']], ['GROUP3'])
+            self.assertEqual(data['deleted'], [])
+
+    def test_incremental(self):
+        """ Test a sync in several steps, with a limit """
+        with self.client:
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+            data = http.get(flask.url_for('sync.changes'))
+            token = data['next']
+            time.sleep(0.01)
+
+            for item in (self.item1, self.item2):
+                item.info['checked'] = True
+                item.save()
+
+            data = http.get(flask.url_for('sync.changes', since=token, limit=1))
+            self.assertTrue(data['more'])
+            self.assertEqual([item['name'] for item in data['items']], ['ITEM1'])
+            self.assertTrue(data['items'][0]['checked'])
+            self.assertEqual([checklist['name'] for checklist in data['checklists']], ['CHECKLIST1'])
+
+            data = http.get(flask.url_for('sync.changes', since=data['next'], limit=1))
+            self.assertFalse(data['more'])
+            self.assertEqual([item['name'] for item in data['items']], ['ITEM2'])
+            self.assertEqual(data['groups'] + data['checklists'] + data['deleted'], [])
+
+            # invalid tokens
+            data = http.get(flask.url_for('sync.changes', since='XXX'))
+            self.assertEqual(data.get('status', 0), 400)
+
+    def test_old_documents(self):
+        """ Test documents that did not change for longer than the tombstones are kept do not reset every sync """
+        old = project.model._now() - datetime.timedelta(days=project.model.TOMBSTONE_DAYS + 10)
+        for collection in ('groups', 'checklists', 'items'):
+            project.model.storage.update(collection, {}, {'$set': {'updated_at': old}}, multi=True)
+        with self.client:
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+            data = http.get(flask.url_for('sync.changes'))
+            self.assertEqual(len(data['items']), 2)
+            for _ in range(2):
+                data = http.get(flask.url_for('sync.changes', since=data['next']))
+                self.assertFalse(data['reset'])
+                self.assertEqual(data['groups'] + data['checklists'] + data['items'] + data['deleted'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
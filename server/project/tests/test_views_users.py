@@ -3,7 +3,7 @@ import flask
 import flask_testing
 import project.model
 import project.views
-from project.tests import HTTPHelper
+from project.tests import HTTPHelper, auth_header
 
 
 class TestUsersView(flask_testing.TestCase):
@@ -26,7 +26,7 @@ class TestUsersView(flask_testing.TestCase):
         self.user.create_child({'name': 'GROUP1'})
 
     def tearDown(self):
-        project.model.db.command('dropDatabase')
+        project.model.storage.drop()
 
 #    def test_availableusers(self):
 #        with self.client:
@@ -39,6 +39,22 @@ class TestUsersView(flask_testing.TestCase):
 #            self.assertTrue(len(data) == 1)
 #            self.assertTrue('name' in data[0] and data[0]['name'] == 'USER1')
 
+    def test_userspagination(self):
+        """ Test users are returned in pages, with a link to the next page """
+        for i in range(4):
+            project.model.create_user('OTHER{}'.format(i))
+        with self.client:
+            url = flask.url_for('users.available', limit=2)
+            names = []
+            while url is not None:
+                response = self.client.get(url, headers={'Authorization': auth_header('USER1', 'PASSWORD1')})
+                data = response.get_json()
+                self.assertTrue(len(data) <= 2)
+                names.extend(user['name'] for user in data)
+                link = response.headers.get('Link', None)
+                url = link[1:link.index('>')] if link else None
+            self.assertEqual(names, ['USER1', 'OTHER0', 'OTHER1', 'OTHER2', 'OTHER3'])
+
     def test_oneuser(self):
         with self.client:
             url = flask.url_for('users.info', _id=str(self.user.id()))
@@ -50,6 +66,37 @@ class TestUsersView(flask_testing.TestCase):
             self.assertFalse(project.model.PASSWORD_FIELDNAME in data)
             self.assertFalse('token' in data)
 
+    def test_usertree(self):
+        " Get the groups, checklists and items of a user in a single request "
+        group2 = self.user.create_child({'name': 'GROUP2', 'private': False})
+        checklist = group2.create_child({'name': 'CHECKLIST1'})
+        checklist.create_child({'name': 'ITEM1', 'checked': True})
+        checklist.create_child({'name': 'ITEM2'}, position=0)
+        project.model.create_user('USER2', 'PASSWORD2')
+
+        with self.client:
+            url = flask.url_for('users.tree', _id=str(self.user.id()))
+            http = HTTPHelper(self.client, ['USER1', 'PASSWORD1'])
+            data = http.get(url)
+            self.assertFalse('error_message' in data)
+            self.assertEqual([group['name'] for group in data['groups']], ['GROUP1', 'GROUP2'])
+            self.assertEqual(data['groups'][0]['checklists'], [])
+            checklist = data['groups'][1]['checklists'][0]
+            self.assertEqual(checklist['name'], 'CHECKLIST1')
+            self.assertEqual([item['name'] for item in checklist['items']], ['ITEM2', 'ITEM1'])
+            self.assertTrue(checklist['items'][1]['checked'])
+
+            # select depth and fields
+            data = http.get(flask.url_for('users.tree', _id=str(self.user.id()), depth=2, fields='name'))
+            checklist = data['groups'][1]['checklists'][0]
+            self.assertEqual(checklist['name'], 'CHECKLIST1')
+            self.assertFalse('items' in checklist)
+            self.assertFalse('private' in data['groups'][1])
+
+            # other users only get public groups
+            data = http.get(url, auth=['USER2', 'PASSWORD2'])
+            self.assertEqual([group['name'] for group in data['groups']], ['GROUP2'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -2,7 +2,14 @@ import project.views.users
 import project.views.groups
 import project.views.checklists
 import project.views.items
+import project.views.sync
+import project.views.events
+import project.views.jobs
+import project.jobs
 import project.server.auth
+import project.server.jsonprovider
+import project.server.passwords
+import project.server.events
 import flask
 
 
@@ -11,12 +18,17 @@ def get_blueprints(auth):
         project.views.users.get_blueprint(auth),
         project.views.groups.get_blueprint(auth),
         project.views.checklists.get_blueprint(auth),
-        project.views.items.get_blueprint(auth)
+        project.views.items.get_blueprint(auth),
+        project.views.sync.get_blueprint(auth),
+        project.views.events.get_blueprint(auth),
+        project.views.jobs.get_blueprint(auth)
     ]
 
 
 def register(app):
-    auth = project.server.auth.create_auth()
+    auth = project.server.auth.create_auth(app.config)
+    project.server.jsonprovider.install(app)
+    project.jobs.configure(app.config)
 
     for blueprint in get_blueprints(auth):
         app.register_blueprint(blueprint)
@@ -28,3 +40,10 @@ def register(app):
     @app.errorhandler(500)
     def error_handler(error):
         return flask.make_response(flask.jsonify({'error_message': str(error), 'status': error.code}))
+
+    @app.errorhandler(project.server.passwords.PoolFull)
+    @app.errorhandler(project.server.events.Unavailable)
+    def busy_handler(error):
+        response = flask.make_response(flask.jsonify({'error_message': str(error), 'status': 503}), 503)
+        response.headers['Retry-After'] = '1'
+        return response
@@ -3,6 +3,10 @@ import project.model as model
 from bson.objectid import ObjectId
 from bson.errors import InvalidId
 import datetime
+from project.views.streaming import stream_json
+from project.views.conditional import not_modified, with_etag
+from project.views.jobs import wants_async, accepted
+import project.jobs as jobs
 
 
 def get_blueprint(auth=None):
@@ -12,6 +16,11 @@ def get_blueprint(auth=None):
     blueprint.add_url_rule('/checklists/<_id>', view_func=auth.login_required(update_checklist), methods=['POST', 'PUT'], endpoint='update')
     blueprint.add_url_rule('/checklists/<_id>', view_func=auth.login_required(delete_checklist), methods=['DELETE'], endpoint='delete')
     blueprint.add_url_rule('/checklists/<_id>/clear', view_func=auth.login_required(clear_checklist), methods=['POST'], endpoint='clear')
+    blueprint.add_url_rule('/checklists/<_id>/check', view_func=auth.login_required(check_checklist), methods=['POST'], endpoint='check')
+    blueprint.add_url_rule('/checklists/<_id>/uncheck', view_func=auth.login_required(uncheck_checklist), methods=['POST'], endpoint='uncheck')
+    blueprint.add_url_rule('/checklists/<_id>/shift', view_func=auth.login_required(shift_checklist), methods=['POST'], endpoint='shift')
+    blueprint.add_url_rule('/checklists/<_id>/clear_due_dates', view_func=auth.login_required(clear_due_dates), methods=['POST'], endpoint='clear_due_dates')
+    blueprint.add_url_rule('/checklists/<_id>/items/bulk', view_func=auth.login_required(bulk_items), methods=['POST'], endpoint='bulk')
     blueprint.add_url_rule('/checklists/<_id>/duplicate', view_func=auth.login_required(duplicate_checklist), methods=['POST'], endpoint='duplicate')
     blueprint.add_url_rule('/checklists/today', view_func=auth.login_required(today_checklist), methods=['GET'], endpoint='today')
     blueprint.add_url_rule('/checklists/history', view_func=auth.login_required(history_checklist), methods=['GET'], endpoint='history')
@@ -23,6 +32,9 @@ def new_checklist():
     new_info = flask.request.json
     if not new_info or new_info is None:
         flask.abort(400, 'No information provided')
+    invalid = model.invalid_fields(new_info)
+    if invalid:
+        flask.abort(400, 'Invalid field names: {}'.format(', '.join(invalid)))
 
     # check the properties
     name = new_info.get('name', None)
@@ -48,7 +60,21 @@ def new_checklist():
         flask.abort(500, 'Error while saving new checklist')
 
 
+def _sane_item(item):
+    """ Adds the uri of an item document """
+    item['uri'] = flask.url_for('items.info', _id=item['_id'], _external=True)
+    return item
+
+
 def single_checklist(_id):
+    """ Returns a checklist with its items. Items are streamed as they are read, see stream_json()
+
+    The response has an ETag. If the If-None-Match header of the request matches the current
+    version of the checklist, a 304 response is returned without reading the items.
+    """
+    response = not_modified(model.Checklist, _id)
+    if response is not None:
+        return response
     checklist = model.search_element(model.Checklist, _id)
     # checl the list exists
     if checklist is None:
@@ -59,26 +85,25 @@ def single_checklist(_id):
 
     info = checklist.sane_info()
     info['uri'] = flask.url_for('checklists.info', _id=_id, _external=True)
+    items = info.pop('items', [])
 
-    # convert the items list to an Item list
-    new_items = []
-    if 'items' in info:
-        for item in info['items']:
+    def checklist_items():
+        # external items are read in batches, in the order of the checklist
+        external_ids = [item['_id'] for item in items if '_id' in item]
+        real_items = model.iter_documents(model.Item, external_ids)
+        for item in items:
             if '_id' in item:
                 # assume it is an external item
-                real_item = model.search_element(model.Item, item['_id'])
+                real_item = next(real_items)
                 if real_item is None:
-                    item_info = dict(name='NOT FOUND: {}'.format(str(item['_id'])), _id=str(item['_id']))
+                    yield dict(name='NOT FOUND: {}'.format(item['_id']), _id=item['_id'])
                 else:
-                    item_info = real_item.sane_info()
-                    item_info['uri'] = flask.url_for('items.info', _id=str(real_item.id()), _external=True)
-                new_items.append(item_info)
+                    yield _sane_item(real_item)
             else:
                 # item has no _id: assume it is an internal document.
-                new_items.append(item)
-        info['items'] = new_items
+                yield item
 
-    return flask.jsonify(info)
+    return with_etag(stream_json(checklist_items(), head=info), _id, checklist.info.get('version'))
 
 
 def update_checklist(_id):
@@ -92,6 +117,9 @@ def update_checklist(_id):
     new_info = flask.request.json
     if not new_info or new_info is None:
         flask.abort(400, 'No information')
+    invalid = model.invalid_fields(new_info)
+    if invalid:
+        flask.abort(400, 'Invalid field names: {}'.format(', '.join(invalid)))
 
     # is an array of items is passed, update only the Item IDs
     try:
@@ -103,7 +131,15 @@ def update_checklist(_id):
     except InvalidId:
         flask.abort(400, 'Invalid identifiers in the items array')
 
-    checklist.info.update(new_info)
+    # if the checklist is moved, check the user can edit the new group
+    if 'parentid' in new_info and str(new_info['parentid']) != str(checklist.info.get('parentid')):
+        group = model.search_element(model.Group, new_info['parentid'])
+        if group is None:
+            flask.abort(404, 'Group not found')
+        if not group.editable_by(flask.g.user_id):
+            flask.abort(401, 'You are not allowed to edit the new group')
+
+    checklist.update(new_info)
 
     if(checklist.save()):
         return single_checklist(_id)
@@ -112,6 +148,10 @@ def update_checklist(_id):
 
 
 def delete_checklist(_id):
+    """ Deletes a checklist and its items.
+
+    With the parameter async=1, only the checklist is deleted in the request. Its items are deleted
+    by a job and the response is 202 with the uri of the job """
     checklist = model.search_element(model.Checklist, _id)
     # check the checklist exists and it is editable by the current user
     if checklist is None:
@@ -119,142 +159,153 @@ def delete_checklist(_id):
     if not checklist.editable_by(flask.g.user_id):
         flask.abort(401, 'You are not allowed to edit this checklist')
 
-    # delete all items in the list
-    model.db.items.remove({'parentid': checklist.id()})
-
-    if checklist.delete():
-        return flask.jsonify({'status': 200, 'message': 'Checklist {} deleted'.format(_id)})
-    else:
-        flask.abort(500, 'Error while deleting checklist')
+    if wants_async():
+        checklist.delete()
+        job_id = jobs.enqueue('delete_checklist', dict(
+            checklist_id=str(checklist.id()), owner_id=str(checklist.owner_id()), private=checklist.is_private()),
+            flask.g.user_id)
+        return accepted(job_id)
+    model.delete_checklist(checklist)
+    return flask.jsonify({'status': 200, 'message': 'Checklist {} deleted'.format(_id)})
 
 # --------------------------------------- Actions
 
 
-def clear_checklist(_id):
-    """ Remove all done items """
+def _editable_checklist(_id):
+    """ Returns the checklist, or aborts if it doesn't exist or the current user cannot edit it """
     checklist = model.search_element(model.Checklist, _id)
-    # check the checklist exists and it is editable by the current user
     if checklist is None:
         flask.abort(404, 'Checklist not found')
     if not checklist.editable_by(flask.g.user_id):
         flask.abort(401, 'You are not allowed to edit this checklist')
+    return checklist
 
-    new_items = list()
-    # remove all done items
-    model.db.items.remove({'parentid': checklist.id(), 'checked': True})
-    for item in checklist.info.get('items', []):
-        # check if the items in the array still exist
-        if model.db.items.find_one({'_id': item['_id']}):
-            new_items.push(item)
-    checklist.info['items'] = new_items
-    checklist.save()
+
+def clear_checklist(_id):
+    """ Remove all done items """
+    checklist = _editable_checklist(_id)
+    model.clear_checklist(checklist)
     return single_checklist(_id)
 
 
-def duplicate_checklist(_id):
-    """ Duplicates a checklist """
-    checklist = model.search_element(model.Checklist, _id)
-    # check the checklist exists and it is editable by the current user
-    if checklist is None:
-        flask.abort(404, 'Checklist not found')
-    if not checklist.editable_by(flask.g.user_id):
-        flask.abort(401, 'You are not allowed to edit this checklist')
+def check_checklist(_id):
+    """ Checks all items in the checklist.
 
-    new_info = checklist.info.copy()
+    The done date of the items is today, or the parameter done_date """
+    checklist = _editable_checklist(_id)
+    new_info = flask.request.get_json(silent=True) or dict()
+    done_date = new_info.get('done_date', datetime.date.today().isoformat())
+    count = model.check_items(checklist, True, done_date)
+    return flask.jsonify({'status': 200, 'count': count})
 
-    # ignore these fields, if exist
-    new_info.pop('_id', None)
-    new_info.pop('items', None)
-
-    # duplicate the checklist and its items
-    new_checklist = checklist.parent().create_child(new_info)
-    for item in checklist.info.get('items', []):
-        if '_id' in item:
-            # it is an external document: duplicate the item
-            new_item = model.search_element(model.Item, item['_id'])
-            import pprint
-            pprint.pprint(new_item)
-            if new_item is not None:
-                new_checklist.create_child(new_item.info)
-        else:
-            # it is an internal item: create a new external item
-            new_checklist.create_child(item)
-
-    # save and return the new checklist
-    if(new_checklist.save()):
-        return single_checklist(checklist.id())
-    else:
-        flask.abort(500, 'Error while saving new checklist')
+
+def uncheck_checklist(_id):
+    """ Unchecks all items in the checklist """
+    checklist = _editable_checklist(_id)
+    count = model.check_items(checklist, False)
+    return flask.jsonify({'status': 200, 'count': count})
+
+
+def shift_checklist(_id):
+    """ Moves the due date of all items in the checklist the number of days in the parameter days """
+    checklist = _editable_checklist(_id)
+    new_info = flask.request.get_json(silent=True) or dict()
+    days = new_info.get('days', flask.request.args.get('days', None, type=int))
+    if type(days) != int:
+        flask.abort(400, 'The number of days is needed')
+    count = model.shift_due_dates(checklist, days)
+    return flask.jsonify({'status': 200, 'count': count})
+
+
+def clear_due_dates(_id):
+    """ Removes the due date of all items in the checklist """
+    checklist = _editable_checklist(_id)
+    count = model.clear_due_dates(checklist)
+    return flask.jsonify({'status': 200, 'count': count})
+
+
+def bulk_items(_id):
+    """ Creates, updates and deletes several items of a checklist at once.
+
+    The request is a list of operations: {"op": "create", "item": {...}}, {"op": "update", "_id": ..., "item": {...}}
+    or {"op": "delete", "_id": ...}. The response includes the result of each operation. """
+    checklist = _editable_checklist(_id)
+
+    operations = flask.request.json
+    if not operations or type(operations) != list:
+        flask.abort(400, 'A list of operations is needed')
+    if len(operations) > flask.current_app.config.get('BULK_MAX_OPERATIONS', 1000):
+        flask.abort(400, 'Too many operations')
+
+    results = model.bulk_items(checklist, operations)
+    return flask.jsonify({'status': 200, 'results': results})
+
+
+def duplicate_checklist(_id):
+    """ Duplicates a checklist and returns the new one.
+
+    With the parameter async=1, the checklist is duplicated by a job and the response is 202 with the uri
+    of the job and the uri the new checklist will have when the job is done """
+    checklist = _editable_checklist(_id)
+    if wants_async():
+        new_id = ObjectId()
+        job_id = jobs.enqueue('duplicate_checklist', dict(checklist_id=str(checklist.id()), new_id=str(new_id)), flask.g.user_id)
+        return accepted(job_id, checklist=flask.url_for('checklists.info', _id=str(new_id), _external=True))
+    new_checklist = model.duplicate_checklist(checklist)
+    return single_checklist(new_checklist.id())
 
 
 def today_checklist():
-    """Gets a special checklist with unchecked items with a due_date before a week from today. """
+    """Gets a special checklist with unchecked items with a due_date before a week from today.
 
-    to_date = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=7), datetime.time(0, 0, 0)).isoformat()[:10]
+    The number of days can be changed with the parameter `days` """
+
+    days = flask.request.args.get('days', 7, type=int)
+    to_date = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=days), datetime.time(0, 0, 0)).isoformat()[:10]
 
     checklist = {
         'name': 'Today',
         'description': 'Due items before {}'.format(to_date),
-        'hide_done_items': True,
-        'items': []
+        'hide_done_items': True
     }
 
-    groups = model.available_groups(flask.g.user_id)
-    for g in groups:
-        if '_id' not in g:
-            continue
-        checklists = model.available_checklists(g['_id'])
-        for c in checklists:
-            # checked not equal True also includes items without the checked field (default: checked=false)
-            # also, do not include empty due_date
-            filter = {'$and': [{'parentid': c['_id']}, {'checked': {'$not': {'$eq': True}}}, {'due_date': {'$gt': '', '$lt': to_date}}]}
-            if model.db.items.count_documents(filter) > 0:
-                items = model.db.items.find(filter)
-                checklist['items'].append({'name': '# {} # {}'.format(g['name'], c['name'])})
-                for i in items:
-                    if '_id' in i:
-                        i['_id'] = str(i['_id'])
-                    if 'parentid' in i:
-                        i['parentid'] = str(i['parentid'])
-                    i['uri'] = flask.url_for('items.info', _id=i['_id'], _external=True)
-                    checklist['items'].append(i)
-
-    return flask.jsonify(checklist)
+    # checked not equal True also includes items without the checked field (default: checked=false)
+    # also, do not include empty due_date
+    filter = {'checked': {'$not': {'$eq': True}}, 'due_date': {'$gt': '', '$lt': to_date}}
+
+    def today_items():
+        for c in model.checklist_items(flask.g.user_id, filter):
+            yield {'name': '# {} # {}'.format(c['name'], c['checklist']['name'])}
+            for i in c['items']:
+                yield _sane_item(i)
+
+    return stream_json(today_items(), head=checklist)
 
 
 def history_checklist():
-    """Gets a special checklist with checked items during the last week. """
+    """Gets a special checklist with checked items during the last week.
 
-    from_date = datetime.datetime.combine(datetime.date.today() - datetime.timedelta(days=7), datetime.time(0, 0, 0)).isoformat()[:10]
+    The number of days can be changed with the parameter `days` """
+
+    days = flask.request.args.get('days', 7, type=int)
+    from_date = datetime.datetime.combine(datetime.date.today() - datetime.timedelta(days=days), datetime.time(0, 0, 0)).isoformat()[:10]
 
     checklist = {
         'name': 'Today',
         'description': 'Completed items after {}'.format(from_date),
-        'hide_done_items': False,
-        'items': []
+        'hide_done_items': False
     }
 
-    groups = model.available_groups(flask.g.user_id)
-    for g in groups:
-        if '_id' not in g:
-            continue
-        checklists = model.available_checklists(g['_id'])
-        for c in checklists:
-            # checked not equal True also includes items without the checked field (default: checked=false)
-            # also, do not include empty due_date
-            filter = {'$and': [{'parentid': c['_id']}, {'checked': {'$not': True}}, {'done_date': {'$gte': from_date}}]}
-            if model.db.items.count_documents(filter) > 0:
-                items = model.db.items.find(filter)
-                checklist['items'].append({'name': '# {}'.format(c['name'])})
-                for i in items:
-                    if '_id' in i:
-                        i['_id'] = str(i['_id'])
-                    if 'parentid' in i:
-                        i['parentid'] = str(i['parentid'])
-                    i['uri'] = flask.url_for('items.info', _id=i['_id'], _external=True)
-                    i['_show_on'] = i['done_date']
-                    checklist['items'].append(i)
+    filter = {'checked': True, 'done_date': {'$gte': from_date}}
+
+    def history_items():
+        for c in model.checklist_items(flask.g.user_id, filter):
+            yield {'name': '# {}'.format(c['checklist']['name'])}
+            for i in c['items']:
+                i = _sane_item(i)
+                i['_show_on'] = i['done_date']
+                yield i
 
             # TODO: include recursive events
 
-    return flask.jsonify(checklist)
+    return stream_json(history_items(), head=checklist)
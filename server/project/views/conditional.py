@@ -0,0 +1,36 @@
+import flask
+import project.model as model
+from project.views.streaming import wants_ndjson
+
+
+def etag(element_id, version):
+    """ Returns the entity tag of the view of an element in a version """
+    tag = '{}-{}'.format(element_id, version or 0)
+    if wants_ndjson():
+        tag += '-ndjson'
+    return tag
+
+
+def not_modified(element_class, element_id):
+    """ Returns a 304 response if the If-None-Match header of the request matches the current version of an element.
+
+    Only the version and the fields needed to check the user can access the element are read.
+
+    Returns:
+        A flask.Response, or None if the full view of the element must be returned """
+    if not flask.request.if_none_match:
+        return None
+    version = model.visible_version(element_class, element_id, flask.g.user_id)
+    if version is None:
+        return None
+    tag = etag(element_id, version)
+    if not flask.request.if_none_match.contains(tag):
+        return None
+    return with_etag(flask.Response(status=304), element_id, version)
+
+
+def with_etag(response, element_id, version):
+    """ Sets the entity tag of the view of an element in a response, and returns the response """
+    response.set_etag(etag(element_id, version))
+    response.vary.add('Accept')
+    return response
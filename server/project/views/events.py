@@ -0,0 +1,54 @@
+import json
+import flask
+import project.server.auth
+import project.server.events as events
+
+
+def get_blueprint(auth=None):
+    blueprint = flask.Blueprint('events', __name__)
+    login_required = auth.login_required(stream)
+
+    def authenticated_stream():
+        # browsers cannot set headers in an EventSource: accept the token as a parameter too
+        token = flask.request.args.get('token', None)
+        if token is None:
+            return login_required()
+        user_id = project.server.auth.decode_auth_token(token)
+        if user_id is None:
+            return flask.make_response(flask.jsonify(dict(error_message='Unauthorized', status=401)))
+        flask.g.user_id = str(user_id)
+        return stream()
+
+    blueprint.add_url_rule('/events', view_func=authenticated_stream, methods=['GET'], endpoint='stream')
+    return blueprint
+
+
+def _format(event):
+    return 'event: {}\ndata: {}\n\n'.format(event['action'], json.dumps(event['data']))
+
+
+def stream():
+    """ Sends the changes in the elements the current user can see, as Server-Sent Events.
+
+    Events are `saved` and `deleted`, with data {"collection": ..., "_id": ..., "parentid": ...}.
+    A `reset` event means some events were lost: the client must reload its elements.
+    A comment is sent every EVENTS_HEARTBEAT seconds, so proxies do not close idle connections.
+    """
+    heartbeat = flask.current_app.config.get('EVENTS_HEARTBEAT', 15)
+    subscription = events.subscribe(flask.g.user_id)
+
+    def generate():
+        # the request context is not kept: it is not needed, and connections last for hours
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                event = subscription.get(timeout=heartbeat)
+                yield ': keepalive\n\n' if event is None else _format(event)
+        finally:
+            events.unsubscribe(subscription)
+
+    response = flask.Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # nginx must not buffer the events
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,5 +1,7 @@
 import flask
 import project.model as model
+from project.views.pagination import paginate
+from project.views.conditional import not_modified, with_etag
 
 
 def get_blueprint(auth=None):
@@ -22,6 +24,9 @@ def new_group():
     # check properties
     if not new_info or new_info is None:
         flask.abort(400, 'No information provided')
+    invalid = model.invalid_fields(new_info)
+    if invalid:
+        flask.abort(400, 'Invalid field names: {}'.format(', '.join(invalid)))
     name = new_info.get('name', None)
     if name is None:
         flask.abort(400, 'A group needs a name')
@@ -36,6 +41,18 @@ def new_group():
 
 
 def single_group(_id):
+    """ Returns a group and a page of its checklists.
+
+    Parameters:
+        limit: maximum number of checklists. By default and at most, PAGE_SIZE
+        after: token of the page. The url of the next page is in checklists_next, if any
+
+    The response has an ETag. If the If-None-Match header of the request matches the current
+    version of the group, a 304 response is returned.
+    """
+    response = not_modified(model.Group, _id)
+    if response is not None:
+        return response
     group = model.search_element(model.Group, _id)
     # check the group exists
     if group is None:
@@ -46,15 +63,20 @@ def single_group(_id):
 
     info = group.sane_info()
     checklists_info = list()
-    for c in model.available_checklists(_id):
+    page, next_url = paginate(
+        lambda limit, after: model.available_checklists(_id, limit=limit, after=after),
+        'groups.info', keys=('order', '_id'), _id=_id)
+    for c in page:
         checklist_info = dict()
-        checklist_info['_id'] = str(c['_id'])
-        checklist_info['name'] = str(c['name'])
+        checklist_info['_id'] = c['_id']
+        checklist_info['name'] = c['name']
         checklist_info['uri'] = flask.url_for('checklists.info', _id=checklist_info['_id'], _external=True)
         checklists_info.append(checklist_info)
     info['checklists'] = checklists_info
+    if next_url is not None:
+        info['checklists_next'] = next_url
     info['uri'] = flask.url_for('groups.info', _id=_id, _external=True)
-    return flask.jsonify(info)
+    return with_etag(flask.jsonify(info), _id, group.info.get('version'))
 
 
 def update_group(_id):
@@ -69,7 +91,10 @@ def update_group(_id):
     new_info = flask.request.json
     if not new_info or new_info is None:
         flask.abort(400, 'No information')
-    group.info.update(new_info)
+    invalid = model.invalid_fields(new_info)
+    if invalid:
+        flask.abort(400, 'Invalid field names: {}'.format(', '.join(invalid)))
+    group.update(new_info)
     if(group.save()):
         return single_group(_id)
     else:
@@ -86,7 +111,7 @@ def delete_group(_id):
         flask.abort(401, 'Not allowed to delete this group')
 
     # check the group is empty
-    if model.db.checklists.count({'parentid': group.id()}) > 0:
+    if model.storage.count('checklists', {'parentid': group.id()}) > 0:
         flask.abort(401, 'Group is not empty')
 
     if group.delete():
@@ -1,5 +1,6 @@
 import flask
 import project.model as model
+from project.views.conditional import not_modified, with_etag
 
 
 def get_blueprint(auth=None):
@@ -15,6 +16,9 @@ def new_item():
     new_info = flask.request.json
     if not new_info or new_info is None:
         flask.abort(400, 'No information provided')
+    invalid = model.invalid_fields(new_info)
+    if invalid:
+        flask.abort(400, 'Invalid field names: {}'.format(', '.join(invalid)))
 
     # check the properties
     name = new_info.get('name', None)
@@ -28,16 +32,19 @@ def new_item():
     checklist = model.search_element(model.Checklist, checklist_id)
     if checklist is None:
         flask.abort(404, 'Group not found')
+    if not checklist.editable_by(flask.g.user_id):
+        flask.abort(401, 'You are not allowed to edit this checklist')
 
-    # create the checklist
-    item = checklist.create_child(new_info)
-    if(checklist.save()):
-        return single_item(item.id())
-    else:
-        flask.abort(500, 'Error while saving new item')
+    # create the item. By default, it is appended to the checklist
+    position = flask.request.args.get('position', None, type=int)
+    item = checklist.create_child(new_info, position=position)
+    return single_item(item.id())
 
 
 def single_item(_id):
+    response = not_modified(model.Item, _id)
+    if response is not None:
+        return response
     item = model.search_element(model.Item, _id)
     # check the list exists
     if item is None:
@@ -48,7 +55,7 @@ def single_item(_id):
 
     info = item.sane_info()
     info['uri'] = flask.url_for('items.info', _id=_id, _external=True)
-    return flask.jsonify(info)
+    return with_etag(flask.jsonify(info), _id, item.info.get('version'))
 
 
 def update_item(_id):
@@ -62,11 +69,29 @@ def update_item(_id):
     new_info = flask.request.json
     if not new_info or new_info is None:
         flask.abort(400, 'No information')
-    item.info.update(new_info)
-    if(item.save()):
-        return single_item(_id)
-    else:
+    invalid = model.invalid_fields(new_info)
+    if invalid:
+        flask.abort(400, 'Invalid field names: {}'.format(', '.join(invalid)))
+
+    # if the item is moved, check the user can edit the new checklist
+    old_parentid = item.info.get('parentid')
+    checklist = None
+    if 'parentid' in new_info and str(new_info['parentid']) != str(old_parentid):
+        checklist = model.search_element(model.Checklist, new_info['parentid'])
+        if checklist is None:
+            flask.abort(404, 'Checklist not found')
+        if not checklist.editable_by(flask.g.user_id):
+            flask.abort(401, 'You are not allowed to edit the new checklist')
+
+    item.update(new_info)
+    if not item.save():
         flask.abort(500, 'Error while saving item')
+    if checklist is not None:
+        # move the item from the items of the old checklist to the new one
+        if old_parentid is not None:
+            model.detach_item(old_parentid, item.id())
+        model.attach_item(checklist.id(), item.id())
+    return single_item(_id)
 
 
 def delete_item(_id):
@@ -79,11 +104,8 @@ def delete_item(_id):
 
     # delete the item from the checklist
     if 'parentid' in item.info:
-        checklist = model.search_element(model.Checklist, item.info['parentid'])
-        if checklist is None:
-            flask.current_app.logger.error('Removing Item %s and checklist not found', _id)
-        elif not checklist.delete_child(_id):
-            flask.current_app.logger.error('Cannot remove Item %s from checklist %s', _id, checklist.id())
+        if not model.detach_item(item.info['parentid'], item.id()):
+            flask.current_app.logger.error('Cannot remove Item %s from checklist %s', _id, item.info['parentid'])
     else:
         flask.current_app.logger.error('Item %s doesn\'t belong to a checklist', _id)
 
@@ -0,0 +1,41 @@
+import flask
+import project.jobs as jobs
+
+
+def get_blueprint(auth=None):
+    blueprint = flask.Blueprint('jobs', __name__)
+    blueprint.add_url_rule('/jobs/<_id>', view_func=auth.login_required(single_job), methods=['GET'], endpoint='info')
+    return blueprint
+
+
+def wants_async():
+    """ Returns True if the request asks to run the operation as a job, with the parameter async """
+    return flask.request.args.get('async', '').lower() in ('1', 'true', 'yes')
+
+
+def accepted(job_id, **info):
+    """ Returns a 202 response for a new job, with its uri in the Location header """
+    info['status'] = 202
+    info['job'] = flask.url_for('jobs.info', _id=str(job_id), _external=True)
+    response = flask.make_response(flask.jsonify(info), 202)
+    response.headers['Location'] = info['job']
+    return response
+
+
+def single_job(_id):
+    """ Returns the status of a job: queued, running, done or failed.
+
+    Running jobs include their progress, finished jobs their result and failed jobs their error. """
+    job = jobs.get_job(_id)
+    if job is None:
+        flask.abort(404, 'Job not found')
+    if str(job['owner_id']) != str(flask.g.user_id):
+        flask.abort(401, 'Not allowed to access this job')
+
+    info = {key: job[key] for key in ('kind', 'status', 'attempts', 'created_at', 'updated_at') if key in job}
+    for key in ('progress', 'result', 'error'):
+        if key in job:
+            info[key] = job[key]
+    info['_id'] = job['_id']
+    info['uri'] = flask.url_for('jobs.info', _id=info['_id'], _external=True)
+    return flask.jsonify(info)
@@ -0,0 +1,34 @@
+import flask
+import project.model as model
+
+
+def page_args():
+    """ Returns the limit and after parameters of the request.
+
+    The limit is between 1 and PAGE_SIZE, and it is PAGE_SIZE by default """
+    page_size = flask.current_app.config.get('PAGE_SIZE', 1000)
+    limit = flask.request.args.get('limit', page_size, type=int)
+    return min(max(limit, 1), page_size), flask.request.args.get('after', None)
+
+
+def paginate(find, endpoint, keys=('_id', ), **values):
+    """ Returns a page of documents and the url of the next page.
+
+    Attrs:
+        find: a function with parameters limit and after that returns the documents
+        endpoint: endpoint of the url of the next page. values are its parameters
+        keys: the keys the documents are sorted by, as in model.page_token()
+
+    Returns:
+        (documents, next_url). next_url is None if this is the last page """
+    limit, after = page_args()
+    try:
+        # an extra document tells if there is a next page
+        documents = list(find(limit=limit + 1, after=after))
+    except ValueError as e:
+        flask.abort(400, str(e))
+    if len(documents) <= limit:
+        return documents, None
+    documents = documents[:limit]
+    next_url = flask.url_for(endpoint, limit=limit, after=model.page_token(documents[-1], keys), _external=True, **values)
+    return documents, next_url
@@ -0,0 +1,75 @@
+import flask
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# the serialized documents are sent in chunks of about this size, in characters
+CHUNK_SIZE = 16384
+
+
+def wants_ndjson():
+    """ Returns True if the client prefers NDJSON to JSON, from the Accept header """
+    best = flask.request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def _chunks(parts):
+    """ Joins small strings in chunks of about CHUNK_SIZE characters """
+    buffer = []
+    size = 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def _json_parts(documents, head, key):
+    dumps = flask.json.dumps
+    if head is None:
+        yield '['
+    else:
+        # the head without its closing brace, and the list as its last key
+        head = dumps(head)[:-1].rstrip()
+        yield '{}{}{}: ['.format(head, ', ' if head != '{' else '', dumps(key))
+    separator = ''
+    for document in documents:
+        yield separator
+        yield dumps(document)
+        separator = ', '
+    yield ']' if head is None else ']}'
+
+
+def _ndjson_parts(documents, head):
+    dumps = flask.json.dumps
+    if head is not None:
+        yield dumps(head) + '\n'
+    for document in documents:
+        yield dumps(document) + '\n'
+
+
+def stream_json(documents, head=None, key='items'):
+    """ Returns a response that serializes a list of documents while they are read.
+
+    The response is a JSON array, or NDJSON with a document in each line if the Accept header
+    of the request prefers application/x-ndjson.
+
+    Attrs:
+        documents: an iterable with the documents. It is consumed while sending the response,
+            in the context of the request
+        head: if not None, a dictionary. In JSON, the documents are the value of its key `key`.
+            In NDJSON, it is sent as the first line.
+        key: the key of the documents in head
+
+    Returns:
+        A flask.Response. Errors must be checked before calling this function: once the response
+        has started, they cannot be reported to the client """
+    if wants_ndjson():
+        parts = _ndjson_parts(documents, head)
+        mimetype = NDJSON_MIMETYPE
+    else:
+        parts = _json_parts(documents, head, key)
+        mimetype = 'application/json'
+    return flask.Response(flask.stream_with_context(_chunks(parts)), mimetype=mimetype)
@@ -0,0 +1,37 @@
+import flask
+import project.model as model
+
+
+def get_blueprint(auth=None):
+    blueprint = flask.Blueprint('sync', __name__)
+    blueprint.add_url_rule('/sync', view_func=auth.login_required(sync), methods=['GET'], endpoint='changes')
+    return blueprint
+
+
+def sync():
+    """ Returns the groups, checklists and items that the current user can access that changed since the last sync:
+    the ones of the user and the public ones of every user.
+
+    Parameters:
+        since: the token `next` of the previous response. Without it, all the elements are returned
+        limit: maximum number of elements of each type. By default and at most, PAGE_SIZE.
+            If there are more, `more` is true: ask again with the `next` token
+
+    The response includes the identifiers of the deleted elements in `deleted`, and of the public elements
+    of other users that became private. Remove them before applying the other changes. If `reset` is true,
+    the token was too old: all the elements are returned and any other element must be removed.
+    """
+    page_size = flask.current_app.config.get('PAGE_SIZE', 1000)
+    limit = min(max(flask.request.args.get('limit', page_size, type=int), 1), page_size)
+    try:
+        changes = model.sync(
+            flask.g.user_id, since=flask.request.args.get('since', None), limit=limit,
+            delay=flask.current_app.config.get('SYNC_DELAY', 0))
+    except ValueError as e:
+        flask.abort(400, str(e))
+
+    for endpoint, name in (('groups.info', 'groups'), ('checklists.info', 'checklists'), ('items.info', 'items')):
+        for info in changes[name]:
+            info['uri'] = flask.url_for(endpoint, _id=info['_id'], _external=True)
+    changes['status'] = 200
+    return flask.jsonify(changes)
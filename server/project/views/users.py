@@ -1,12 +1,15 @@
 import flask
 import project.model as model
 import project.server.auth
+from project.views.pagination import paginate
+from project.views.streaming import stream_json
 
 
 def get_blueprint(auth=None):
     blueprint = flask.Blueprint('users', __name__)
     blueprint.add_url_rule('/users/', view_func=auth.login_required(users), methods=['GET'], endpoint='available')
     blueprint.add_url_rule('/users/<_id>', view_func=auth.login_required(single_user), methods=['GET'], endpoint='info')
+    blueprint.add_url_rule('/users/<_id>/tree', view_func=auth.login_required(user_tree), methods=['GET'], endpoint='tree')
     blueprint.add_url_rule('/login', view_func=auth.login_required(login), methods=['GET'], endpoint='login')
 
     return blueprint
@@ -22,16 +25,32 @@ def login():
 
 
 def users():
-    available_users = list()
-    for user in model.available_users():
-        info = user.copy()
-        info['_id'] = str(info['_id'])
-        info['uri'] = flask.url_for('users.info', _id=info['_id'], _external=True)
-        available_users.append(info)
-    return flask.jsonify(available_users)
+    """ Returns a page of the available users, streamed as a JSON array or NDJSON.
+
+    Parameters:
+        limit: maximum number of users. By default and at most, PAGE_SIZE
+        after: token of the page. The url of the next page is in the Link header, if any
+    """
+    page, next_url = paginate(model.available_users, 'users.available')
+
+    def available_users():
+        for user in page:
+            user['uri'] = flask.url_for('users.info', _id=user['_id'], _external=True)
+            yield user
+
+    response = stream_json(available_users())
+    if next_url is not None:
+        response.headers['Link'] = '<{}>; rel="next"'.format(next_url)
+    return response
 
 
 def single_user(_id):
+    """ Returns a user and a page of its groups.
+
+    Parameters:
+        limit: maximum number of groups. By default and at most, PAGE_SIZE
+        after: token of the page. The url of the next page is in groups_next, if any
+    """
     user = model.search_element(model.User, _id)
     if user is None:
         flask.abort(404)
@@ -39,11 +58,49 @@ def single_user(_id):
     groups_info = list()
     only_public = (str(_id) != flask.g.user_id)
 
-    for g in model.available_groups(_id, only_public=only_public):
-        group_info = g.copy()
-        group_info['_id'] = str(g['_id'])
-        group_info['uri'] = flask.url_for('groups.info', _id=group_info['_id'], _external=True)
-        groups_info.append(group_info)
+    page, next_url = paginate(
+        lambda limit, after: model.available_groups(_id, only_public=only_public, limit=limit, after=after),
+        'users.info', _id=_id)
+    for g in page:
+        g['uri'] = flask.url_for('groups.info', _id=g['_id'], _external=True)
+        groups_info.append(g)
     info['groups'] = groups_info
+    if next_url is not None:
+        info['groups_next'] = next_url
     info['uri'] = flask.url_for('users.info', _id=_id, _external=True)
     return flask.jsonify(info)
+
+
+def user_tree(_id):
+    """ Returns the groups of a user with their checklists and items, in a single response.
+
+    Parameters:
+        depth: 1 for only groups, 2 for groups and checklists, 3 (default) for groups, checklists and items
+        fields: a comma separated list of the fields to return. By default, all fields
+    """
+    user = model.search_element(model.User, _id)
+    if user is None:
+        flask.abort(404)
+    depth = min(max(flask.request.args.get('depth', 3, type=int), 1), 3)
+    fields = flask.request.args.get('fields', None)
+    if fields is not None:
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    only_public = (str(_id) != flask.g.user_id)
+
+    def sane(info, endpoint):
+        if '_id' in info:
+            info['uri'] = flask.url_for(endpoint, _id=info['_id'], _external=True)
+        return info
+
+    groups = model.user_tree(user.id(), only_public=only_public, depth=depth, fields=fields)
+    for group in groups:
+        sane(group, 'groups.info')
+        for checklist in group.get('checklists', []):
+            sane(checklist, 'checklists.info')
+            for item in checklist.get('items', []):
+                sane(item, 'items.info')
+
+    info = user.summary()
+    info['groups'] = groups
+    info['uri'] = flask.url_for('users.tree', _id=_id, _external=True)
+    return flask.jsonify(info)